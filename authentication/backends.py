@@ -0,0 +1,53 @@
+from rest_framework import authentication
+from rest_framework import exceptions
+from . import jsonwebtokens
+
+
+class TokenUser:
+    """
+    Lightweight user built from the JWT payload, so that authenticating
+    a request does not need a database query
+    id: <UUID> user id (None for tokens issued before it was added)
+    role: <admin | dentist | patient>
+    name: <String>
+    phonenumber: <BigInt>
+    """
+
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, payload):
+        self.id = payload.get("user_id")
+        self.role = payload.get("role")
+        self.name = payload.get("name")
+        self.phonenumber = payload.get("phonenumber")
+
+    def __str__(self):
+        return self.name
+
+
+class JWTAuthentication(authentication.BaseAuthentication):
+    """
+    Decodes "Authorization: Bearer <token>" once per request
+    - request.user: TokenUser
+    - request.auth: verified JWT payload
+    1. No Authorization header: request stays unauthenticated
+    2. Malformed header or invalid/expired JWT: 401 UNAUTHORIZED
+    """
+
+    keyword = "Bearer"
+
+    def authenticate(self, request):
+        header = authentication.get_authorization_header(request).split()
+        if not header:
+            return None
+        if len(header) != 2:
+            raise exceptions.AuthenticationFailed("Invalid JWT")
+
+        payload, error = jsonwebtokens.is_authorized(header[1].decode("utf-8"))
+        if error:
+            raise exceptions.AuthenticationFailed(error)
+        return TokenUser(payload), payload
+
+    def authenticate_header(self, request):
+        return self.keyword
@@ -0,0 +1,11 @@
+from rest_framework.views import exception_handler
+
+
+def error_exception_handler(exc, context):
+    """
+    Same as DRF's handler but keeps the {"error": ...} shape of the views
+    """
+    response = exception_handler(exc, context)
+    if response is not None and "detail" in response.data:
+        response.data = {"error": response.data["detail"]}
+    return response
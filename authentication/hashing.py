@@ -0,0 +1,71 @@
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import bcrypt
+import os
+import threading
+
+# ==============================NOTE====================================
+# bcrypt runs on its own size-capped thread pool so that a burst of logins
+# cannot tie up every server worker. Once WORKERS are busy and MAX_QUEUE
+# more are waiting, new requests are rejected with PoolSaturated and the
+# views answer 503 with a Retry-After of RETRY_AFTER seconds.
+WORKERS = int(os.getenv("BCRYPT_WORKERS", 4))
+MAX_QUEUE = int(os.getenv("BCRYPT_MAX_QUEUE", 16))
+RETRY_AFTER = 2
+
+_executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="bcrypt")
+_lock = threading.Lock()
+_stats = {"in_flight": 0, "running": 0, "completed": 0, "rejected": 0}
+
+
+class PoolSaturated(Exception):
+    pass
+
+
+def pool_stats():
+    """
+    Returns workers, max_queue, queue_depth (waiting for a worker),
+    running, completed and rejected
+    """
+    with _lock:
+        return {
+            "workers": WORKERS,
+            "max_queue": MAX_QUEUE,
+            "queue_depth": _stats["in_flight"] - _stats["running"],
+            "running": _stats["running"],
+            "completed": _stats["completed"],
+            "rejected": _stats["rejected"],
+        }
+
+
+def _track_running(fn, *args):
+    with _lock:
+        _stats["running"] += 1
+    try:
+        return fn(*args)
+    finally:
+        with _lock:
+            _stats["running"] -= 1
+
+
+async def _run(fn, *args):
+    with _lock:
+        if _stats["in_flight"] >= WORKERS + MAX_QUEUE:
+            _stats["rejected"] += 1
+            raise PoolSaturated()
+        _stats["in_flight"] += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_executor, _track_running, fn, *args)
+    finally:
+        with _lock:
+            _stats["in_flight"] -= 1
+            _stats["completed"] += 1
+
+
+async def hashpw(password: bytes, salt: bytes) -> bytes:
+    return await _run(bcrypt.hashpw, password, salt)
+
+
+async def checkpw(password: bytes, hashed_password: bytes) -> bool:
+    return await _run(bcrypt.checkpw, password, hashed_password)
@@ -1,17 +1,36 @@
 import jwt
+from collections import OrderedDict
 from datetime import datetime, timezone, timedelta
+import hashlib
+import threading
+import time
 import os
 
 key = os.getenv("JWT_KEY")
 
+# ==============================NOTE====================================
+# Verified payloads are cached per process, keyed by the token's digest.
+# Entries are dropped when the token's "exp" passes or when the cache is
+# full (least recently used first).
+CACHE_SIZE = 1024
 
-def create_jwt(role, phonenumber, name):
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+
+def create_jwt(role, phonenumber, name, user_id=None):
+    """
+    - user_id (User.id) lets views use primary-key lookups, tokens issued
+    before it was added don't carry it so it is not a required claim
+    """
     ist_tz = timezone(timedelta(hours=5, minutes=30))
     encoded = jwt.encode(
         {
             "role": role,
             "phonenumber": phonenumber,
             "name": name,
+            "user_id": str(user_id) if user_id else None,
             "iat": datetime.now(tz=ist_tz),
             "exp": datetime.now(tz=ist_tz) + timedelta(days=7),
         },
@@ -21,7 +40,67 @@ def create_jwt(role, phonenumber, name):
     return encoded
 
 
-def is_authorized(token, permitted_roles=None):
+def token_digest(token):
+    return hashlib.sha256(token.encode("utf-8")).digest()
+
+
+def fetch_cached_payload(digest):
+    """
+    1. Not cached: returns None, None
+    2. Cached but expired: evicts it, returns None, error
+    3. Cached: returns payload, None
+    """
+    with _cache_lock:
+        entry = _cache.get(digest)
+        if entry is None:
+            _cache_stats["misses"] += 1
+            return None, None
+        payload, expires_at = entry
+        if expires_at <= time.time():
+            del _cache[digest]
+            _cache_stats["expired"] += 1
+            return None, "JWT has expired"
+        _cache.move_to_end(digest)
+        _cache_stats["hits"] += 1
+        return payload, None
+
+
+def cache_payload(digest, payload):
+    with _cache_lock:
+        _cache[digest] = (payload, payload["exp"])
+        _cache.move_to_end(digest)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+            _cache_stats["evictions"] += 1
+
+
+def cache_stats():
+    """
+    Returns hits, misses, evictions, expired and current size of the cache
+    """
+    with _cache_lock:
+        stats = dict(_cache_stats)
+        stats["size"] = len(_cache)
+    return stats
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
+        for stat in _cache_stats:
+            _cache_stats[stat] = 0
+
+
+def decode_jwt(token):
+    """
+    Verifies the token (signature + required claims) and returns its payload
+    - Cached payloads are returned without running jwt.decode again
+    """
+    digest = token_digest(token)
+    payload, error = fetch_cached_payload(digest)
+    if payload or error:
+        return payload, error
+
     try:
         payload = jwt.decode(
             token,
@@ -35,6 +114,15 @@ def is_authorized(token, permitted_roles=None):
         return None, "JWT is missing required claims"
     except jwt.DecodeError:
         return None, "Invalid JWT"
+
+    cache_payload(digest, payload)
+    return payload, None
+
+
+def is_authorized(token, permitted_roles=None):
+    payload, error = decode_jwt(token)
+    if error:
+        return None, error
     if permitted_roles:
         if payload.get("role") not in permitted_roles:
             return None, "You are unauthorized"
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from authentication import models
+
+
+class Command(BaseCommand):
+    help = (
+        "Backfill User.normalized_name and User.phonenumber_text "
+        "for users saved before they existed"
+    )
+
+    def handle(self, *args, **kwargs):
+        users = []
+        for user in models.User.objects.only(
+            "id", "name", "normalized_name", "phonenumber", "phonenumber_text"
+        ):
+            normalized_name = models.normalize_name(user.name)
+            phonenumber_text = str(user.phonenumber)
+            if (
+                user.normalized_name != normalized_name
+                or user.phonenumber_text != phonenumber_text
+            ):
+                user.normalized_name = normalized_name
+                user.phonenumber_text = phonenumber_text
+                users.append(user)
+        models.User.objects.bulk_update(
+            users, ["normalized_name", "phonenumber_text"], batch_size=500
+        )
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Successfully backfilled {len(users)} users")
+        )
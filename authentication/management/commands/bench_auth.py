@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from authentication import jsonwebtokens
+import time
+
+
+class Command(BaseCommand):
+    help = "Benchmark per-request JWT authorization with and without the cache"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=10000)
+
+    def handle(self, *args, **kwargs):
+        requests = kwargs["requests"]
+        token = jsonwebtokens.create_jwt(
+            role="dentist", phonenumber=9999999999, name="Bench Mark"
+        )
+        roles = set(["dentist", "admin"])
+
+        # Uncached: every request runs the full jwt.decode
+        start = time.perf_counter()
+        for _ in range(requests):
+            jsonwebtokens.clear_cache()
+            jsonwebtokens.is_authorized(token, roles)
+        uncached = (time.perf_counter() - start) / requests
+
+        # Cached: only the first request decodes
+        jsonwebtokens.clear_cache()
+        start = time.perf_counter()
+        for _ in range(requests):
+            jsonwebtokens.is_authorized(token, roles)
+        cached = (time.perf_counter() - start) / requests
+
+        stats = jsonwebtokens.cache_stats()
+        self.stdout.write(f"Requests: {requests}")
+        self.stdout.write(f"Uncached: {uncached * 1_000_000:.2f} us/request")
+        self.stdout.write(f"Cached:   {cached * 1_000_000:.2f} us/request")
+        self.stdout.write(f"Speedup:  {uncached / cached:.1f}x")
+        self.stdout.write(
+            f"Hits: {stats["hits"]}, Misses: {stats["misses"]}, Size: {stats["size"]}"
+        )
+        self.stdout.write(self.style.SUCCESS("Auth benchmark finished"))
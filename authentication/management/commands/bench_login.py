@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from authentication import hashing
+import asyncio
+import bcrypt
+import time
+
+
+class Command(BaseCommand):
+    help = "Benchmark login password checks (bcrypt pool) against concurrency"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--logins", type=int, default=64)
+        parser.add_argument(
+            "--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64]
+        )
+
+    def handle(self, *args, **kwargs):
+        password = b"A1plain_text_password"
+        hashed_password = bcrypt.hashpw(password, bcrypt.gensalt())
+        self.stdout.write(
+            f"Workers: {hashing.WORKERS}, Max queue: {hashing.MAX_QUEUE}, "
+            f"Logins per level: {kwargs["logins"]}"
+        )
+        self.stdout.write("Concurrency | Logins/s | Accepted | Rejected (503)")
+        for concurrency in kwargs["concurrency"]:
+            accepted, rejected, elapsed = asyncio.run(
+                self.run_level(password, hashed_password, kwargs["logins"], concurrency)
+            )
+            self.stdout.write(
+                f"{concurrency:>11} | {accepted / elapsed:>8.1f} | "
+                f"{accepted:>8} | {rejected:>14}"
+            )
+        self.stdout.write(self.style.SUCCESS("Login benchmark finished"))
+
+    async def run_level(self, password, hashed_password, logins, concurrency):
+        accepted, rejected = 0, 0
+        remaining = logins
+
+        async def client():
+            nonlocal accepted, rejected, remaining
+            while remaining > 0:
+                remaining -= 1
+                try:
+                    await hashing.checkpw(password, hashed_password)
+                    accepted += 1
+                except hashing.PoolSaturated:
+                    rejected += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        return accepted, rejected, time.perf_counter() - start
@@ -1,19 +1,31 @@
+from django.contrib.postgres.indexes import GinIndex
 from django.db import models
 
 # Create your models here.
 import uuid
 
-
 # ==============================NOTE====================================
 # Foreign key names are getting an added "_id" at the end of their names
 
 
+def normalize_name(name):
+    """
+    Casing and whitespace insensitive form of a name
+    eg: "  john   DOE" -> "john doe"
+    """
+    return " ".join(name.split()).casefold()
+
+
 class User(models.Model):
     """
     id: <UUID> user id
     role: <UUID> whether doctor, admin or patient
     name: <String>
+    normalized_name: <String> normalize_name(name), maintained on save
     phonenumber: <BigInt>
+    phonenumber_text: <String> str(phonenumber), maintained on save (prefix search)
+    - bulk_create, bulk_update and queryset update() skip save(), set
+    normalized_name and phonenumber_text along with name/phonenumber
     password: <String>
     active: <Bool>
     """
@@ -28,14 +40,49 @@ class User(models.Model):
         max_length=10, choices=RoleChoices.choices, default=RoleChoices.PATIENT
     )
     name = models.CharField(max_length=50)
+    # "C": ordered by code point, like patient pages built in memory
+    normalized_name = models.CharField(
+        max_length=50, db_index=True, editable=False, default="", db_collation="C"
+    )
     phonenumber = models.BigIntegerField()
+    phonenumber_text = models.CharField(max_length=20, editable=False, default="")
     password = models.TextField(blank=True)
     active = models.BooleanField(default=True)
 
     class Meta:
         db_table = "credentials"
         constraints = [
+            # identity lookups go by (phonenumber, normalized_name), its
+            # index also serves them
             models.UniqueConstraint(
-                fields=["name", "phonenumber"], name="unique_phone+name"
+                fields=["phonenumber", "normalized_name"],
+                name="unique_phone+normalized_name",
             )
         ]
+        indexes = [
+            # LIKE 'prefix%' on phonenumber_text for the phonenumber typeahead
+            models.Index(
+                fields=["phonenumber_text"],
+                opclasses=["text_pattern_ops"],
+                name="phonenumber_text_pattern_idx",
+            ),
+            # pg_trgm index for the fuzzy patient search (patient/search.py)
+            GinIndex(
+                fields=["normalized_name"],
+                opclasses=["gin_trgm_ops"],
+                name="normalized_name_trgm_idx",
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.normalized_name = normalize_name(self.name)
+        self.phonenumber_text = str(self.phonenumber)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            update_fields = set(update_fields)
+            if "name" in update_fields:
+                update_fields.add("normalized_name")
+            if "phonenumber" in update_fields:
+                update_fields.add("phonenumber_text")
+            kwargs["update_fields"] = update_fields
+        super().save(*args, **kwargs)
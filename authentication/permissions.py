@@ -0,0 +1,42 @@
+from rest_framework import exceptions
+from rest_framework import permissions
+
+
+class RolePermission(permissions.BasePermission):
+    """
+    Allows the request only if the JWT role is permitted for the HTTP method
+    - roles: roles permitted for every method
+    - method_roles: overrides roles for particular methods
+    1. Token missing: 401 UNAUTHORIZED
+    2. Role not permitted: 401 UNAUTHORIZED
+    """
+
+    roles = set()
+    method_roles = {}
+
+    def has_permission(self, request, view):
+        permitted_roles = self.method_roles.get(request.method, self.roles)
+        if request.auth is None:
+            raise exceptions.AuthenticationFailed("Authorization token missing")
+        # AuthenticationFailed instead of returning False, clients expect a 401
+        if permitted_roles and request.auth.get("role") not in permitted_roles:
+            raise exceptions.AuthenticationFailed("You are unauthorized")
+        return True
+
+
+class IsAuthenticatedRole(RolePermission):
+    """
+    Any valid JWT, regardless of role
+    """
+
+
+class IsDentist(RolePermission):
+    roles = set(["dentist"])
+
+
+class IsDentistOrAdmin(RolePermission):
+    roles = set(["dentist", "admin"])
+
+
+class IsPatient(RolePermission):
+    roles = set(["patient"])
@@ -1,6 +1,6 @@
+from django.db import IntegrityError
 from . import models
 from . import validation
-from patient import services as patient_services
 from rest_framework import status
 
 
@@ -23,7 +23,7 @@ def set_empty_password(userData, role):
     try:
 
         user = models.User.objects.get(
-            name=patient_services.capitalize_name(userData.get("name")),
+            normalized_name=models.normalize_name(userData.get("name")),
             phonenumber=userData.get("phonenumber"),
         )
     except models.User.DoesNotExist:
@@ -45,6 +45,7 @@ def set_new_phonenumber(userData, role):
     2. Check if user is valid
     3. Admin only reset patient's number
     4. Validate new phonenumber
+    5. Same name already registered with the new phonenumber
     - returns error and status
     """
     is_valid_phonenumber: validation.FieldValidity = validation.validate_phonenumber(
@@ -73,7 +74,7 @@ def set_new_phonenumber(userData, role):
 
     try:
         user = models.User.objects.get(
-            name=patient_services.capitalize_name(userData.get("name")),
+            normalized_name=models.normalize_name(userData.get("name")),
             phonenumber=userData.get("old_phonenumber"),
         )
     except models.User.DoesNotExist:
@@ -85,5 +86,11 @@ def set_new_phonenumber(userData, role):
             status.HTTP_401_UNAUTHORIZED,
         )
     user.phonenumber = userData.get("new_phonenumber")
-    user.save()
+    try:
+        user.save()
+    except IntegrityError:
+        return (
+            "Account exists for this name and new phonenumber",
+            status.HTTP_409_CONFLICT,
+        )
     return None, None
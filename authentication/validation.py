@@ -24,6 +24,24 @@ def validate_phonenumber(phonenumber: int) -> FieldValidity:
     return {"error": None, "valid": True}
 
 
+def validate_phonenumber_prefix(prefix: int) -> FieldValidity:
+    """
+    First few digits of a phonenumber (typeahead)
+    1. At most 10 digits long
+    2. Startswith 6, 7, 8 or 9
+    """
+    phone: str = str(prefix)
+    starting_numbers = set([6, 7, 8, 9])
+
+    if len(phone) > 10:
+        return {"error": "Phonenumber is longer than 10 digits", "valid": False}
+
+    if int(phone[0]) not in starting_numbers:
+        return {"error": "Phonenumber should start with 6, 7, 8, 9", "valid": False}
+
+    return {"error": None, "valid": True}
+
+
 def validate_password(password: str) -> FieldValidity:
     """
     Validates the password based on the following criteria:
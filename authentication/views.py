@@ -1,24 +1,44 @@
 from authentication.serializers import CredentialSerializer
 from rest_framework.response import Response
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework import permissions
 from rest_framework import status
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from . import models
 from . import validation
 from . import services
 from . import serializers
+from . import hashing
 from . import jsonwebtokens
+from . import permissions as app_permissions
 from patient import services as patient_services
-import bcrypt
+import json
 import os
 
 SALT = os.getenv("SALT")
 SALT_BYTES = bytes(SALT, "utf-8")
 
 
-@api_view(["POST"])
-@permission_classes((permissions.AllowAny,))
-def signup(request):
+def parse_json_body(request):
+    try:
+        return json.loads(request.body or b"{}"), None
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return None, "Invalid JSON"
+
+
+def pool_saturated_response():
+    response = JsonResponse(
+        {"error": "Too many requests right now, try again in a few seconds"},
+        status=status.HTTP_503_SERVICE_UNAVAILABLE,
+    )
+    response["Retry-After"] = str(hashing.RETRY_AFTER)
+    return response
+
+
+@csrf_exempt
+@require_POST
+async def signup(request):
     # TODO: Add password validation here aklfja;fajfklj
     """
     Allows users who have their details stored to create a password for them\n
@@ -28,6 +48,7 @@ def signup(request):
     4. Already registered: 409 CONFLICT
     5. Password validation fail: 400 BAD REQUEST
     6. Successful registration: 201 CREATED
+    7. Hashing pool saturated: 503 SERVICE UNAVAILABLE (with Retry-After)
 
     Flow:\n
     - Admin first creates a `User` object in database and keeps password field empty
@@ -45,66 +66,71 @@ def signup(request):
     }
     ```
     """
-    if request.method == "POST":
-        # Case 1
-        serializer = CredentialSerializer(data=request.data)
-        if not serializer.is_valid():
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    # Case 1
+    data, error = parse_json_body(request)
+    if error:
+        return JsonResponse({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+    serializer = CredentialSerializer(data=data)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-        # Case 2
-        is_valid_phonenumber: validation.FieldValidity = (
-            validation.validate_phonenumber(serializer.data["phonenumber"])
+    # Case 2
+    is_valid_phonenumber: validation.FieldValidity = validation.validate_phonenumber(
+        serializer.data["phonenumber"]
+    )
+    if not is_valid_phonenumber["valid"]:
+        return JsonResponse(
+            {"error": is_valid_phonenumber["error"]},
+            status=status.HTTP_400_BAD_REQUEST,
         )
-        if not is_valid_phonenumber["valid"]:
-            return Response(
-                {"error": is_valid_phonenumber["error"]},
-                status=status.HTTP_400_BAD_REQUEST,
-            )
-
-        # Case 3
-        try:
-            user_object = models.User.objects.get(
-                phonenumber=serializer.data["phonenumber"],
-                name=patient_services.capitalize_name(serializer.data["name"]),
-            )
-        except models.User.DoesNotExist:
-            return Response(
-                {"error": "User is not registered by admin"},
-                status=status.HTTP_404_NOT_FOUND,
-            )
 
-        # Case 4
-        if user_object.password != "":
-            return Response(
-                {"error": "Password already set for this user"},
-                status=status.HTTP_409_CONFLICT,
-            )
+    # Case 3
+    try:
+        user_object = await models.User.objects.aget(
+            phonenumber=serializer.data["phonenumber"],
+            normalized_name=models.normalize_name(serializer.data["name"]),
+        )
+    except models.User.DoesNotExist:
+        return JsonResponse(
+            {"error": "User is not registered by admin"},
+            status=status.HTTP_404_NOT_FOUND,
+        )
 
-        # Case 5
-        is_valid_password: validation.FieldValidity = validation.validate_password(
-            serializer.data["password"]
+    # Case 4
+    if user_object.password != "":
+        return JsonResponse(
+            {"error": "Password already set for this user"},
+            status=status.HTTP_409_CONFLICT,
         )
-        if not is_valid_password["valid"]:
-            return Response(
-                {"error": is_valid_password["error"]},
-                status=status.HTTP_400_BAD_REQUEST,
-            )
 
-        # Case 6
-        bytes_password: bytes = bytes(serializer.data["password"], "utf-8")
-        hashed_password: bytes = bcrypt.hashpw(bytes_password, SALT_BYTES)
-        password_to_store: str = hashed_password.decode("utf-8")
-        user_object.password = password_to_store
-        user_object.save()
-        return Response(
-            {"message": "Signup successful!"},
-            status=status.HTTP_201_CREATED,
+    # Case 5
+    is_valid_password: validation.FieldValidity = validation.validate_password(
+        serializer.data["password"]
+    )
+    if not is_valid_password["valid"]:
+        return JsonResponse(
+            {"error": is_valid_password["error"]},
+            status=status.HTTP_400_BAD_REQUEST,
         )
 
+    # Case 6 (Case 7 if bcrypt pool is full)
+    bytes_password: bytes = bytes(serializer.data["password"], "utf-8")
+    try:
+        hashed_password: bytes = await hashing.hashpw(bytes_password, SALT_BYTES)
+    except hashing.PoolSaturated:
+        return pool_saturated_response()
+    password_to_store: str = hashed_password.decode("utf-8")
+    user_object.password = password_to_store
+    await user_object.asave()
+    return JsonResponse(
+        {"message": "Signup successful!"},
+        status=status.HTTP_201_CREATED,
+    )
 
-@api_view(["POST"])
-@permission_classes((permissions.AllowAny,))
-def login(request):
+
+@csrf_exempt
+@require_POST
+async def login(request):
     """
     Allows the user to login to their account\n
     1. Some form field is empty, invalid etc: returns 400 BAD REQUEST
@@ -113,6 +139,7 @@ def login(request):
     4. Registered but first signup pending: returns 409 CONFLICT
     5. Incorrect credentials: returns 409 CONFLICT
     6. Correct credentials: returns 200 OK
+    7. Hashing pool saturated: 503 SERVICE UNAVAILABLE (with Retry-After)
 
     Expected JSON:\n
     `{
@@ -121,70 +148,76 @@ def login(request):
         "password": "A1plain_text_password"
     }`
     """
+    # Case 1
+    data, error = parse_json_body(request)
+    if error:
+        return JsonResponse({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+    serializer = CredentialSerializer(data=data)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-    if request.method == "POST":
-        # Case 1
-        serializer = CredentialSerializer(data=request.data)
-        if not serializer.is_valid():
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-
-        # Case 2
-        is_valid_phonenumber: validation.FieldValidity = (
-            validation.validate_phonenumber(serializer.data["phonenumber"])
+    # Case 2
+    is_valid_phonenumber: validation.FieldValidity = validation.validate_phonenumber(
+        serializer.data["phonenumber"]
+    )
+    if not is_valid_phonenumber["valid"]:
+        return JsonResponse(
+            {"error": is_valid_phonenumber["error"]},
+            status=status.HTTP_400_BAD_REQUEST,
         )
-        if not is_valid_phonenumber["valid"]:
-            return Response(
-                {"error": is_valid_phonenumber["error"]},
-                status=status.HTTP_400_BAD_REQUEST,
-            )
 
-        # Case 3
-        probe_users = models.User.objects.filter(
-            phonenumber=serializer.data["phonenumber"]
+    # Case 3
+    probe_users = await models.User.objects.filter(
+        phonenumber=serializer.data["phonenumber"]
+    ).aexists()
+    if not probe_users:
+        return JsonResponse(
+            {"error": "Phonenumber isn't registered by admin"},
+            status=status.HTTP_404_NOT_FOUND,
         )
-        if not probe_users:
-            return Response(
-                {"error": "Phonenumber isn't registered by admin"},
-                status=status.HTTP_404_NOT_FOUND,
-            )
 
-        # Case 4
-        try:
-            stored_user = models.User.objects.get(
-                phonenumber=serializer.data["phonenumber"],
-                name=patient_services.capitalize_name(serializer.data["name"]),
-            )
-        except models.User.DoesNotExist:
-            return Response(
-                {"error": "Phonenumber not registered with this name. Register again."},
-                status=status.HTTP_404_NOT_FOUND,
-            )
-        if stored_user.password == "":
-            return Response(
-                {"error": "You haven't set up your password. Signup first!"},
-                status=status.HTTP_409_CONFLICT,
-            )
+    # Case 4
+    try:
+        stored_user = await models.User.objects.aget(
+            phonenumber=serializer.data["phonenumber"],
+            normalized_name=models.normalize_name(serializer.data["name"]),
+        )
+    except models.User.DoesNotExist:
+        return JsonResponse(
+            {"error": "Phonenumber not registered with this name. Register again."},
+            status=status.HTTP_404_NOT_FOUND,
+        )
+    if stored_user.password == "":
+        return JsonResponse(
+            {"error": "You haven't set up your password. Signup first!"},
+            status=status.HTTP_409_CONFLICT,
+        )
 
-        # Case 5
-        password: bytes = bytes(serializer.data["password"], "utf-8")
-        hashed_password: bytes = bytes(stored_user.password, "utf-8")
+    # Case 5 (Case 7 if bcrypt pool is full)
+    password: bytes = bytes(serializer.data["password"], "utf-8")
+    hashed_password: bytes = bytes(stored_user.password, "utf-8")
 
-        if not bcrypt.checkpw(password, hashed_password):
-            return Response(
-                {"error": "Incorrect password"}, status=status.HTTP_409_CONFLICT
-            )
-        # Case 6
-        jwt = jsonwebtokens.create_jwt(
-            role=stored_user.role,
-            phonenumber=serializer.data["phonenumber"],
-            name=patient_services.capitalize_name(serializer.data["name"]),
+    try:
+        is_correct_password = await hashing.checkpw(password, hashed_password)
+    except hashing.PoolSaturated:
+        return pool_saturated_response()
+    if not is_correct_password:
+        return JsonResponse(
+            {"error": "Incorrect password"}, status=status.HTTP_409_CONFLICT
         )
+    # Case 6
+    jwt = jsonwebtokens.create_jwt(
+        role=stored_user.role,
+        phonenumber=serializer.data["phonenumber"],
+        name=patient_services.capitalize_name(serializer.data["name"]),
+        user_id=stored_user.id,
+    )
 
-        return Response({"token": jwt}, status=status.HTTP_201_CREATED)
+    return JsonResponse({"token": jwt}, status=status.HTTP_201_CREATED)
 
 
 @api_view(["POST"])
-@permission_classes((permissions.AllowAny,))
+@permission_classes((app_permissions.IsDentistOrAdmin,))
 def password_reprompt(request):
     """
     In case patient forgets their password, admin and doctor can reset their password
@@ -196,15 +229,6 @@ def password_reprompt(request):
         "phoenumber": "7777777777",
     }
     """
-    # JWT authentication
-    token, error = jsonwebtokens.is_authorized(
-        request.headers["Authorization"].split(" ")[1], set(["dentist", "admin"])
-    )
-    if error:
-        return Response(
-            {"error": error},
-            status=status.HTTP_401_UNAUTHORIZED,
-        )
     if request.method == "POST":
         serialized_data, error = patient_services.serialize_identity(request.data)
         if error:
@@ -213,7 +237,7 @@ def password_reprompt(request):
                 status=status.HTTP_400_BAD_REQUEST,
             )
         error, status_code = services.set_empty_password(
-            serialized_data, token.get("role")
+            serialized_data, request.auth.get("role")
         )
         if error:
             return Response(
@@ -228,17 +252,8 @@ def password_reprompt(request):
 
 
 @api_view(["POST"])
-@permission_classes((permissions.AllowAny,))
+@permission_classes((app_permissions.IsDentistOrAdmin,))
 def change_phonenumber(request):
-    # JWT authentication
-    token, error = jsonwebtokens.is_authorized(
-        request.headers["Authorization"].split(" ")[1], set(["dentist", "admin"])
-    )
-    if error:
-        return Response(
-            {"error": error},
-            status=status.HTTP_401_UNAUTHORIZED,
-        )
     if request.method == "POST":
         phone_reset_serializer = serializers.PhoneResetSerializer(data=request.data)
         if not phone_reset_serializer.is_valid():
@@ -247,7 +262,7 @@ def change_phonenumber(request):
                 status=status.HTTP_400_BAD_REQUEST,
             )
         error, status_code = services.set_new_phonenumber(
-            phone_reset_serializer.data, token.get("role")
+            phone_reset_serializer.data, request.auth.get("role")
         )
         if error:
             return Response(
@@ -0,0 +1,66 @@
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+import hashlib
+
+# ==============================NOTE====================================
+# Conditional GETs for the endpoints the dashboard keeps polling.
+# - A view builds its ETag from validators that are cheap to get, never from
+#   the body: the row count/latest updated_at of the rows it returns (one
+#   aggregate over an index range), read from the database so every server
+#   process agrees on them
+# - If-None-Match/If-Modified-Since still matching -> 304 NOT MODIFIED, the
+#   body isn't queried or serialized at all
+# - Day lists and the dashboard also show patients' names and ages (and
+#   followups their complaint), their validators take in those joined rows
+#   too (patient/services.py entry_validators)
+
+
+def aggregate(queryset, field=None, **extra):
+    """
+    Row count and latest value of field (when given) in one query
+    - extra (along with field): more aggregates, eg: over joined rows, their
+    values follow in the order given
+    """
+    if field is None:
+        return queryset.count(), None
+    result = queryset.aggregate(count=Count("pk"), latest=Max(field), **extra)
+    return (result["count"], result["latest"], *(result[key] for key in extra))
+
+
+def make_etag(*validators):
+    digest = hashlib.sha256(repr(validators).encode("utf-8")).hexdigest()
+    return quote_etag(digest[:32])
+
+
+def headers(etag=None, last_modified=None):
+    """
+    Validators to send along with the 200
+    - no-cache: clients may keep the body but have to revalidate it
+    """
+    response_headers = {"Cache-Control": "private, no-cache"}
+    if etag:
+        response_headers["ETag"] = etag
+    if last_modified:
+        response_headers["Last-Modified"] = http_date(last_modified.timestamp())
+    return response_headers
+
+
+def not_modified(request, etag=None, last_modified=None):
+    """
+    1. Validators of the request still match: 304 NOT MODIFIED (with the
+    validators again)
+    2. If-Match/If-Unmodified-Since failed: 412 PRECONDITION FAILED
+    3. Otherwise None, the view builds the body
+    """
+    response = get_conditional_response(
+        request,
+        etag=etag,
+        last_modified=int(last_modified.timestamp()) if last_modified else None,
+    )
+    if response is None:
+        return None
+    if response.status_code == 304:
+        for header, value in headers(etag, last_modified).items():
+            response[header] = value
+    return response
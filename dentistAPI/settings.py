@@ -40,6 +40,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "django_celery_beat",
     "rest_framework",
     "authentication",
@@ -65,15 +66,19 @@ ROOT_URLCONF = "dentistAPI.urls"
 
 
 REST_FRAMEWORK = {
-    # Use Django's standard `django.contrib.auth` permissions,
-    # or allow read-only access for unauthenticated users.
+    # JWT is decoded once per request by JWTAuthentication (payload in request.auth)
+    # and views pick the roles they allow through authentication.permissions
     "DEFAULT_RENDERER_CLASSES": [
         "rest_framework.renderers.BrowsableAPIRenderer",
         "rest_framework.renderers.JSONRenderer",
     ],
+    "DEFAULT_AUTHENTICATION_CLASSES": [
+        "authentication.backends.JWTAuthentication",
+    ],
     "DEFAULT_PERMISSION_CLASSES": [
-        "rest_framework.permissions.DjangoModelPermissionsOrAnonReadOnly"
+        "authentication.permissions.IsAuthenticatedRole",
     ],
+    "EXCEPTION_HANDLER": "authentication.exceptions.error_exception_handler",
 }
 
 
@@ -111,6 +116,23 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# Defaults to a per-process cache, set CACHE_BACKEND/CACHE_LOCATION to a
+# shared one (eg: django.core.cache.backends.redis.RedisCache) when serving
+# from several processes, the doctor catalog's version stamp and the cached
+# timelines are then shared too
+
+CACHES = {
+    "default": {
+        "BACKEND": os.getenv(
+            "CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"
+        ),
+        "LOCATION": os.getenv("CACHE_LOCATION", ""),
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -164,6 +186,9 @@ CORS_ALLOWED_ORIGINS = [
     # Add other allowed origins as needed
 ]
 
+# Serve front desk patient lookups from a process-local directory (patient/directory.py)
+PATIENT_DIRECTORY = os.getenv("PATIENT_DIRECTORY", "False") == "True"
+
 WHATSAPP_API_URL = os.getenv("WHATSAPP_API_URL")
 WHATSAPP_ACCESS_TOKEN = os.getenv("WHATSAPP_ACCESS_TOKEN")
 
@@ -0,0 +1,166 @@
+from django.core.cache import cache
+from django.db import transaction
+from dentistAPI import conditional
+from . import models
+import threading
+import time
+import uuid
+
+# ==============================NOTE====================================
+# Treatments and prescriptions (medications) change rarely but are read on
+# every diagnosis/prescription write, so each process keeps them in memory.
+# - The catalog carries the version stamp it was loaded at, the stamp lives
+#   in the default cache (shared between processes when CACHES is)
+# - Create/update/delete of a treatment or prescription bumps the stamp once
+#   committed (signals.py), every process reloads on its next lookup
+# - A catalog older than CATALOG_TTL seconds reloads too: a write made by
+#   another process reaches this one even when the cache isn't shared
+# - An id or name the catalog doesn't have is checked against the database
+#   validators before it's reported missing, a row just created by another
+#   process is found right away (reload only when the validators moved)
+# - Writes that skip signals (bulk_create, queryset update) must call
+#   bump_version themselves
+# - GETs of the catalog check it against validators read from the
+#   database (fetch_validators), their ETags never follow a stale catalog
+# - Instances handed out are shared, callers must not modify them
+VERSION_KEY = "doctor_catalog_version"
+CATALOG_TTL = 60
+
+
+def fetch_version():
+    """
+    - Missing stamp (never set or evicted) starts from the current time so it
+    can't match a catalog loaded before
+    """
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def fetch_validators():
+    """
+    Row count and latest updated_at of treatments and of prescriptions
+    """
+    return (
+        conditional.aggregate(models.Treatment.objects.all(), "updated_at"),
+        conditional.aggregate(models.Prescription.objects.all(), "updated_at"),
+    )
+
+
+def bump_version():
+    """
+    Once the write commits, a cache error is logged and doesn't fail the
+    write (catalogs still reload within CATALOG_TTL)
+    """
+
+    def bump():
+        try:
+            cache.incr(VERSION_KEY)
+        except ValueError:
+            cache.set(VERSION_KEY, time.time_ns(), timeout=None)
+
+    transaction.on_commit(bump, robust=True)
+
+
+class Catalog:
+    """
+    treatments: id -> Treatment
+    treatments_by_name: name -> Treatment
+    prescriptions: id -> Prescription (ordered by type, name)
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.validators = None
+        self.loaded_at = 0
+        self.treatments = {}
+        self.treatments_by_name = {}
+        self.prescriptions = {}
+
+    def current(self, validators=None):
+        """
+        Reloads (validators, then one query per table) when the version
+        stamp moved, the catalog is older than CATALOG_TTL or validators
+        (from fetch_validators) differ from the ones it was loaded with
+        """
+        version = fetch_version()
+        with self.lock:
+            if (
+                version != self.version
+                or time.monotonic() - self.loaded_at > CATALOG_TTL
+                or (validators is not None and validators != self.validators)
+            ):
+                # read first, a write landing during the load reloads again
+                self.validators = fetch_validators()
+                treatments = list(models.Treatment.objects.order_by("name"))
+                prescriptions = list(
+                    models.Prescription.objects.order_by("type", "name")
+                )
+                self.treatments = {treatment.id: treatment for treatment in treatments}
+                self.treatments_by_name = {
+                    treatment.name: treatment for treatment in treatments
+                }
+                self.prescriptions = {
+                    prescription.id: prescription for prescription in prescriptions
+                }
+                self.version = version
+                self.loaded_at = time.monotonic()
+            return self
+
+    def lookup(self, table, keys):
+        """
+        Entries of table ("treatments", "treatments_by_name", "prescriptions")
+        for the keys that exist, a miss reloads once if the database moved
+        """
+        entries = getattr(self.current(), table)
+        if any(key not in entries for key in keys):
+            entries = getattr(self.current(fetch_validators()), table)
+        return {key: entries[key] for key in keys if key in entries}
+
+    def treatment(self, treatment_id):
+        return self.treatments_in([treatment_id]).get(to_uuid(treatment_id))
+
+    def treatment_by_name(self, name):
+        return self.lookup("treatments_by_name", [name]).get(name)
+
+    def treatments_in(self, treatment_ids):
+        """
+        Like in_bulk: id -> Treatment for the ids that exist
+        """
+        return self.lookup("treatments", set(map(to_uuid, treatment_ids)))
+
+    def all_treatments(self):
+        return [
+            {"id": treatment.id, "name": treatment.name, "price": treatment.price}
+            for treatment in self.current().treatments.values()
+        ]
+
+    def all_prescriptions(self):
+        """
+        Prescriptions ordered by type then name
+        """
+        return list(self.current().prescriptions.values())
+
+    def prescription(self, prescription_id):
+        return self.prescriptions_in([prescription_id]).get(to_uuid(prescription_id))
+
+    def prescriptions_in(self, prescription_ids):
+        """
+        Like in_bulk: id -> Prescription for the ids that exist
+        """
+        return self.lookup("prescriptions", set(map(to_uuid, prescription_ids)))
+
+
+def to_uuid(value):
+    if isinstance(value, uuid.UUID):
+        return value
+    try:
+        return uuid.UUID(str(value))
+    except ValueError:
+        return None
+
+
+catalog = Catalog()
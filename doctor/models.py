@@ -7,11 +7,13 @@ class Treatment(models.Model):
     id: <UUID>
     name: <String>
     price: <Integer>
+    updated_at: <DateTime> every save, null for rows saved before it existed
     """
 
     id = models.UUIDField(primary_key=True, default=uuid.uuid4)
     name = models.TextField(unique=True)
     price = models.IntegerField()
+    updated_at = models.DateTimeField(auto_now=True, null=True)
 
     class Meta:
         db_table = "treatments"
@@ -22,11 +24,13 @@ class Prescription(models.Model):
     id: <UUID>
     name: <String>
     type: <String>
+    updated_at: <DateTime> every save, null for rows saved before it existed
     """
 
     id = models.UUIDField(primary_key=True, default=uuid.uuid4)
     name = models.TextField(unique=True)
     type = models.TextField()
+    updated_at = models.DateTimeField(auto_now=True, null=True)
 
     class Meta:
         db_table = "prescriptions"
@@ -1,3 +1,4 @@
+from . import catalog
 from . import models
 from patient import services as patient_services
 from django.db import IntegrityError
@@ -37,16 +38,17 @@ def delete_prescription_by_id(prescription_id):
     return name, None
 
 
-def fetch_structured_prescriptions():
+def fetch_structured_prescriptions(validators=None):
+    """
+    Prescriptions grouped by type: {type: [{id, name}]}
+    - built from the catalog (one query ordered by type, name when it loads)
+    - validators: catalog.fetch_validators() the response's ETag is built
+    from, the catalog reloads if it doesn't match them
+    """
     structured_prescriptions = {}
-    types = list(models.Prescription.objects.all().values_list("type").distinct())
-    for prescription_type in types:
-        # returns a tuple i.e why ("medication",)[0] = "medication"
-        prescription_type = prescription_type[0]
-        structured_prescriptions[prescription_type] = (
-            models.Prescription.objects.filter(type=prescription_type).values(
-                "id", "name"
-            )
+    for prescription in catalog.catalog.current(validators).all_prescriptions():
+        structured_prescriptions.setdefault(prescription.type, []).append(
+            {"id": prescription.id, "name": prescription.name}
         )
     return structured_prescriptions
 
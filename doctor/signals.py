@@ -0,0 +1,15 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from . import catalog
+from . import models
+
+# Every committed treatment/prescription write bumps the catalog's version,
+# whether it comes from the views, the admin or the populate_* commands
+
+
+@receiver(post_save, sender=models.Treatment)
+@receiver(post_delete, sender=models.Treatment)
+@receiver(post_save, sender=models.Prescription)
+@receiver(post_delete, sender=models.Prescription)
+def change_catalog(sender, instance, **kwargs):
+    catalog.bump_version()
@@ -1,9 +1,9 @@
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework import permissions
 from rest_framework.response import Response
 from rest_framework import status
-import authentication.jsonwebtokens as jsonwebtokens
-from . import models
+import authentication.permissions as app_permissions
+from dentistAPI import conditional
+from . import catalog
 from . import serializers
 from . import services
 
@@ -11,10 +11,12 @@ from . import services
 
 
 @api_view(["GET", "POST", "DELETE", "PUT"])
-@permission_classes((permissions.AllowAny,))
+@permission_classes((app_permissions.IsDentist,))
 def treatments(request, treatment_id=None):
     """
     1. GET: Fetch all treatments
+    - sends an ETag, If-None-Match with it gets 304 NOT MODIFIED until the
+    catalog changes
     2. POST: Add new treatment
     Expected JSON:
     {
@@ -32,19 +34,15 @@ def treatments(request, treatment_id=None):
         }
     }
     """
-    # JWT authentication
-    token, error = jsonwebtokens.is_authorized(
-        request.headers["Authorization"].split(" ")[1], set(["dentist"])
-    )
-    if error:
-        return Response(
-            {"error": error},
-            status=status.HTTP_401_UNAUTHORIZED,
-        )
-
     if request.method == "GET":
-        treatments = models.Treatment.objects.all().values()
-        return Response({"treatments": treatments})
+        # ETag follows the rows in the database, unchanged catalog -> 304
+        validators = catalog.fetch_validators()
+        etag = conditional.make_etag("treatments", validators)
+        not_modified = conditional.not_modified(request, etag=etag)
+        if not_modified:
+            return not_modified
+        treatments = catalog.catalog.current(validators).all_treatments()
+        return Response({"treatments": treatments}, headers=conditional.headers(etag))
 
     if request.method == "DELETE":
         if treatment_id:
@@ -96,10 +94,12 @@ def treatments(request, treatment_id=None):
 
 
 @api_view(["GET", "POST", "DELETE", "PUT"])
-@permission_classes((permissions.AllowAny,))
+@permission_classes((app_permissions.IsDentist,))
 def prescriptions(request, prescription_id=None):
     """
-    1. GET: Fetch all prescriptions
+    1. GET: Fetch all prescriptions, grouped by type
+    - sends an ETag, If-None-Match with it gets 304 NOT MODIFIED until the
+    catalog changes
     2. POST: Add new prescriptions
     Expected JSON:
     {
@@ -116,20 +116,18 @@ def prescriptions(request, prescription_id=None):
         }
     }
     """
-    # JWT authentication
-    token, error = jsonwebtokens.is_authorized(
-        request.headers["Authorization"].split(" ")[1], set(["dentist"])
-    )
-    if error:
+    if request.method == "GET":
+        # ETag follows the rows in the database, unchanged catalog -> 304
+        validators = catalog.fetch_validators()
+        etag = conditional.make_etag("prescriptions", validators)
+        not_modified = conditional.not_modified(request, etag=etag)
+        if not_modified:
+            return not_modified
+        prescriptions = services.fetch_structured_prescriptions(validators)
         return Response(
-            {"error": error},
-            status=status.HTTP_401_UNAUTHORIZED,
+            {"prescriptions": prescriptions}, headers=conditional.headers(etag)
         )
 
-    if request.method == "GET":
-        prescriptions = services.fetch_structured_prescriptions()
-        return Response({"prescriptions": prescriptions})
-
     if request.method == "DELETE":
         if prescription_id:
             name, error = services.delete_prescription_by_id(prescription_id)
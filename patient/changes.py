@@ -0,0 +1,193 @@
+from django.db import connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from authentication.models import User
+from . import models
+from .pagination import encode_cursor
+
+# ==============================NOTE====================================
+# Delta sync for terminals on flaky connections (changes/?since=<cursor>).
+# - A trigger on every synced table logs each insert, update and delete in
+#   the transaction that makes it, so bulk writes, admin edits and cascades
+#   are logged and a change can't be lost between the write and its log
+# - The changes table only keeps the latest change of a record, logging a
+#   change drops the older ones, it grows with records not with writes
+# - Pages are read in (transaction, id) order and only hold changes of
+#   transactions older than every one still running (pg_current_snapshot),
+#   a change committed later always sorts after a cursor already handed out
+# - since missing on a database that had records before the log: run
+#   manage.py backfill_changes once so every record is in it
+CHANGES_LIMIT = 500
+# cursor: transaction and id of the last change sent
+CHANGES_CURSOR = (int, int)
+
+Table = models.Change.Table
+# table -> model, fields sent for its rows (never the password)
+SYNC_TABLES = {
+    Table.CREDENTIALS: (User, ("role", "name", "phonenumber", "active")),
+    Table.PATIENT_DETAILS: (
+        models.Details,
+        (
+            "date_of_birth",
+            "address",
+            "gender",
+            "allergies",
+            "illnesses",
+            "smoking",
+            "drinking",
+            "tobacco",
+            "created_at",
+            "updated_at",
+        ),
+    ),
+    Table.COMPLAINTS: (
+        models.Complaint,
+        (
+            "user_id",
+            "complaint",
+            "description",
+            "date",
+            "time",
+            "created_at",
+            "updated_at",
+        ),
+    ),
+    Table.FOLLOWUPS: (
+        models.FollowUp,
+        (
+            "complaint_id",
+            "date",
+            "time",
+            "title",
+            "description",
+            "completed",
+            "number",
+            "created_at",
+            "updated_at",
+        ),
+    ),
+    Table.DIAGNOSIS: (
+        models.Diagnosis,
+        (
+            "complaint_id",
+            "tooth_number",
+            "treatment_id",
+            "price",
+            "created_at",
+            "updated_at",
+        ),
+    ),
+    Table.PATIENT_PRESCRIPTIONS: (
+        models.PatientPrescription,
+        (
+            "complaint_id",
+            "sitting",
+            "prescription_id",
+            "days",
+            "dosage",
+            "created_at",
+            "updated_at",
+        ),
+    ),
+    Table.DISCOUNTS: (
+        models.Discount,
+        ("discount", "created_at", "updated_at"),
+    ),
+}
+TABLE_OF = {model: table for table, (model, _) in SYNC_TABLES.items()}
+
+
+LOG_FUNCTION = """
+CREATE OR REPLACE FUNCTION log_change() RETURNS trigger AS $$
+DECLARE
+    changed_id uuid;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        changed_id := (to_jsonb(OLD) ->> TG_ARGV[1])::uuid;
+    ELSE
+        changed_id := (to_jsonb(NEW) ->> TG_ARGV[1])::uuid;
+    END IF;
+    DELETE FROM {changes} WHERE "table" = TG_ARGV[0]::smallint
+        AND row_id = changed_id;
+    INSERT INTO {changes} ("table", row_id, deleted)
+        VALUES (TG_ARGV[0]::smallint, changed_id, TG_OP = 'DELETE');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+LOG_TRIGGER = """
+DROP TRIGGER IF EXISTS log_change ON {table};
+CREATE TRIGGER log_change AFTER INSERT OR UPDATE OR DELETE
+ON {table} FOR EACH ROW EXECUTE FUNCTION log_change('{code}', '{pk}')
+"""
+# every change after the cursor, of transactions that are all finished
+SETTLED = RawSQL("pg_snapshot_xmin(pg_current_snapshot())::text::bigint", [])
+
+
+def install_triggers(using="default"):
+    """
+    Runs after every migrate (signals.py), skipped until the tables exist
+    """
+    connection = connections[using]
+    tables = connection.introspection.table_names()
+    if models.Change._meta.db_table not in tables:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(LOG_FUNCTION.format(changes=models.Change._meta.db_table))
+        for table, (model, _) in SYNC_TABLES.items():
+            if model._meta.db_table not in tables:
+                continue
+            cursor.execute(
+                LOG_TRIGGER.format(
+                    table=connection.ops.quote_name(model._meta.db_table),
+                    code=table.value,
+                    pk=model._meta.pk.column,
+                )
+            )
+
+
+def fetch_changes(cursor_values, limit=CHANGES_LIMIT):
+    """
+    Changes after the cursor, oldest first, with the current row of every
+    record that wasn't deleted (one query per table)
+    - cursor_values: [transaction, id] of the last change sent, None for all
+    Returns changes, cursor (to send next, same as given if no changes), more
+    """
+    page = models.Change.objects.filter(transaction__lt=SETTLED)
+    if cursor_values:
+        transaction_id, change_id = cursor_values
+        page = page.filter(
+            Q(transaction__gt=transaction_id)
+            | Q(transaction=transaction_id, id__gt=change_id)
+        )
+    page = list(page.order_by("transaction", "id")[: limit + 1])
+    more = len(page) > limit
+    page = page[:limit]
+
+    row_ids = {}
+    for change in page:
+        if not change.deleted:
+            row_ids.setdefault(change.table, []).append(change.row_id)
+    rows = {}
+    for table, ids in row_ids.items():
+        model, fields = SYNC_TABLES[table]
+        for row in model.objects.filter(pk__in=ids).values("pk", *fields):
+            rows[(table, row.pop("pk"))] = row
+
+    changes = []
+    for change in page:
+        row = rows.get((change.table, change.row_id))
+        changes.append(
+            {
+                "table": SYNC_TABLES[change.table][0]._meta.db_table,
+                "id": change.row_id,
+                # deleted since the change was logged
+                "deleted": row is None,
+                "row": row,
+            }
+        )
+    if page:
+        cursor = encode_cursor([page[-1].transaction, page[-1].id])
+    else:
+        cursor = encode_cursor(cursor_values) if cursor_values else None
+    return changes, cursor, more
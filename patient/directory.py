@@ -0,0 +1,204 @@
+from collections import defaultdict
+from django.conf import settings
+from authentication.models import User
+import sys
+import threading
+import time
+
+# ==============================NOTE====================================
+# Process-local directory of patients (credentials joined with
+# patient_details) for the front desk searches.
+# - Loaded lazily on first lookup, reloaded after DIRECTORY_TTL seconds so
+#   writes made by other server processes show up eventually
+# - Writes in this process are applied right away through signals.py
+# - Serves phonenumber and name lookups when settings.PATIENT_DIRECTORY is
+#   on, name search always uses it on databases without pg_trgm
+# - Pages of a phonenumber lookup are ordered like the database's: names
+#   compare by code point in Python and in the "C" collation of
+#   credentials.normalized_name, so a cursor works with either
+DIRECTORY_TTL = 300
+DIRECTORY_FIELDS = ("id", "name", "phonenumber", "date_of_birth")
+
+
+def enabled():
+    return getattr(settings, "PATIENT_DIRECTORY", False)
+
+
+def trigrams(text):
+    """
+    Same trigrams as pg_trgm: every word padded with two spaces in front
+    and one at the back
+    eg: "jo" -> {"  j", " jo", "jo "}
+    """
+    grams = set()
+    for word in text.split():
+        padded = f"  {word} "
+        for i in range(len(padded) - 2):
+            grams.add(padded[i : i + 3])
+    return grams
+
+
+class PatientDirectory:
+    """
+    entries: id -> {id, name, normalized_name, phonenumber, date_of_birth}
+    by_phone: phonenumber -> ids
+    postings: trigram of normalized_name -> ids
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.entries = None
+        self.by_phone = None
+        self.postings = None
+        self.loaded_at = 0
+        self.stats = {"hits": 0, "misses": 0, "loads": 0}
+
+    def load(self):
+        self.entries, self.by_phone, self.postings = (
+            {},
+            defaultdict(set),
+            defaultdict(set),
+        )
+        patients = User.objects.filter(details__isnull=False).values(
+            "id",
+            "name",
+            "normalized_name",
+            "phonenumber",
+            "details__date_of_birth",
+        )
+        for patient in patients:
+            patient["date_of_birth"] = patient.pop("details__date_of_birth")
+            self.add(patient)
+        self.loaded_at = time.monotonic()
+        self.stats["loads"] += 1
+
+    def ensure_loaded(self):
+        """
+        Call with the lock held, counts the lookup as a hit or a miss
+        """
+        if self.entries is None or time.monotonic() - self.loaded_at > DIRECTORY_TTL:
+            self.stats["misses"] += 1
+            self.load()
+        else:
+            self.stats["hits"] += 1
+
+    def add(self, entry):
+        self.entries[entry["id"]] = entry
+        self.by_phone[entry["phonenumber"]].add(entry["id"])
+        for gram in trigrams(entry["normalized_name"]):
+            self.postings[gram].add(entry["id"])
+
+    def discard(self, user_id):
+        entry = self.entries.pop(user_id, None)
+        if entry is None:
+            return None
+        self.by_phone[entry["phonenumber"]].discard(user_id)
+        for gram in trigrams(entry["normalized_name"]):
+            self.postings[gram].discard(user_id)
+        return entry
+
+    def save_patient(self, user, date_of_birth=None):
+        """
+        - User saved: refresh name/phonenumber if they are a patient
+        - Details saved: add or refresh the patient
+        """
+        with self.lock:
+            if self.entries is None:
+                return
+            old_entry = self.discard(user.id)
+            if date_of_birth is None:
+                if old_entry is None:
+                    return
+                date_of_birth = old_entry["date_of_birth"]
+            self.add(
+                {
+                    "id": user.id,
+                    "name": user.name,
+                    "normalized_name": user.normalized_name,
+                    # request data may carry it as a string
+                    "phonenumber": int(user.phonenumber),
+                    "date_of_birth": date_of_birth,
+                }
+            )
+
+    def delete_patient(self, user_id):
+        with self.lock:
+            if self.entries is not None:
+                self.discard(user_id)
+
+    def invalidate(self):
+        with self.lock:
+            self.entries, self.by_phone, self.postings = None, None, None
+
+    def lookup_phone(self, phonenumber):
+        with self.lock:
+            self.ensure_loaded()
+            return [
+                self.entries[user_id]
+                for user_id in self.by_phone.get(int(phonenumber), ())
+            ]
+
+    def search_name(self, query, limit, threshold):
+        """
+        Returns [(entry, similarity)] best match first
+        - similarity: share of the query's trigrams present in the name
+        - names containing the query always match
+        """
+        query_grams = trigrams(query)
+        if not query_grams:
+            return []
+        with self.lock:
+            self.ensure_loaded()
+            shared = defaultdict(int)
+            for gram in query_grams:
+                for user_id in self.postings.get(gram, ()):
+                    shared[user_id] += 1
+            matches = []
+            for user_id, count in shared.items():
+                entry = self.entries[user_id]
+                similarity = count / len(query_grams)
+                if similarity >= threshold or query in entry["normalized_name"]:
+                    matches.append((entry, similarity))
+        matches.sort(key=lambda match: (-match[1], match[0]["normalized_name"]))
+        return matches[:limit]
+
+    def directory_stats(self):
+        """
+        hits, misses, hit_rate, loads, entries and approximate memory_bytes
+        """
+        with self.lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            memory_bytes = 0
+            if self.entries is not None:
+                for index in (self.entries, self.by_phone, self.postings):
+                    memory_bytes += sys.getsizeof(index)
+                    for key, value in index.items():
+                        memory_bytes += sys.getsizeof(key) + sys.getsizeof(value)
+                for entry in self.entries.values():
+                    memory_bytes += sum(sys.getsizeof(v) for v in entry.values())
+            return {
+                **self.stats,
+                "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+                "entries": len(self.entries) if self.entries is not None else 0,
+                "memory_bytes": memory_bytes,
+            }
+
+
+patient_directory = PatientDirectory()
+
+
+def rows_for(entries, patients, fields):
+    """
+    Rows with `fields` for directory entries, in the same order
+    - fields the directory holds: built in memory
+    - other fields: one primary-key query on `patients` (a Details queryset)
+    """
+    if set(fields) <= set(DIRECTORY_FIELDS):
+        return [{field: entry[field] for field in fields} for entry in entries]
+    rows = {
+        row["id"]: row
+        for row in patients.filter(id__in=[entry["id"] for entry in entries]).values(
+            *fields
+        )
+    }
+    return [rows[entry["id"]] for entry in entries if entry["id"] in rows]
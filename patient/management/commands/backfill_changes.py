@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from patient import changes, models
+
+
+class Command(BaseCommand):
+    help = (
+        "Log a change for every synced record that isn't in the change log "
+        "yet, so a sync without a cursor sees records saved before it existed"
+    )
+
+    def handle(self, *args, **kwargs):
+        logged = 0
+        for table, (model, _) in changes.SYNC_TABLES.items():
+            in_log = set(
+                models.Change.objects.filter(table=table).values_list(
+                    "row_id", flat=True
+                )
+            )
+            row_ids = [
+                row_id
+                for row_id in model.objects.values_list("pk", flat=True).iterator()
+                if row_id not in in_log
+            ]
+            models.Change.objects.bulk_create(
+                [models.Change(table=table, row_id=row_id) for row_id in row_ids],
+                batch_size=500,
+            )
+            logged += len(row_ids)
+
+        self.stdout.write(self.style.SUCCESS(f"Successfully logged {logged} records"))
@@ -0,0 +1,63 @@
+import datetime
+from django.core.management.base import BaseCommand
+from django.db.models import F, OuterRef, Subquery
+from django.utils import timezone
+from patient import models
+
+
+class Command(BaseCommand):
+    help = (
+        "Backfill created_at/updated_at for rows saved before they existed: "
+        "complaints from their date and time, their records from the complaint"
+    )
+
+    def handle(self, *args, **kwargs):
+        # date/time were auto_now before, for old complaints they are the
+        # time of the last save, the closest there is to a creation time
+        complaints = []
+        for complaint in models.Complaint.objects.filter(created_at__isnull=True).only(
+            "id", "date", "time"
+        ):
+            complaint.created_at = timezone.make_aware(
+                datetime.datetime.combine(complaint.date, complaint.time)
+            )
+            complaints.append(complaint)
+        models.Complaint.objects.bulk_update(complaints, ["created_at"], batch_size=500)
+
+        records = 0
+        complaint_created_at = models.Complaint.objects.filter(
+            id=OuterRef("complaint_id")
+        ).values("created_at")[:1]
+        for model in (
+            models.FollowUp,
+            models.Diagnosis,
+            models.Discount,
+            models.PatientPrescription,
+        ):
+            records += model.objects.filter(created_at__isnull=True).update(
+                created_at=Subquery(complaint_created_at)
+            )
+        # nothing to go by for details, the backfill is the best bound
+        records += models.Details.objects.filter(created_at__isnull=True).update(
+            created_at=timezone.now()
+        )
+
+        # never saved since, last change is the creation
+        for model in (
+            models.Details,
+            models.Complaint,
+            models.FollowUp,
+            models.Diagnosis,
+            models.Discount,
+            models.PatientPrescription,
+        ):
+            model.objects.filter(updated_at__isnull=True).update(
+                updated_at=F("created_at")
+            )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Successfully backfilled {len(complaints)} complaints "
+                f"and {records} other rows"
+            )
+        )
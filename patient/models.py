@@ -3,12 +3,37 @@ from authentication.models import User
 import uuid
 from doctor.models import Treatment, Prescription
 
-
 # ==============================NOTE====================================
 # Foreign key names are getting an added "_id" at the end of their names
+# Indexes: every hot filter is served by one index, foreign keys to
+# Complaint/User skip their own index when a unique constraint or composite
+# index already starts with them
+# - Complaint(date, time): day's complaints (dashboard, waiting list)
+# - Complaint(user, -date, -time, -id): patient's history in page order
+# - FollowUp(date, time): day's followups
+# - FollowUp(complaint, number), Diagnosis(complaint, ...),
+#   PatientPrescription(complaint, sitting, ...): unique constraints
+# - created_at/updated_at of every clinical table: time ranges, cache
+#   validators and delta exports
+
+
+class Timestamped(models.Model):
+    """
+    created_at: <DateTime> set once on insert
+    updated_at: <DateTime> every save
+    - Both are null only for rows saved before they existed
+    (manage.py backfill_timestamps fills them)
+    - bulk_update and queryset update() don't set updated_at, pass it
+    """
+
+    created_at = models.DateTimeField(auto_now_add=True, null=True, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True, null=True, db_index=True)
+
+    class Meta:
+        abstract = True
 
 
-class Details(models.Model):
+class Details(Timestamped):
     """
     id: <UUID> one-to-one key with user_id from User
     date_of_birth: <Date>
@@ -43,28 +68,37 @@ class Details(models.Model):
         db_table = "patient_details"
 
 
-class Complaint(models.Model):
+class Complaint(Timestamped):
     """
     id: <UUID> (Primary key)
     user: <UUID> (Foreign Key for User)
     complaint: <String> Description of complaint
     description: <String> What doctor did during sitting
-    date:<Date> when complaint was registered
-    time: <Time> when complaint was registered
+    date:<Date> when complaint was registered (never changes after)
+    time: <Time> when complaint was registered (never changes after)
     """
 
     id = models.UUIDField(primary_key=True, default=uuid.uuid4)
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
     complaint = models.TextField()
     description = models.TextField(default="")
-    date = models.DateField(auto_now=True)
-    time = models.TimeField(auto_now=True, blank=True)
+    date = models.DateField(auto_now_add=True)
+    time = models.TimeField(auto_now_add=True, blank=True)
 
     class Meta:
         db_table = "complaints"
+        indexes = [
+            # today's complaints on the dashboard, in time order
+            models.Index(fields=["date", "time"], name="complaint_date_time_idx"),
+            # patient's history, newest first (keyset pages on date, time, id)
+            models.Index(
+                fields=["user", "-date", "-time", "-id"],
+                name="complaint_user_history_idx",
+            ),
+        ]
 
 
-class Diagnosis(models.Model):
+class Diagnosis(Timestamped):
     """
     id: <UUID> (Primary key)
     complaint: <Complaint> (Foreign Key for complaint)
@@ -74,7 +108,7 @@ class Diagnosis(models.Model):
     """
 
     id = models.UUIDField(primary_key=True, default=uuid.uuid4)
-    complaint = models.ForeignKey(Complaint, on_delete=models.CASCADE)
+    complaint = models.ForeignKey(Complaint, on_delete=models.CASCADE, db_index=False)
     tooth_number = models.IntegerField(blank=True, null=True)
     treatment = models.ForeignKey(Treatment, on_delete=models.PROTECT)
     price = models.IntegerField()
@@ -89,7 +123,7 @@ class Diagnosis(models.Model):
         ]
 
 
-class FollowUp(models.Model):
+class FollowUp(Timestamped):
     """
     id: <UUID> (Primary key)
     complaint: <Complaint> (Foreign Key for Complaint)
@@ -102,7 +136,7 @@ class FollowUp(models.Model):
     """
 
     id = models.UUIDField(primary_key=True, default=uuid.uuid4)
-    complaint = models.ForeignKey(Complaint, on_delete=models.CASCADE)
+    complaint = models.ForeignKey(Complaint, on_delete=models.CASCADE, db_index=False)
     date = models.DateField()
     time = models.TimeField(null=True, blank=True)
     title = models.CharField(max_length=255)
@@ -117,9 +151,13 @@ class FollowUp(models.Model):
                 fields=["complaint", "number"], name="unique_complaint+number"
             )
         ]
+        indexes = [
+            # followups of a day (dashboard, waiting list), in time order
+            models.Index(fields=["date", "time"], name="followup_date_time_idx"),
+        ]
 
 
-class Discount(models.Model):
+class Discount(Timestamped):
     """
     complaint: <Complaint> along with which bill is associated
     discount: <Integer> Amount of discount given by the dentist
@@ -134,7 +172,7 @@ class Discount(models.Model):
         db_table = "discounts"
 
 
-class PatientPrescription(models.Model):
+class PatientPrescription(Timestamped):
     """
     id: <UUID>
     complaint: <Complaint>
@@ -153,7 +191,7 @@ class PatientPrescription(models.Model):
         EMPTY = ""
 
     id = models.UUIDField(primary_key=True, default=uuid.uuid4)
-    complaint = models.ForeignKey(Complaint, on_delete=models.CASCADE)
+    complaint = models.ForeignKey(Complaint, on_delete=models.CASCADE, db_index=False)
     sitting = models.IntegerField()
     prescription = models.ForeignKey(Prescription, on_delete=models.PROTECT)
     days = models.IntegerField()
@@ -169,3 +207,49 @@ class PatientPrescription(models.Model):
                 name="unique_complaint+sitting+prescription",
             )
         ]
+
+
+class CurrentTransaction(models.Func):
+    """
+    Id of the transaction writing the row (Postgres xid8, fits a bigint)
+    """
+
+    template = "pg_current_xact_id()::text::bigint"
+    output_field = models.BigIntegerField()
+
+
+class Change(models.Model):
+    """
+    One row per changed record for the delta sync (patient/changes.py),
+    written by a trigger in the transaction that changed the record
+    id: <BigInt> order of the changes within a transaction
+    transaction: <BigInt> id of the transaction that made the change
+    table: <Table> which table the record is in
+    row_id: <UUID> primary key of the record
+    deleted: <Bool> record was deleted
+    - Only the latest change of a record is kept
+    """
+
+    class Table(models.IntegerChoices):
+        CREDENTIALS = 1
+        PATIENT_DETAILS = 2
+        COMPLAINTS = 3
+        FOLLOWUPS = 4
+        DIAGNOSIS = 5
+        PATIENT_PRESCRIPTIONS = 6
+        DISCOUNTS = 7
+
+    id = models.BigAutoField(primary_key=True)
+    transaction = models.BigIntegerField(db_default=CurrentTransaction())
+    table = models.PositiveSmallIntegerField(choices=Table.choices)
+    row_id = models.UUIDField()
+    deleted = models.BooleanField(default=False, db_default=False)
+
+    class Meta:
+        db_table = "changes"
+        indexes = [
+            # sync pages are read in (transaction, id) order
+            models.Index(fields=["transaction", "id"], name="change_cursor_idx"),
+            # older changes of a record are dropped when it changes again
+            models.Index(fields=["table", "row_id"], name="change_table_row_idx"),
+        ]
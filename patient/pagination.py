@@ -0,0 +1,122 @@
+from django.db.models import Q
+import base64
+import json
+
+# ==============================NOTE====================================
+# Keyset (cursor) pagination: a page is fetched with
+# "WHERE (ordering) > (last row of previous page) ORDER BY ordering LIMIT n"
+# so its cost does not grow with how deep the client has paged.
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def page_size(requested):
+    """
+    ?limit= value capped to MAX_PAGE_SIZE, PAGE_SIZE when missing/invalid
+    """
+    try:
+        size = int(requested)
+    except (TypeError, ValueError):
+        return PAGE_SIZE
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+def select_fields(requested, allowed):
+    """
+    Sparse fieldsets: ?fields=name,phonenumber
+    - "id" is always returned (clients need it and pages are keyed on it)
+    1. Not given: all allowed fields
+    2. Unknown field: error
+    """
+    if not requested:
+        return list(allowed), None
+    fields = ["id"]
+    for field in requested.split(","):
+        field = field.strip()
+        if field not in allowed:
+            return None, f"Unknown field: {field}"
+        if field not in fields:
+            fields.append(field)
+    return fields, None
+
+
+def encode_cursor(values):
+    raw = json.dumps([str(value) for value in values]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("utf-8")
+
+
+def decode_cursor(cursor, converters=None):
+    """
+    - converters: one per ordering field, turns the cursor's string back
+    into a value of the field (eg: uuid.UUID, datetime.date.fromisoformat)
+    1. Not base64 JSON, wrong number of values or a value that doesn't
+    convert: error
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("utf-8")))
+    except (ValueError, UnicodeDecodeError):
+        return None, "Invalid cursor"
+    if not isinstance(values, list):
+        return None, "Invalid cursor"
+    if converters is not None:
+        if len(values) != len(converters):
+            return None, "Invalid cursor"
+        try:
+            values = [convert(value) for convert, value in zip(converters, values)]
+        except (TypeError, ValueError, AttributeError):
+            return None, "Invalid cursor"
+    return values, None
+
+
+def row_value(row, field):
+    """
+    Value of an ordering field ("-date" -> date) in a .values() dict or model
+    """
+    field = field.lstrip("-")
+    if isinstance(row, dict):
+        return row[field]
+    return getattr(row, field)
+
+
+def keyset_paginate(queryset, ordering, cursor_values, limit):
+    """
+    - queryset: .values() or model queryset with every field of `ordering`
+    - ordering: fields that together are unique (last one a pk), "-" prefix
+    for descending ones
+    - cursor_values: decoded cursor of the previous page or None
+    Returns rows of this page and cursor for the next one (None on last page)
+    """
+    if cursor_values:
+        if len(cursor_values) != len(ordering):
+            return [], None
+        fields = [field.lstrip("-") for field in ordering]
+        after = Q()
+        for i, field in enumerate(ordering):
+            lookup = "lt" if field.startswith("-") else "gt"
+            equal_before = {fields[j]: cursor_values[j] for j in range(i)}
+            after |= Q(**equal_before, **{f"{fields[i]}__{lookup}": cursor_values[i]})
+        queryset = queryset.filter(after)
+
+    rows = list(queryset.order_by(*ordering)[: limit + 1])
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor([row_value(rows[-1], field) for field in ordering])
+
+
+def keyset_paginate_rows(rows, ordering, cursor_values, limit):
+    """
+    keyset_paginate for rows already in memory (dicts with every field of
+    `ordering`, all ascending), cursor_values converted like the fields
+    """
+
+    def key(row):
+        return [row[field] for field in ordering]
+
+    rows = sorted(rows, key=key)
+    if cursor_values:
+        rows = [row for row in rows if key(row) > cursor_values]
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor([rows[-1][field] for field in ordering])
@@ -0,0 +1,32 @@
+from authentication.permissions import RolePermission
+
+
+class DetailsPermission(RolePermission):
+    """
+    1. GET: patient fetching their own details
+    2. POST: admin/dentist registering a patient
+    """
+
+    method_roles = {
+        "GET": set(["patient"]),
+        "POST": set(["admin", "dentist"]),
+    }
+
+
+class FollowupsPermission(RolePermission):
+    """
+    1. GET: admin/dentist waiting list
+    2. POST, PUT, DELETE: dentist only
+    """
+
+    roles = set(["dentist"])
+    method_roles = {"GET": set(["dentist", "admin"])}
+
+
+class MedicalDetailsPermission(RolePermission):
+    """
+    1. GET: any role (dentist-only for other patients is checked in the view)
+    2. POST: dentist only
+    """
+
+    method_roles = {"POST": set(["dentist"])}
@@ -0,0 +1,39 @@
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.db import connection
+from django.db.models import Q
+from authentication.models import normalize_name
+from . import directory
+
+# ==============================NOTE====================================
+# Fuzzy name search for the front desk typeahead.
+# - PostgreSQL: pg_trgm word similarity, served by the GIN trigram index on
+#   credentials.normalized_name (see User.Meta.indexes)
+# - Other backends, or when the patient directory is enabled: the
+#   directory's in-process trigram index with the same scoring
+SEARCH_LIMIT = 20
+SIMILARITY_THRESHOLD = 0.6  # pg_trgm's default word_similarity_threshold
+
+
+def search_patients_by_name(patients, name, fields, limit=SEARCH_LIMIT):
+    """
+    Ranks `patients` (a Details queryset) by how closely their name matches
+    - returns at most `limit` rows with `fields`, each with a "similarity" score
+    """
+    query = normalize_name(name)
+    if connection.vendor == "postgresql" and not directory.enabled():
+        return list(
+            patients.values(*fields)
+            .annotate(similarity=TrigramWordSimilarity(query, "id__normalized_name"))
+            .filter(
+                Q(id__normalized_name__trigram_word_similar=query)
+                | Q(id__normalized_name__contains=query)
+            )
+            .order_by("-similarity", "id__normalized_name")[:limit]
+        )
+
+    ranked = directory.patient_directory.search_name(query, limit, SIMILARITY_THRESHOLD)
+    similarities = {entry["id"]: similarity for entry, similarity in ranked}
+    rows = directory.rows_for([entry for entry, _ in ranked], patients, fields)
+    for row in rows:
+        row["similarity"] = similarities[row["id"]]
+    return rows
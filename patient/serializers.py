@@ -152,3 +152,49 @@ class PatientPrescriptionUpdateSerializer(serializers.Serializer):
         choices=models.PatientPrescription.DosageChoices.choices,
         default=models.PatientPrescription.DosageChoices.EMPTY,
     )
+
+
+class SittingDiagnosisSerializer(serializers.Serializer):
+    """
+    treatment: <UUID> for treatment
+    tooth_number: <Integer>
+    """
+
+    treatment = serializers.UUIDField()
+    tooth_number = serializers.IntegerField()
+
+
+class SittingPrescriptionSerializer(serializers.Serializer):
+    """
+    prescription: <UUID>
+    days: <Integer>
+    dosage: <OD | BD | TD | Half BD | Half TD | "">
+    """
+
+    prescription = serializers.UUIDField()
+    days = serializers.IntegerField()
+    dosage = serializers.ChoiceField(
+        choices=models.PatientPrescription.DosageChoices.choices,
+        default=models.PatientPrescription.DosageChoices.EMPTY,
+    )
+
+
+class SittingSerializer(serializers.Serializer):
+    """
+    Everything written when a sitting ends
+    complaint: <UUID>
+    sitting: = 0 for complaint, >= 1 for followups
+    diagnoses: [{treatment, tooth_number}]
+    prescriptions: [{prescription, days, dosage}]
+    followup: <Followup> next followup to schedule (optional)
+    discount: <Integer> (optional)
+    consultation: <Bool> add consultation charges
+    """
+
+    complaint = serializers.UUIDField()
+    sitting = serializers.IntegerField(min_value=0)
+    diagnoses = SittingDiagnosisSerializer(many=True, default=[])
+    prescriptions = SittingPrescriptionSerializer(many=True, default=[])
+    followup = FollowupSerializer(required=False)
+    discount = serializers.IntegerField(required=False)
+    consultation = serializers.BooleanField(default=False)
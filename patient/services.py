@@ -1,13 +1,31 @@
 import datetime
 import uuid
 from . import models
-from doctor import models as doc_models
+from doctor.catalog import catalog
+from doctor.models import Prescription
+from . import directory
+from . import pagination
+from . import search
 from . import serializers
+from . import timeline
 from . import utils
-from authentication.models import User
+from authentication.models import User, normalize_name
 from django.db import IntegrityError, transaction
-from django.db.models import F
+from django.contrib.postgres.aggregates import StringAgg
+from django.db.models import (
+    BooleanField,
+    CharField,
+    F,
+    IntegerField,
+    Max,
+    Prefetch,
+    UUIDField,
+    Value,
+)
+from django.db.models.functions import MD5, Cast, Concat, ExtractYear
 from django.forms.models import model_to_dict
+from django.utils import timezone
+from psycopg2 import errorcodes
 from rest_framework import status
 from reportlab.lib.pagesizes import letter
 from reportlab.lib import colors
@@ -28,80 +46,136 @@ def capitalize_name(name, snake_case=False):
     return capitalized_name.strip()
 
 
-def fetch_patients_with_phone_and_name(phonenumber, name):
-    patients = (
-        models.Details.objects.select_related("user")
-        .filter(id__phonenumber=phonenumber, id__name__icontains=name)
-        .annotate(name=F("id_id__name"), phonenumber=F("id_id__phonenumber"))
-        .values(
-            "id",
-            "name",
-            "phonenumber",
-            "date_of_birth",
-            "address",
-            "gender",
-            "allergies",
-            "illnesses",
-            "smoking",
-            "drinking",
-            "tobacco",
-        )
+PATIENT_FIELDS = (
+    "id",
+    "name",
+    "phonenumber",
+    "date_of_birth",
+    "address",
+    "gender",
+    "allergies",
+    "illnesses",
+    "smoking",
+    "drinking",
+    "tobacco",
+)
+# Pages of patients are ordered (and keyed) by name, id breaks ties
+PATIENT_ORDERING = ("normalized_name", "id")
+PATIENT_CURSOR = (str, uuid.UUID)
+
+
+def patients_queryset():
+    return models.Details.objects.annotate(
+        name=F("id_id__name"),
+        phonenumber=F("id_id__phonenumber"),
+        normalized_name=F("id_id__normalized_name"),
+    )
+
+
+def paginate_patients(patients, fields, cursor_values, limit):
+    """
+    Keyset page of `patients` with only `fields` in every row
+    """
+    patients, next_cursor = pagination.keyset_paginate(
+        patients.values(*fields, *PATIENT_ORDERING),
+        PATIENT_ORDERING,
+        cursor_values,
+        limit,
+    )
+    if "normalized_name" not in fields:
+        for patient in patients:
+            del patient["normalized_name"]
+    return patients, next_cursor
+
+
+def fetch_all_patients(
+    fields=PATIENT_FIELDS, cursor_values=None, limit=pagination.PAGE_SIZE
+):
+    return paginate_patients(patients_queryset(), fields, cursor_values, limit)
+
+
+def fetch_patients_with_phone_and_name(
+    phonenumber,
+    name,
+    fields=PATIENT_FIELDS,
+    cursor_values=None,
+    limit=pagination.PAGE_SIZE,
+):
+    patients, next_cursor = paginate_patients(
+        patients_queryset().filter(
+            id__phonenumber=phonenumber,
+            id__normalized_name__contains=normalize_name(name),
+        ),
+        fields,
+        cursor_values,
+        limit,
     )
     if not len(patients):
         return (
             None,
-            f"No patients found with name: {
-                name} and phonenumber: {phonenumber}",
+            None,
+            f"No patients found with name: {name} and phonenumber: {phonenumber}",
         )
-    return patients, None
+    return patients, next_cursor, None
 
 
-def fetch_patients_with_phone(phonenumber):
-    patients = (
-        models.Details.objects.select_related("user")
-        .filter(id__phonenumber=phonenumber)
-        .annotate(name=F("id_id__name"), phonenumber=F("id_id__phonenumber"))
-        .values(
-            "id",
-            "name",
-            "phonenumber",
-            "date_of_birth",
-            "address",
-            "gender",
-            "allergies",
-            "illnesses",
-            "smoking",
-            "drinking",
-            "tobacco",
+def fetch_patients_with_phone(
+    phonenumber, fields=PATIENT_FIELDS, cursor_values=None, limit=pagination.PAGE_SIZE
+):
+    """
+    - Served from the patient directory when it is enabled
+    """
+    if directory.enabled():
+        entries, next_cursor = pagination.keyset_paginate_rows(
+            directory.patient_directory.lookup_phone(phonenumber),
+            PATIENT_ORDERING,
+            cursor_values,
+            limit,
+        )
+        patients = directory.rows_for(entries, patients_queryset(), fields)
+    else:
+        patients, next_cursor = paginate_patients(
+            patients_queryset().filter(id__phonenumber=phonenumber),
+            fields,
+            cursor_values,
+            limit,
         )
-    )
     if not len(patients):
         return (
+            None,
             None,
             f"No patients found with phonenumber: {phonenumber}",
         )
-    return patients, None
+    return patients, next_cursor, None
 
 
-def fetch_patients_with_name(name):
+def fetch_patients_with_phone_prefix(
+    prefix, fields=PATIENT_FIELDS, limit=search.SEARCH_LIMIT
+):
+    """
+    Typeahead on the first digits of the phonenumber
+    - LIKE 'prefix%' served by the text_pattern_ops index on phonenumber_text
+    - at most `limit` patients, ordered by phonenumber
+    """
     patients = (
-        models.Details.objects.select_related("user")
-        .filter(id__name__icontains=name)
-        .annotate(name=F("id_id__name"), phonenumber=F("id_id__phonenumber"))
-        .values(
-            "id",
-            "name",
-            "phonenumber",
-            "date_of_birth",
-            "address",
-            "gender",
-            "allergies",
-            "illnesses",
-            "smoking",
-            "drinking",
-            "tobacco",
-        )
+        patients_queryset()
+        .filter(id__phonenumber_text__startswith=str(prefix))
+        .order_by("id__phonenumber_text")
+        .values(*fields)[:limit]
     )
+    if not len(patients):
+        return (
+            None,
+            f"No patients found with phonenumber starting with: {prefix}",
+        )
+    return patients, None
+
+
+def fetch_patients_with_name(name, fields=PATIENT_FIELDS):
+    """
+    Fuzzy search on name, best matches first (capped at search.SEARCH_LIMIT)
+    """
+    patients = search.search_patients_by_name(patients_queryset(), name, fields)
     if not len(patients):
         return (
             None,
@@ -110,28 +184,50 @@ def fetch_patients_with_name(name):
     return patients, None
 
 
-def fetch_complaint_and_followup_history(patient_id):
+HISTORY_ORDERING = ("-date", "-time", "-id")
+HISTORY_CURSOR = (datetime.date.fromisoformat, datetime.time.fromisoformat, uuid.UUID)
+
+
+def fetch_complaint_and_followup_history(
+    patient_id, cursor_values=None, limit=pagination.PAGE_SIZE
+):
     """
-    - Fetch complaints and followups for given patient
+    - Fetch complaints (latest first, a page at a time) and their followups
+    for given patient
+    - Three queries whatever the length of the history: patient, page of
+    complaints, followups of every complaint on the page
     1. Invaild patient_id
     2. Success
     """
-    try:
-        patient = User.objects.get(id=patient_id)
-    except User.DoesNotExist:
-        return None, "This patient does not exist"
-    complaints = models.Complaint.objects.filter(user=patient)
+    if not User.objects.filter(id=patient_id).exists():
+        return None, None, "This patient does not exist"
+    complaints = models.Complaint.objects.filter(user_id=patient_id).prefetch_related(
+        Prefetch(
+            "followup_set",
+            queryset=models.FollowUp.objects.only(
+                "complaint_id", "title", "date", "completed", "number", "time"
+            ).order_by("number"),
+        )
+    )
+    complaints, next_cursor = pagination.keyset_paginate(
+        complaints, HISTORY_ORDERING, cursor_values, limit
+    )
     complaint_followup_mapping = []
     for complaint in complaints:
-        followups_by_complaint = (
-            models.FollowUp.objects.filter(complaint=complaint)
-            .values("title", "date", "completed", "number", "time")
-            .order_by("number")
-        )
         complaint_details = {
             "complaint": complaint.complaint,
             "date": complaint.date,
         }
+        followups_by_complaint = [
+            {
+                "title": followup.title,
+                "date": followup.date,
+                "completed": followup.completed,
+                "number": followup.number,
+                "time": followup.time,
+            }
+            for followup in complaint.followup_set.all()
+        ]
         complaint_followup_mapping.append(
             {
                 str(complaint.id): {
@@ -140,7 +236,81 @@ def fetch_complaint_and_followup_history(patient_id):
                 }
             }
         )
-    return complaint_followup_mapping, None
+    return complaint_followup_mapping, next_cursor, None
+
+
+def fetch_complaint_detail(complaint_id):
+    """
+    Everything the sitting screen shows for a complaint, in four queries
+    (complaint with patient and discount, diagnoses, followups, prescriptions)
+    - prescriptions are grouped by sitting, 0 being the complaint itself
+    1. Invalid complaint_id
+    2. Success
+    """
+    try:
+        complaint = (
+            models.Complaint.objects.select_related("user", "discount")
+            .prefetch_related(*timeline.complaint_records())
+            .get(id=complaint_id)
+        )
+    except models.Complaint.DoesNotExist:
+        return None, "Complaint doesn't exist"
+
+    try:
+        discount = model_to_dict(complaint.discount)
+    except models.Discount.DoesNotExist:
+        discount = {}
+    prescriptions = {}
+    for prescription in complaint.patientprescription_set.all():
+        prescriptions.setdefault(prescription.sitting, []).append(
+            {
+                "id": prescription.id,
+                "sitting": prescription.sitting,
+                "complaint": prescription.complaint_id,
+                "prescription_name": prescription.prescription_name,
+                "prescription_type": prescription.prescription_type,
+                "prescription_id": prescription.prescription_id,
+                "days": prescription.days,
+                "dosage": prescription.dosage,
+            }
+        )
+    return {
+        "complaint": {
+            "id": complaint.id,
+            "patient_id": complaint.user_id,
+            "name": complaint.user.name,
+            "phonenumber": complaint.user.phonenumber,
+            "complaint": complaint.complaint,
+            "description": complaint.description,
+            "date": complaint.date,
+            "time": complaint.time,
+        },
+        "diagnoses": [
+            {
+                "id": diagnosis.id,
+                "tooth_number": diagnosis.tooth_number,
+                "treatment": diagnosis.treatment_id,
+                "treatment_name": diagnosis.treatment_name,
+                "price": diagnosis.price,
+            }
+            for diagnosis in complaint.diagnosis_set.all()
+        ],
+        "followups": [
+            {
+                "id": followup.id,
+                "complaint_id": followup.complaint_id,
+                "date": followup.date,
+                "time": followup.time,
+                "title": followup.title,
+                "description": followup.description,
+                "completed": followup.completed,
+                "number": followup.number,
+            }
+            for followup in complaint.followup_set.all()
+        ],
+        "prescriptions": prescriptions,
+        "discount": discount,
+    }, None
 
 
 def serialize_identity(medical_data):
@@ -180,7 +350,7 @@ def fetch_details_object(name, phonenumber):
     """
     try:
         user_details = User.objects.select_related("details").get(
-            name=name,
+            normalized_name=normalize_name(name),
             phonenumber=phonenumber,
         )
     except User.DoesNotExist:
@@ -188,6 +358,34 @@ def fetch_details_object(name, phonenumber):
     return None, user_details.details
 
 
+def fetch_details_object_by_id(user_id):
+    """
+    Primary-key lookup of a patient's details (Details.id is User.id)
+    """
+    try:
+        user_details = models.Details.objects.select_related("id").get(id=user_id)
+    except models.Details.DoesNotExist:
+        return "User not found", None
+    return None, user_details
+
+
+def fetch_user_id_from_token(payload):
+    """
+    - Tokens carry "user_id", older ones only have name and phonenumber
+    so fall back to looking the user up with them
+    """
+    if payload.get("user_id"):
+        return payload["user_id"], None
+    try:
+        user = User.objects.only("id").get(
+            normalized_name=normalize_name(payload["name"]),
+            phonenumber=payload["phonenumber"],
+        )
+    except User.DoesNotExist:
+        return None, "User not found"
+    return user.id, None
+
+
 def add_medical_details(data):
     """
     1. Creates medical details for first time
@@ -215,12 +413,16 @@ def add_medical_details(data):
     return None
 
 
-def fetch_medical_details(capitalized_name, phonenumber):
+def fetch_medical_details(capitalized_name, phonenumber, user_id=None):
     """
     Fetch the medical details of patient
     - illnesses, allergies, smoking, drinking, tobacco
+    - user_id given: primary-key lookup instead of name+phonenumber
     """
-    error, user_details = fetch_details_object(capitalized_name, phonenumber)
+    if user_id:
+        error, user_details = fetch_details_object_by_id(user_id)
+    else:
+        error, user_details = fetch_details_object(capitalized_name, phonenumber)
     if error:
         return None, error
 
@@ -253,34 +455,46 @@ def fetch_diagnosis_by_complaint(complaint_id):
     return diagnoses
 
 
+def is_foreign_key_violation(error):
+    """
+    IntegrityError raised for a missing parent row (not a unique constraint)
+    - postgres checks foreign keys at commit, writes relying on this run in
+    autocommit (no outer transaction) so the write itself raises it
+    """
+    return (
+        getattr(error.__cause__, "pgcode", None) == errorcodes.FOREIGN_KEY_VIOLATION
+    )
+
+
 def create_diagnosis(diagnosis_data):
     """
     Create a new diagnosis entry in the database
+    - complaint_id is written directly, a missing complaint is reported by
+    the foreign key
     1. Invalid treatment UUID
     2. Invalid complaint UUID
     3. Duplicate diagnosis (complaint+tooth+treatment should be unique)
     3. Success
     """
-    try:
-        complaint = models.Complaint.objects.get(id=diagnosis_data["complaint"])
-        treatment = models.Treatment.objects.get(id=diagnosis_data["treatment"])
-        models.Diagnosis.objects.create(
-            complaint=complaint,
-            treatment=treatment,
-            tooth_number=diagnosis_data["tooth_number"],
-            price=treatment.price,
-        )
-    except models.Complaint.DoesNotExist:
+    treatment = catalog.treatment(diagnosis_data["treatment"])
+    if treatment is None:
         return (
             f"For {diagnosis_data["tooth_number"]} Invalid chief-complaint",
             status.HTTP_404_NOT_FOUND,
         )
-    except models.Treatment.DoesNotExist:
-        return (
-            f"For {diagnosis_data["tooth_number"]} Invalid chief-complaint",
-            status.HTTP_404_NOT_FOUND,
+    try:
+        models.Diagnosis.objects.create(
+            complaint_id=diagnosis_data["complaint"],
+            treatment_id=treatment.id,
+            tooth_number=diagnosis_data["tooth_number"],
+            price=treatment.price,
         )
-    except IntegrityError:
+    except IntegrityError as error:
+        if is_foreign_key_violation(error):
+            return (
+                f"For {diagnosis_data["tooth_number"]} Invalid chief-complaint",
+                status.HTTP_404_NOT_FOUND,
+            )
         return (
             f"For tooth {diagnosis_data["tooth_number"]
                          }, {treatment.name} diagnosis already exists",
@@ -289,6 +503,103 @@ def create_diagnosis(diagnosis_data):
     return None, None
 
 
+def diagnoses_to_create(diagnoses, treatments):
+    """
+    - diagnoses: [{complaint, treatment, tooth_number}] of existing complaints
+    - treatments: Treatment by id, for every treatment that exists
+    Checks them against complaint+tooth_number+treatment uniqueness with one
+    query (and against each other)
+    Returns Diagnosis objects to bulk_create and conflicts of the rest
+    """
+    existing_diagnoses = set(
+        models.Diagnosis.objects.filter(
+            complaint_id__in=set(diagnosis["complaint"] for diagnosis in diagnoses),
+            tooth_number__in=set(diagnosis["tooth_number"] for diagnosis in diagnoses),
+        ).values_list("complaint_id", "tooth_number", "treatment_id")
+    )
+    new_diagnoses, conflicts = [], []
+    for i, diagnosis in enumerate(diagnoses):
+        tooth_number = diagnosis["tooth_number"]
+        treatment = treatments.get(diagnosis["treatment"])
+        key = (diagnosis["complaint"], tooth_number, diagnosis["treatment"])
+        if treatment is None:
+            conflicts.append(
+                {"field": "diagnoses", "index": i, "error": "Treatment not found"}
+            )
+        elif key in existing_diagnoses:
+            conflicts.append(
+                {
+                    "field": "diagnoses",
+                    "index": i,
+                    "error": f"For tooth {tooth_number}, {treatment.name} diagnosis already exists",
+                }
+            )
+        else:
+            existing_diagnoses.add(key)
+            new_diagnoses.append(
+                models.Diagnosis(
+                    complaint_id=diagnosis["complaint"],
+                    treatment=treatment,
+                    tooth_number=tooth_number,
+                    price=treatment.price,
+                )
+            )
+    return new_diagnoses, conflicts
+
+
+def create_diagnoses(diagnoses_data):
+    """
+    Create many diagnoses at once (full-mouth plans)
+    - complaints and treatments resolved with one query each, duplicates
+    checked with one and the rest saved with one bulk_create
+    1. Invalid complaint/treatment or duplicate: listed in conflicts, the
+    rest is still saved
+    2. Duplicate saved or complaint deleted after the checks: nothing saved,
+    409 CONFLICT
+    3. Success
+    Returns number saved, conflicts, error, error_status
+    """
+    complaint_ids = set(
+        models.Complaint.objects.filter(
+            id__in=set(diagnosis["complaint"] for diagnosis in diagnoses_data)
+        ).values_list("id", flat=True)
+    )
+    treatments = catalog.treatments_in(
+        set(diagnosis["treatment"] for diagnosis in diagnoses_data)
+    )
+    valid, conflicts = [], []
+    for i, diagnosis in enumerate(diagnoses_data):
+        if diagnosis["complaint"] in complaint_ids:
+            valid.append((i, diagnosis))
+        else:
+            tooth_number = diagnosis["tooth_number"]
+            conflicts.append(
+                {
+                    "field": "diagnoses",
+                    "index": i,
+                    "error": f"For {tooth_number} Invalid chief-complaint",
+                }
+            )
+    new_diagnoses, diagnosis_conflicts = diagnoses_to_create(
+        [diagnosis for _, diagnosis in valid], treatments
+    )
+    # indexes of the conflicts are of the valid ones, map back to the request
+    for conflict in diagnosis_conflicts:
+        conflict["index"] = valid[conflict["index"]][0]
+    conflicts = sorted(conflicts + diagnosis_conflicts, key=lambda c: c["index"])
+
+    try:
+        models.Diagnosis.objects.bulk_create(new_diagnoses)
+    except IntegrityError:
+        return (
+            None,
+            None,
+            "Diagnoses were changed while saving, try again",
+            status.HTTP_409_CONFLICT,
+        )
+    return len(new_diagnoses), conflicts, None, None
+
+
 def update_diagnosis(diagnosis_update_data):
     """
     Update existing diagnosis entry
@@ -297,21 +608,19 @@ def update_diagnosis(diagnosis_update_data):
     3. Duplicate diagnosis (complaint+tooth+treatment should be unique)
     4. Success
     """
+    updated_treatment = catalog.treatment(diagnosis_update_data["treatment"])
+    if updated_treatment is None:
+        return "Treatment not found", status.HTTP_404_NOT_FOUND
     try:
         diagnosis_to_update = models.Diagnosis.objects.get(
             id=diagnosis_update_data["id"]
         )
-        updated_treatment = models.Treatment.objects.get(
-            id=diagnosis_update_data["treatment"]
-        )
-        diagnosis_to_update.treatment = updated_treatment
+        diagnosis_to_update.treatment_id = updated_treatment.id
         diagnosis_to_update.tooth_number = diagnosis_update_data["tooth_number"]
         diagnosis_to_update.price = updated_treatment.price
         diagnosis_to_update.save()
     except models.Diagnosis.DoesNotExist:
         return "Diagnosis not found", status.HTTP_404_NOT_FOUND
-    except models.Treatment.DoesNotExist:
-        return "Treatment not found", status.HTTP_404_NOT_FOUND
     except IntegrityError:
         return (
             f"For tooth {diagnosis_update_data["tooth_number"]
@@ -327,11 +636,13 @@ def add_consultation(complaint):
     2. Duplicate Consultation charge
     3. Success
     """
+    treatment = catalog.treatment_by_name("Consultation")
+    if treatment is None:
+        return "Consultation is not a treatment yet", status.HTTP_404_NOT_FOUND
     try:
         complaint = models.Complaint.objects.get(id=complaint)
-        treatment = models.Treatment.objects.get(name="Consultation")
         models.Diagnosis.objects.create(
-            complaint=complaint, treatment=treatment, price=treatment.price
+            complaint=complaint, treatment_id=treatment.id, price=treatment.price
         )
     except models.Complaint.DoesNotExist:
         return "Invalid complaint", status.HTTP_404_NOT_FOUND
@@ -354,38 +665,176 @@ def delete_diagnosis(diagnosis_id):
     return tooth_number, treatment, None
 
 
+def complaints_with_patient():
+    return models.Complaint.objects.select_related("user", "user__details")
+
+
+def complaint_entry(complaint):
+    """
+    Waiting list row of a complaint (complaint from complaints_with_patient)
+    """
+    return {
+        "id": complaint.id,
+        "patient_id": complaint.user.id,
+        "name": complaint.user.name,
+        "age": utils.get_age(complaint.user.details.date_of_birth),
+        "phonenumber": complaint.user.phonenumber,
+        "time": complaint.time,
+        "complaint": complaint.complaint,
+    }
+
+
+def fetch_complaints_by_date(date):
+    """
+    Returns list of all the complaints registered on the given date
+    """
+    return [
+        complaint_entry(complaint)
+        for complaint in complaints_with_patient().filter(date=date)
+    ]
+
+
+def followups_with_patient():
+    return models.FollowUp.objects.select_related(
+        "complaint", "complaint__user", "complaint__user__details"
+    )
+
+
+def followup_entry(followup):
+    """
+    Waiting list row of a followup (followup from followups_with_patient)
+    - "id" is the complaint's, "followup_id" the followup's own
+    """
+    complaint_object = {
+        "complaint": followup.complaint.complaint,
+        "time": followup.complaint.time,
+        "date": followup.complaint.date,
+        "description": followup.complaint.description,
+    }
+    return {
+        "name": followup.complaint.user.name,
+        "patient_id": followup.complaint.user.id,
+        "age": utils.get_age(followup.complaint.user.details.date_of_birth),
+        "phonenumber": followup.complaint.user.phonenumber,
+        "time": followup.time,
+        "followup": followup.title,
+        "id": followup.complaint.id,
+        "followup_id": followup.id,
+        "complaint_object": complaint_object,
+        "sitting": followup.number,
+    }
+
+
 def fetch_followups_by_date(date: datetime.datetime.date):
     """
     Returns list of all the followups for the given date
     """
-    followups_for_date = models.FollowUp.objects.select_related(
-        "complaint", "complaint__user", "complaint__user__details"
-    ).filter(date=date)
-    formatted_followups = []
-    for followup in followups_for_date:
-        complaint_object = {
-            "complaint": followup.complaint.complaint,
-            "time": followup.complaint.time,
-            "date": followup.complaint.date,
-            "description": followup.complaint.description,
-        }
+    return [
+        followup_entry(followup)
+        for followup in followups_with_patient().filter(date=date)
+    ]
 
-        formatted_followups.append(
-            {
-                "name": followup.complaint.user.name,
-                "patient_id": followup.complaint.user.id,
-                "age": utils.get_age(followup.complaint.user.details.date_of_birth),
-                "phonenumber": followup.complaint.user.phonenumber,
-                "time": followup.time,
-                "followup": followup.title,
-                "id": followup.complaint.id,
-                "complaint_object": complaint_object,
-                "sitting": followup.number,
-            }
-        )
-    if not formatted_followups:
-        return []
-    return formatted_followups
+
+def entry_validators(user, complaint=None):
+    """
+    Aggregates over what waiting list rows show besides their own row, for
+    the ETags of the day lists (conditional.aggregate)
+    - user: path to the patient (User), credentials have no updated_at so
+    name and phonenumber go in as a digest, age by its details' updated_at
+    - complaint: path to the complaint, for followup rows
+    """
+    validators = {
+        "patients": MD5(
+            StringAgg(
+                Concat(
+                    f"{user}__name",
+                    Value(":"),
+                    Cast(f"{user}__phonenumber", CharField()),
+                    output_field=CharField(),
+                ),
+                delimiter=",",
+                ordering=f"{user}__id",
+            )
+        ),
+        "details_latest": Max(f"{user}__details__updated_at"),
+    }
+    if complaint:
+        validators["complaints_latest"] = Max(f"{complaint}__updated_at")
+    return validators
+
+
+def dashboard_columns(date, user, **columns):
+    """
+    Columns of a dashboard row, same order on both sides of the UNION
+    - user: path to the patient (User) from the queried model
+    - age as in utils.get_age, in SQL
+    """
+    return {
+        "entry_type": columns["type"],
+        "entry_id": columns["id"],
+        "entry_followup_id": columns.get(
+            "followup_id", Value(None, output_field=UUIDField())
+        ),
+        "entry_sitting": columns.get("sitting", Value(0)),
+        "entry_patient_id": F(f"{user}__id"),
+        "entry_name": F(f"{user}__name"),
+        "entry_age": Value(date.year, output_field=IntegerField())
+        - ExtractYear(f"{user}__details__date_of_birth"),
+        "entry_phonenumber": F(f"{user}__phonenumber"),
+        "entry_time": F("time"),
+        "entry_complaint": columns["complaint"],
+        "entry_followup": columns.get(
+            "followup", Value(None, output_field=CharField())
+        ),
+        "entry_completed": columns.get(
+            "completed", Value(False, output_field=BooleanField())
+        ),
+    }
+
+
+def fetch_dashboard(date):
+    """
+    Complaints and followups of the given date in one UNION ALL query,
+    sorted by time (followups without a time last)
+    - each side is a range on its (date, time) index
+    - "id" is always the complaint's, followup_id/followup only set for
+    followups
+    """
+    complaint_columns = dashboard_columns(
+        date,
+        "user",
+        type=Value("complaint"),
+        id=F("id"),
+        complaint=F("complaint"),
+    )
+    followup_columns = dashboard_columns(
+        date,
+        "complaint__user",
+        type=Value("followup"),
+        id=F("complaint_id"),
+        followup_id=F("id"),
+        sitting=F("number"),
+        complaint=F("complaint__complaint"),
+        followup=F("title"),
+        completed=F("completed"),
+    )
+    complaints = (
+        models.Complaint.objects.filter(date=date)
+        .annotate(**complaint_columns)
+        .values(*complaint_columns)
+    )
+    followups = (
+        models.FollowUp.objects.filter(date=date)
+        .annotate(**followup_columns)
+        .values(*followup_columns)
+    )
+    entries = complaints.union(followups, all=True).order_by(
+        F("entry_time").asc(nulls_last=True), "entry_type"
+    )
+    return [
+        {column.removeprefix("entry_"): value for column, value in entry.items()}
+        for entry in entries
+    ]
 
 
 def fetch_followups_by_complaint(complaint_id):
@@ -415,29 +864,27 @@ def is_valid_uuid(uuid_string):
 def create_followup(complaint_id, followup_data):
     """
     - Checks if complaint_id is valid or not then creates a followup with
-    serialized data
+    serialized data, complaint_id is written directly
     - Errors Handled:
         1. Invalid UUID for complaint_id
-        2. Non-existent complaint_id
+        2. Non-existent complaint_id (foreign key violation)
         3. Duplicate constraint (complaint, number)
     """
     if not is_valid_uuid(complaint_id):
         return "Invalid followup, chief complaint is not registered"
 
-    try:
-        complaint_data = models.Complaint.objects.get(id=complaint_id)
-    except models.Complaint.DoesNotExist:
-        return "Invalid followup, chief complaint is not registered"
     try:
         models.FollowUp.objects.create(
-            complaint=complaint_data,
+            complaint_id=complaint_id,
             title=followup_data["title"],
             description=followup_data["description"],
             date=followup_data["date"],
             time=followup_data["time"],
             number=followup_data["number"],
         )
-    except IntegrityError:
+    except IntegrityError as error:
+        if is_foreign_key_violation(error):
+            return "Invalid followup, chief complaint is not registered"
         return "Duplicate followup, it already exists"
     return None
 
@@ -464,108 +911,273 @@ def update_followup(followup_data):
 def delete_followup(followup_id):
     """
     - Deletes the followup using followup_id
-    - Also deletes the associated prescriptions with it
+    - Also deletes the prescriptions of its sitting, names of the medications
+    removed are fetched with one query and both deletes are set-based
+    Returns number, names of removed medications, error and code
     """
-    try:
-        with transaction.atomic():
+    with transaction.atomic():
+        try:
             followup_to_delete = models.FollowUp.objects.get(id=followup_id)
-            sitting = followup_to_delete.number
-            complaint = followup_to_delete.complaint
-            prescriptions_to_delete, error = fetch_patients_prescriptions(
-                complaint.id, sitting
+        except models.FollowUp.DoesNotExist:
+            return (
+                None,
+                None,
+                "Invalid follwoup, it does not exist",
+                status.HTTP_404_NOT_FOUND,
             )
-            if error:
-                return None, error, status.HTTP_404_NOT_FOUND
-            for prescription in prescriptions_to_delete:
-                id = prescription["id"]
-                name, error = delete_patient_prescription(id)
-                if error:
-                    return None, error, status.HTTP_404_NOT_FOUND
-            followup_to_delete.delete()
+        sitting = followup_to_delete.number
+        prescriptions_to_delete = models.PatientPrescription.objects.filter(
+            complaint_id=followup_to_delete.complaint_id, sitting=sitting
+        )
+        names = list(
+            prescriptions_to_delete.values_list("prescription__name", flat=True)
+        )
+        # PatientPrescription has no delete signals (the change log is a
+        # trigger), so Django fast-deletes this as a single DELETE
+        prescriptions_to_delete.delete()
+        followup_to_delete.delete()
+    return sitting, names, None, None
 
-    except models.FollowUp.DoesNotExist:
-        return None, "Invalid follwoup, it does not exist", status.HTTP_404_NOT_FOUND
-    return sitting, None, None
+
+def finalize_sitting(sitting_data):
+    """
+    Writes a whole sitting (diagnoses, prescriptions, next followup, discount,
+    consultation) in one transaction, one bulk_create per table
+    - Everything is checked before writing, lookups are one query per table
+    - Any conflict and nothing is written
+    1. Invalid complaint
+    2. Invalid followup for sitting
+    3. Conflicts: [{"field", "index", "error"}] invalid or duplicate items
+    4. Success: counts of what was saved
+    Returns saved, conflicts, error, error_code
+    """
+    try:
+        complaint = models.Complaint.objects.get(id=sitting_data["complaint"])
+    except models.Complaint.DoesNotExist:
+        return None, None, "Invalid complaint", status.HTTP_404_NOT_FOUND
+    sitting = sitting_data["sitting"]
+    if (
+        sitting
+        and not models.FollowUp.objects.filter(
+            complaint=complaint, number=sitting
+        ).exists()
+    ):
+        return None, None, "Invalid followup for sitting", status.HTTP_404_NOT_FOUND
+
+    diagnoses = sitting_data["diagnoses"]
+    prescriptions = sitting_data["prescriptions"]
+    followup = sitting_data.get("followup")
+    conflicts = []
+
+    treatments = catalog.treatments_in(
+        set(diagnosis["treatment"] for diagnosis in diagnoses)
+    )
+    new_diagnoses, diagnosis_conflicts = diagnoses_to_create(
+        [{**diagnosis, "complaint": complaint.id} for diagnosis in diagnoses],
+        treatments,
+    )
+    conflicts += diagnosis_conflicts
+    if sitting_data["consultation"]:
+        treatment = catalog.treatment_by_name("Consultation")
+        if treatment is None:
+            conflicts.append(
+                {"field": "consultation", "index": 0, "error": "Treatment not found"}
+            )
+        else:
+            new_diagnoses.append(
+                models.Diagnosis(
+                    complaint=complaint, treatment=treatment, price=treatment.price
+                )
+            )
+
+    # Medications from the catalog, duplicates checked with one query
+    medications = catalog.prescriptions_in(
+        set(prescription["prescription"] for prescription in prescriptions)
+    )
+    existing_prescriptions = set(
+        models.PatientPrescription.objects.filter(
+            complaint=complaint, sitting=sitting
+        ).values_list("prescription_id", flat=True)
+    )
+    new_prescriptions = []
+    for i, prescription in enumerate(prescriptions):
+        medication = medications.get(prescription["prescription"])
+        if medication is None:
+            conflicts.append(
+                {
+                    "field": "prescriptions",
+                    "index": i,
+                    "error": "Invalid medication, coudn't save prescription",
+                }
+            )
+        elif medication.id in existing_prescriptions:
+            conflicts.append(
+                {
+                    "field": "prescriptions",
+                    "index": i,
+                    "error": f"{medication.name} is a duplicate entry cannot save it",
+                }
+            )
+        else:
+            existing_prescriptions.add(medication.id)
+            new_prescriptions.append(
+                models.PatientPrescription(
+                    complaint=complaint,
+                    prescription=medication,
+                    sitting=sitting,
+                    days=prescription["days"],
+                    dosage=prescription["dosage"],
+                )
+            )
+
+    if (
+        followup
+        and models.FollowUp.objects.filter(
+            complaint=complaint, number=followup["number"]
+        ).exists()
+    ):
+        conflicts.append(
+            {
+                "field": "followup",
+                "index": 0,
+                "error": "Duplicate followup, it already exists",
+            }
+        )
+
+    if conflicts:
+        return None, conflicts, "Sitting was not saved", status.HTTP_409_CONFLICT
+
+    try:
+        with transaction.atomic():
+            models.Diagnosis.objects.bulk_create(new_diagnoses)
+            models.PatientPrescription.objects.bulk_create(new_prescriptions)
+            if followup:
+                models.FollowUp.objects.create(complaint=complaint, **followup)
+            if "discount" in sitting_data:
+                models.Discount.objects.bulk_create(
+                    [
+                        models.Discount(
+                            complaint=complaint, discount=sitting_data["discount"]
+                        )
+                    ],
+                    update_conflicts=True,
+                    unique_fields=["complaint"],
+                    update_fields=["discount", "updated_at"],
+                )
+    except IntegrityError:
+        return (
+            None,
+            None,
+            "Sitting was changed while saving, try again",
+            status.HTTP_409_CONFLICT,
+        )
+    saved = {
+        "diagnoses": len(new_diagnoses),
+        "prescriptions": len(new_prescriptions),
+        "followup": bool(followup),
+        "discount": "discount" in sitting_data,
+    }
+    return saved, None, None, None
 
 
 def create_or_update_discount(discount_data):
     """
-    Creating for the very first time
-    1. Checks if complaint exists
-    2. Creates new discount if discount doesn't exist
-    3. Updates discount if it exists
+    Creates the discount of a complaint or updates it if it exists, in one
+    INSERT ... ON CONFLICT UPDATE
+    1. Invalid complaint (foreign key violation)
+    2. Success
     """
+    complaint_id = discount_data["complaint"]
     try:
-        complaint = models.Complaint.objects.get(id=discount_data["complaint"])
-        discount_to_update = models.Discount.objects.get(complaint=complaint)
-        discount_to_update.discount = discount_data["discount"]
-        discount_to_update.save()
-    except models.Complaint.DoesNotExist:
-        return "Can't create discount, invalid complaint", status.HTTP_404_NOT_FOUND
-    except models.Discount.DoesNotExist:
-        models.Discount.objects.create(
-            complaint=complaint,
-            discount=discount_data["discount"],
+        models.Discount.objects.bulk_create(
+            [
+                models.Discount(
+                    complaint_id=complaint_id, discount=discount_data["discount"]
+                )
+            ],
+            update_conflicts=True,
+            unique_fields=["complaint"],
+            update_fields=["discount", "updated_at"],
         )
+    except IntegrityError as error:
+        if is_foreign_key_violation(error):
+            return (
+                "Can't create discount, invalid complaint",
+                status.HTTP_404_NOT_FOUND,
+            )
+        raise
     return None, None
 
 
 def fetch_discount(complaint_id):
     """
     Fetch the bill given the complaint id
+    - one query when there is a discount, complaint only checked without one
     1. Check if bill exists for complaint
     2. Success
     """
-    try:
-        complaint = models.Complaint.objects.get(id=complaint_id)
-        discount = models.Discount.objects.get(complaint=complaint)
-        discount = model_to_dict(discount)
-    except models.Complaint.DoesNotExist:
+    discount = (
+        models.Discount.objects.filter(complaint_id=complaint_id)
+        .values("complaint", "discount")
+        .first()
+    )
+    if discount:
+        return discount, None, None
+    if not models.Complaint.objects.filter(id=complaint_id).exists():
         return (
             None,
             "Complaint doesn't exist for this complaint",
             status.HTTP_404_NOT_FOUND,
         )
-    except models.Discount.DoesNotExist:
-        return {}, None, None
-    return discount, None, None
+    return {}, None, None
 
 
 def create_patient_prescription(patient_prescription_data):
     """
     Create a prescription entry for a certain sitting of complaint
+    - complaint_id and prescription_id are written directly, which one is
+    missing is only looked up when a foreign key is violated
+    - Foreign keys are checked at commit: call it in autocommit, inside an
+    outer atomic() a missing complaint/medication raises at that commit
+    instead of returning 404
     1. Invalid complaint
     2. Invalid prescription
     3. Integrity error with duplicate medication
     4. Success
     """
-    try:
-        complaint = models.Complaint.objects.get(
-            id=patient_prescription_data["complaint"]
-        )
-    except models.Complaint.DoesNotExist:
-        return "Invalid complaint, coudn't save prescription", status.HTTP_404_NOT_FOUND
-    try:
-        prescription = doc_models.Prescription.objects.get(
-            id=patient_prescription_data["prescription"]
-        )
-    except doc_models.Prescription.DoesNotExist:
-        return (
-            "Invalid medication, coudn't save prescription",
-            status.HTTP_404_NOT_FOUND,
-        )
     try:
         models.PatientPrescription.objects.create(
-            complaint=complaint,
-            prescription=prescription,
+            complaint_id=patient_prescription_data["complaint"],
+            prescription_id=patient_prescription_data["prescription"],
             sitting=patient_prescription_data["sitting"],
             days=patient_prescription_data["days"],
             dosage=patient_prescription_data["dosage"],
         )
-    except IntegrityError:
+    except IntegrityError as error:
+        if not is_foreign_key_violation(error):
+            prescription_id = patient_prescription_data["prescription"]
+            prescription = catalog.prescription(prescription_id)
+            name = (
+                prescription.name
+                if prescription
+                else Prescription.objects.filter(id=prescription_id)
+                .values_list("name", flat=True)
+                .first()
+            )
+            return (
+                f"{name} is a duplicate entry cannot save it",
+                status.HTTP_409_CONFLICT,
+            )
+        if not models.Complaint.objects.filter(
+            id=patient_prescription_data["complaint"]
+        ).exists():
+            return (
+                "Invalid complaint, coudn't save prescription",
+                status.HTTP_404_NOT_FOUND,
+            )
         return (
-            f"{prescription.name} is a duplicate entry cannot save it",
-            status.HTTP_409_CONFLICT,
+            "Invalid medication, coudn't save prescription",
+            status.HTTP_404_NOT_FOUND,
         )
     return None, None
 
@@ -625,17 +1237,14 @@ def update_patients_prescription(serializer_data):
         )
     except models.PatientPrescription.DoesNotExist:
         return "Invalid Prescription entry, coudn't update", status.HTTP_404_NOT_FOUND
-    try:
-        prescription = doc_models.Prescription.objects.get(
-            id=serializer_data["prescription"]
-        )
-    except doc_models.Prescription.DoesNotExist:
+    prescription = catalog.prescription(serializer_data["prescription"])
+    if prescription is None:
         return (
             "Invalid medication, coudn't save prescription",
             status.HTTP_404_NOT_FOUND,
         )
     try:
-        patient_prescription.prescription = prescription
+        patient_prescription.prescription_id = prescription.id
         patient_prescription.dosage = serializer_data["dosage"]
         patient_prescription.days = serializer_data["days"]
         patient_prescription.save()
@@ -647,6 +1256,135 @@ def update_patients_prescription(serializer_data):
     return None, None
 
 
+def prescriptions_diff(complaint_id, sitting, desired):
+    """
+    - desired: prescription id -> {days, dosage} the sitting should have
+    Returns PatientPrescriptions to create, to update and ids to delete
+    """
+    current = {
+        patient_prescription.prescription_id: patient_prescription
+        for patient_prescription in models.PatientPrescription.objects.filter(
+            complaint_id=complaint_id, sitting=sitting
+        )
+    }
+    to_create, to_update = [], []
+    # bulk_update doesn't run auto_now
+    now = timezone.now()
+    for prescription_id, prescription in desired.items():
+        patient_prescription = current.get(prescription_id)
+        if patient_prescription is None:
+            to_create.append(
+                models.PatientPrescription(
+                    complaint_id=complaint_id,
+                    sitting=sitting,
+                    prescription_id=prescription_id,
+                    days=prescription["days"],
+                    dosage=prescription["dosage"],
+                )
+            )
+        elif (patient_prescription.days, patient_prescription.dosage) != (
+            prescription["days"],
+            prescription["dosage"],
+        ):
+            patient_prescription.days = prescription["days"]
+            patient_prescription.dosage = prescription["dosage"]
+            patient_prescription.updated_at = now
+            to_update.append(patient_prescription)
+    to_delete = [
+        patient_prescription.id
+        for prescription_id, patient_prescription in current.items()
+        if prescription_id not in desired
+    ]
+    return to_create, to_update, to_delete
+
+
+def replace_patients_prescriptions(complaint_id, sitting, prescriptions_data):
+    """
+    Makes the prescription of a sitting exactly `prescriptions_data`
+    [{prescription, days, dosage}], diffing it against what is saved
+    - medications looked up with one query, current rows with another
+    - new ones bulk_created, changed ones bulk_updated, missing ones deleted,
+    all in one transaction holding the complaint's row lock
+    1. Invalid complaint
+    2. Invalid sitting
+    3. Same medication twice
+    4. Invalid medication
+    5. Medication or complaint deleted while saving: 409 CONFLICT
+    6. Success: counts of added, updated and removed
+    Returns changes, error, error_code
+    """
+    if not models.Complaint.objects.filter(id=complaint_id).exists():
+        return (
+            None,
+            "Invalid complaint, coudn't save prescription",
+            status.HTTP_404_NOT_FOUND,
+        )
+    if (
+        sitting
+        and not models.FollowUp.objects.filter(
+            complaint_id=complaint_id, number=sitting
+        ).exists()
+    ):
+        return (
+            None,
+            "Invalid followup, coudn't save prescription",
+            status.HTTP_404_NOT_FOUND,
+        )
+
+    desired = {}
+    for prescription in prescriptions_data:
+        if prescription["prescription"] in desired:
+            return (
+                None,
+                "Same medication can't be prescribed twice in a sitting",
+                status.HTTP_400_BAD_REQUEST,
+            )
+        desired[prescription["prescription"]] = prescription
+    medications = catalog.prescriptions_in(desired.keys())
+    if len(medications) != len(desired):
+        return (
+            None,
+            "Invalid medication, coudn't save prescription",
+            status.HTTP_404_NOT_FOUND,
+        )
+
+    try:
+        with transaction.atomic():
+            # saves of a complaint's prescriptions take turns on its row, the
+            # diff is read under that lock
+            if (
+                not models.Complaint.objects.select_for_update()
+                .filter(id=complaint_id)
+                .exists()
+            ):
+                return (
+                    None,
+                    "Invalid complaint, coudn't save prescription",
+                    status.HTTP_404_NOT_FOUND,
+                )
+            to_create, to_update, to_delete = prescriptions_diff(
+                complaint_id, sitting, desired
+            )
+            models.PatientPrescription.objects.bulk_create(to_create)
+            models.PatientPrescription.objects.bulk_update(
+                to_update, ["days", "dosage", "updated_at"]
+            )
+            if to_delete:
+                models.PatientPrescription.objects.filter(id__in=to_delete).delete()
+    except IntegrityError:
+        return (
+            None,
+            "Prescription was changed while saving, try again",
+            status.HTTP_409_CONFLICT,
+        )
+    counts = {
+        "added": len(to_create),
+        "updated": len(to_update),
+        "removed": len(to_delete),
+    }
+    return counts, None, None
+
+
 def delete_patient_prescription(patient_prescription_id):
     """
     Delete a prescription from patient's complaint/followup
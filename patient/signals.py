@@ -0,0 +1,60 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_migrate, post_save
+from django.dispatch import receiver
+from authentication.models import User
+from . import changes
+from . import directory
+from . import models
+from . import waiting_list
+
+# Directory changes and waiting list notifications are applied once the
+# write is committed, a rolled back transaction leaves them untouched. The
+# sync's change log is written by triggers (changes.py), installed after
+# every migrate
+
+
+@receiver(post_save, sender=User)
+def save_user(sender, instance, **kwargs):
+    transaction.on_commit(lambda: directory.patient_directory.save_patient(instance))
+
+
+@receiver(post_save, sender=models.Details)
+def save_details(sender, instance, **kwargs):
+    transaction.on_commit(
+        lambda: directory.patient_directory.save_patient(
+            instance.id, instance.date_of_birth
+        )
+    )
+
+
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=models.Details)
+def delete_patient(sender, instance, **kwargs):
+    user_id = instance.pk
+    transaction.on_commit(lambda: directory.patient_directory.delete_patient(user_id))
+
+
+@receiver(post_save, sender=models.Complaint)
+@receiver(post_delete, sender=models.Complaint)
+def change_complaint(sender, instance, **kwargs):
+    complaint_id = instance.pk
+    # robust: the write is already committed, a failed NOTIFY only costs
+    # the dashboards this update (logged), never a 500
+    transaction.on_commit(
+        lambda: waiting_list.notify("complaint", complaint_id), robust=True
+    )
+
+
+@receiver(post_save, sender=models.FollowUp)
+@receiver(post_delete, sender=models.FollowUp)
+def change_followup(sender, instance, **kwargs):
+    followup_id = instance.pk
+    transaction.on_commit(
+        lambda: waiting_list.notify("followup", followup_id), robust=True
+    )
+
+
+@receiver(post_migrate)
+def install_change_log(sender, using, **kwargs):
+    if sender.name == "patient":
+        changes.install_triggers(using)
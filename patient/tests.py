@@ -1,3 +1,1402 @@
-from django.test import TestCase
+import datetime
+import uuid
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import status
+from authentication import jsonwebtokens
+from authentication.models import User
+from doctor import models as doc_models
+from doctor.catalog import catalog
+from . import models
+from . import services
+from . import timeline
+from .pagination import encode_cursor
 
-# Create your tests here.
+
+class PatientHistoryTests(TestCase):
+    def setUp(self):
+        self.patient = User.objects.create(name="John Doe", phonenumber=9876543210)
+
+    def add_complaints(self, count):
+        for i in range(count):
+            complaint = models.Complaint.objects.create(
+                user=self.patient, complaint=f"Complaint {i}"
+            )
+            for number in range(1, 4):
+                models.FollowUp.objects.create(
+                    complaint=complaint,
+                    title=f"Sitting {number}",
+                    date=datetime.date(2025, 1, number),
+                    number=number,
+                )
+
+    def test_history_query_count_is_constant(self):
+        """
+        1. Short history
+        2. Long history: same number of queries (patient, complaints, followups)
+        """
+        # 1. short history
+        self.add_complaints(1)
+        with self.assertNumQueries(3):
+            history, next_cursor, error = services.fetch_complaint_and_followup_history(
+                self.patient.id
+            )
+        self.assertIsNone(error)
+        self.assertEqual(len(history), 1)
+
+        # 2. long history
+        self.add_complaints(29)
+        with self.assertNumQueries(3):
+            history, next_cursor, error = services.fetch_complaint_and_followup_history(
+                self.patient.id
+            )
+        self.assertEqual(len(history), 30)
+        followups = list(history[0].values())[0]["followups"]
+        self.assertEqual([f["number"] for f in followups], [1, 2, 3])
+
+    def test_history_pages(self):
+        """
+        1. First page and cursor
+        2. Last page, every complaint seen once
+        """
+        self.add_complaints(5)
+
+        # 1. first page
+        history, next_cursor, error = services.fetch_complaint_and_followup_history(
+            self.patient.id, limit=3
+        )
+        self.assertEqual(len(history), 3)
+        self.assertIsNotNone(next_cursor)
+
+        # 2. last page
+        cursor_values, _ = services.pagination.decode_cursor(
+            next_cursor, services.HISTORY_CURSOR
+        )
+        rest, next_cursor, error = services.fetch_complaint_and_followup_history(
+            self.patient.id, cursor_values, limit=3
+        )
+        self.assertEqual(len(rest), 2)
+        self.assertIsNone(next_cursor)
+        seen = [list(page.keys())[0] for page in history + rest]
+        self.assertEqual(len(set(seen)), 5)
+
+    def test_history_bad_cursor(self):
+        """
+        1. Cursor of the previous page
+        2. Not a cursor, values of the wrong type, wrong number of values:
+        400 BAD REQUEST
+        """
+        self.add_complaints(2)
+        token = jsonwebtokens.create_jwt("admin", 8888888888, "Doc")
+        url = f"/p/history/{self.patient.id}/"
+        headers = {"HTTP_AUTHORIZATION": f"Bearer {token}"}
+
+        # 1. cursor of the previous page
+        response = self.client.get(f"{url}?limit=1", **headers)
+        response = self.client.get(
+            f"{url}?limit=1&cursor={response.data['next']}", **headers
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data["history"]), 1)
+
+        # 2. bad cursors
+        for values in (None, ["a", "b", "c"], ["2025-01-01"]):
+            cursor = "x" if values is None else encode_cursor(values)
+            response = self.client.get(f"{url}?cursor={cursor}", **headers)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(response.data, {"error": "Invalid cursor"})
+
+
+class DayListEtagTests(TestCase):
+    """
+    Day list ETags follow the patients and complaints their rows show, even
+    when the write skipped signals or happened in another process
+    """
+
+    def setUp(self):
+        token = jsonwebtokens.create_jwt("admin", 8888888888, "Doc")
+        self.headers = {"HTTP_AUTHORIZATION": f"Bearer {token}"}
+        self.patient = User.objects.create(name="John Doe", phonenumber=9876543210)
+        models.Details.objects.create(
+            id=self.patient, date_of_birth=datetime.date(1990, 1, 1), address="Pune"
+        )
+        self.complaint = models.Complaint.objects.create(
+            user=self.patient, complaint="Tooth ache"
+        )
+        models.FollowUp.objects.create(
+            complaint=self.complaint,
+            title="Sitting 1",
+            date=datetime.date.today(),
+            number=1,
+        )
+
+    def assertRefetched(self, url, etag):
+        """
+        Returns the new body and ETag
+        """
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag, **self.headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data, response["ETag"]
+
+    def test_etags_follow_joined_rows(self):
+        """
+        1. Nothing changed: 304 NOT MODIFIED
+        2. Patient renamed
+        3. Date of birth changed
+        4. Complaint edited, shown by followup rows
+        """
+        etags = {}
+        for url in ("/p/complaints/", "/p/followup/", "/p/dashboard/"):
+            etags[url] = self.client.get(url, **self.headers)["ETag"]
+
+            # 1. nothing changed
+            response = self.client.get(
+                url, HTTP_IF_NONE_MATCH=etags[url], **self.headers
+            )
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # 2. rename
+        User.objects.filter(id=self.patient.id).update(name="Jane Doe")
+        data, etags["/p/complaints/"] = self.assertRefetched(
+            "/p/complaints/", etags["/p/complaints/"]
+        )
+        self.assertEqual(data["complaints"][0]["name"], "Jane Doe")
+        data, etags["/p/followup/"] = self.assertRefetched(
+            "/p/followup/", etags["/p/followup/"]
+        )
+        self.assertEqual(data["followups"][0]["name"], "Jane Doe")
+        data, etags["/p/dashboard/"] = self.assertRefetched(
+            "/p/dashboard/", etags["/p/dashboard/"]
+        )
+        self.assertEqual({entry["name"] for entry in data["entries"]}, {"Jane Doe"})
+
+        # 3. date of birth
+        models.Details.objects.filter(id=self.patient.id).update(
+            date_of_birth=datetime.date(2000, 1, 1), updated_at=timezone.now()
+        )
+        for url in ("/p/complaints/", "/p/followup/", "/p/dashboard/"):
+            _, etags[url] = self.assertRefetched(url, etags[url])
+
+        # 4. complaint edited
+        models.Complaint.objects.filter(id=self.complaint.id).update(
+            complaint="Bleeding gums", updated_at=timezone.now()
+        )
+        data, _ = self.assertRefetched("/p/followup/", etags["/p/followup/"])
+        self.assertEqual(
+            data["followups"][0]["complaint_object"]["complaint"], "Bleeding gums"
+        )
+
+
+class WaitingListEventsTests(TestCase):
+    def test_events_errors(self):
+        """
+        Errors use the {"error": ...} shape of every other view
+        1. Not GET: 405 METHOD NOT ALLOWED
+        2. No token, not a staff token: 401 UNAUTHORIZED
+        """
+        url = "/p/waiting_list/events/"
+
+        # 1. not GET
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+        self.assertEqual(response.json(), {"error": 'Method "POST" not allowed.'})
+
+        # 2. no token, patient token
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(response.json(), {"error": "Authorization token missing"})
+        token = jsonwebtokens.create_jwt("patient", 9876543210, "John Doe")
+        response = self.client.get(f"{url}?token={token}")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(list(response.json()), ["error"])
+
+
+class TimelineTests(TestCase):
+    def setUp(self):
+        self.patient = User.objects.create(name="John Doe", phonenumber=9876543210)
+        self.complaint = models.Complaint.objects.create(
+            user=self.patient, complaint="Tooth ache"
+        )
+        self.treatment = doc_models.Treatment.objects.create(name="RCT", price=5000)
+        cache.clear()
+
+    def test_timeline_cache(self):
+        """
+        1. Built on the first read
+        2. Repeat read: served from the cache, only the validators query
+        3. Record added, treatment renamed: rebuilt
+        4. Unknown patient
+        """
+        # 1. first read
+        chart, error = timeline.fetch_timeline(self.patient.id)
+        self.assertIsNone(error)
+        self.assertEqual(chart[0]["diagnoses"], [])
+
+        # 2. repeat read
+        with self.assertNumQueries(1):
+            self.assertEqual(timeline.fetch_timeline(self.patient.id)[0], chart)
+
+        # 3. writes
+        models.Diagnosis.objects.create(
+            complaint=self.complaint,
+            treatment=self.treatment,
+            tooth_number=11,
+            price=5000,
+        )
+        chart, _ = timeline.fetch_timeline(self.patient.id)
+        self.assertEqual(chart[0]["diagnoses"][0]["treatment_name"], "RCT")
+        self.treatment.name = "Root Canal"
+        self.treatment.save()
+        chart, _ = timeline.fetch_timeline(self.patient.id)
+        self.assertEqual(chart[0]["diagnoses"][0]["treatment_name"], "Root Canal")
+
+        # 4. unknown patient
+        chart, error = timeline.fetch_timeline(uuid.uuid4())
+        self.assertEqual(error, "This patient does not exist")
+
+
+class WritePathTests(TestCase):
+    """
+    Writers set *_id columns directly instead of loading the parent rows,
+    counts include the on_commit callbacks (waiting list NOTIFY) so they
+    match what a request runs
+    """
+
+    def setUp(self):
+        self.patient = User.objects.create(name="John Doe", phonenumber=9876543210)
+        self.complaint = models.Complaint.objects.create(
+            user=self.patient, complaint="Tooth ache"
+        )
+        self.treatment = doc_models.Treatment.objects.create(name="RCT", price=5000)
+        self.medication = doc_models.Prescription.objects.create(
+            name="Amoxicillin", type="Tablet"
+        )
+        # catalog reloads with the rows of this test
+        cache.clear()
+
+    def test_create_diagnosis_queries(self):
+        # treatment comes from the catalog, only the insert
+        catalog.treatment(self.treatment.id)
+        with (
+            self.assertNumQueries(1),
+            self.captureOnCommitCallbacks(execute=True),
+        ):
+            error, _ = services.create_diagnosis(
+                {
+                    "complaint": self.complaint.id,
+                    "treatment": self.treatment.id,
+                    "tooth_number": 11,
+                }
+            )
+        self.assertIsNone(error)
+
+    def test_create_followup_queries(self):
+        # insert and NOTIFY
+        with (
+            self.assertNumQueries(2),
+            self.captureOnCommitCallbacks(execute=True),
+        ):
+            error = services.create_followup(
+                str(self.complaint.id),
+                {
+                    "title": "Sitting 1",
+                    "description": "",
+                    "date": datetime.date(2025, 1, 1),
+                    "time": None,
+                    "number": 1,
+                },
+            )
+        self.assertIsNone(error)
+
+    def test_create_patient_prescription_queries(self):
+        with (
+            self.assertNumQueries(1),
+            self.captureOnCommitCallbacks(execute=True),
+        ):
+            error, _ = services.create_patient_prescription(
+                {
+                    "complaint": self.complaint.id,
+                    "prescription": self.medication.id,
+                    "sitting": 0,
+                    "days": 3,
+                    "dosage": "OD",
+                }
+            )
+        self.assertIsNone(error)
+
+    def test_discount_queries(self):
+        """
+        1. Create
+        2. Update
+        3. Fetch
+        """
+        # 1. create
+        with (
+            self.assertNumQueries(1),
+            self.captureOnCommitCallbacks(execute=True),
+        ):
+            services.create_or_update_discount(
+                {"complaint": self.complaint.id, "discount": 100}
+            )
+
+        # 2. update
+        with (
+            self.assertNumQueries(1),
+            self.captureOnCommitCallbacks(execute=True),
+        ):
+            services.create_or_update_discount(
+                {"complaint": self.complaint.id, "discount": 200}
+            )
+
+        # 3. fetch
+        with self.assertNumQueries(1):
+            discount, error, _ = services.fetch_discount(self.complaint.id)
+        self.assertEqual(discount["discount"], 200)
+
+    def test_catalog_miss_reloads(self):
+        """
+        Rows created by another process (no stamp bump reaches this one) are
+        found by the writes before the catalog's TTL
+        1. Diagnosis with the new treatment
+        2. Prescription switched to the new medication
+        3. Unknown ids are still not found
+        """
+        catalog.current()
+        treatment, medication = (
+            doc_models.Treatment.objects.bulk_create(
+                [doc_models.Treatment(name="Crown", price=8000)]
+            )[0],
+            doc_models.Prescription.objects.bulk_create(
+                [doc_models.Prescription(name="Ibuprofen", type="Tablet")]
+            )[0],
+        )
+
+        # 1. new treatment
+        error, _ = services.create_diagnosis(
+            {
+                "complaint": self.complaint.id,
+                "treatment": treatment.id,
+                "tooth_number": 11,
+            }
+        )
+        self.assertIsNone(error)
+        self.assertEqual(
+            models.Diagnosis.objects.get(complaint=self.complaint).price, 8000
+        )
+
+        # 2. new medication
+        patient_prescription = models.PatientPrescription.objects.create(
+            complaint=self.complaint,
+            sitting=0,
+            prescription=self.medication,
+            days=3,
+            dosage="OD",
+        )
+        error, _ = services.update_patients_prescription(
+            {
+                "id": patient_prescription.id,
+                "prescription": medication.id,
+                "days": 3,
+                "dosage": "OD",
+            }
+        )
+        self.assertIsNone(error)
+
+        # 3. unknown ids
+        self.assertIsNone(catalog.treatment(uuid.uuid4()))
+        self.assertEqual(catalog.prescriptions_in([uuid.uuid4()]), {})
+
+    def test_delete_followup_queries(self):
+        """
+        Savepoint, followup, medication names, one DELETE per table, release
+        and the waiting list's NOTIFY, however many prescriptions it had
+        """
+        followup = models.FollowUp.objects.create(
+            complaint=self.complaint,
+            title="Sitting 1",
+            date=datetime.date(2025, 1, 1),
+            number=1,
+        )
+        for i in range(3):
+            medication = doc_models.Prescription.objects.create(
+                name=f"Medication {i}", type="Tablet"
+            )
+            models.PatientPrescription.objects.create(
+                complaint=self.complaint,
+                sitting=1,
+                prescription=medication,
+                days=3,
+                dosage="OD",
+            )
+        with (
+            self.assertNumQueries(7),
+            self.captureOnCommitCallbacks(execute=True),
+        ):
+            sitting, names, error, _ = services.delete_followup(followup.id)
+        self.assertIsNone(error)
+        self.assertEqual(
+            sorted(names), ["Medication 0", "Medication 1", "Medication 2"]
+        )
+        self.assertFalse(
+            models.PatientPrescription.objects.filter(
+                complaint=self.complaint, sitting=1
+            ).exists()
+        )
+
+
+class ReplacePrescriptionsTests(TestCase):
+    """
+    prescription/<complaint_id>/<sitting>/ PUT: the sitting's prescription
+    becomes exactly the list sent
+    """
+
+    def setUp(self):
+        token = jsonwebtokens.create_jwt("dentist", 8888888888, "Doc")
+        self.headers = {"HTTP_AUTHORIZATION": f"Bearer {token}"}
+        self.patient = User.objects.create(name="John Doe", phonenumber=9876543210)
+        self.complaint = models.Complaint.objects.create(
+            user=self.patient, complaint="Tooth ache"
+        )
+        models.FollowUp.objects.create(
+            complaint=self.complaint,
+            title="Sitting 1",
+            date=datetime.date(2025, 1, 1),
+            number=1,
+        )
+        self.kept, self.changed, self.removed, self.added = (
+            doc_models.Prescription.objects.create(name=name, type="Tablet")
+            for name in ("Amoxicillin", "Ibuprofen", "Metronidazole", "Paracetamol")
+        )
+        self.saved = {
+            medication.id: models.PatientPrescription.objects.create(
+                complaint=self.complaint,
+                sitting=sitting,
+                prescription=medication,
+                days=3,
+                dosage="OD",
+            ).id
+            for medication, sitting in (
+                (self.kept, 0),
+                (self.changed, 0),
+                (self.removed, 0),
+                (self.added, 1),
+            )
+        }
+        # catalog reloads with the rows of this test
+        cache.clear()
+
+    def put_prescriptions(self, prescriptions):
+        return self.client.put(
+            f"/p/prescription/{self.complaint.id}/0/",
+            [
+                {"prescription": str(medication.id), "days": days, "dosage": dosage}
+                for medication, days, dosage in prescriptions
+            ],
+            content_type="application/json",
+            **self.headers,
+        )
+
+    def saved_prescriptions(self):
+        return set(
+            models.PatientPrescription.objects.values_list(
+                "id", "sitting", "prescription_id", "days", "dosage"
+            )
+        )
+
+    def test_replace_diff(self):
+        """
+        Unchanged rows are kept, changed ones updated in place, missing ones
+        deleted and new ones inserted, other sittings aren't touched
+        """
+        response = self.put_prescriptions(
+            [
+                (self.kept, 3, "OD"),
+                (self.changed, 5, "BD"),
+                (self.added, 3, "OD"),
+            ]
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.data["changes"], {"added": 1, "updated": 1, "removed": 1}
+        )
+        added = models.PatientPrescription.objects.get(
+            sitting=0, prescription=self.added
+        )
+        self.assertEqual(
+            self.saved_prescriptions(),
+            {
+                (self.saved[self.kept.id], 0, self.kept.id, 3, "OD"),
+                (self.saved[self.changed.id], 0, self.changed.id, 5, "BD"),
+                (added.id, 0, self.added.id, 3, "OD"),
+                (self.saved[self.added.id], 1, self.added.id, 3, "OD"),
+            },
+        )
+
+    def test_replace_errors(self):
+        """
+        Nothing changes on
+        1. Same medication twice: 400 BAD REQUEST
+        2. Unknown medication: 404 NOT FOUND
+        """
+        before = self.saved_prescriptions()
+
+        # 1. same medication twice
+        response = self.put_prescriptions([(self.kept, 3, "OD"), (self.kept, 5, "BD")])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            response.data,
+            {"error": "Same medication can't be prescribed twice in a sitting"},
+        )
+        self.assertEqual(self.saved_prescriptions(), before)
+
+        # 2. unknown medication
+        unknown = doc_models.Prescription(id=uuid.uuid4())
+        response = self.put_prescriptions([(self.kept, 5, "BD"), (unknown, 3, "OD")])
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(
+            response.data, {"error": "Invalid medication, coudn't save prescription"}
+        )
+        self.assertEqual(self.saved_prescriptions(), before)
+
+
+class SittingTests(TestCase):
+    """
+    sitting/ POST: a whole sitting is saved or nothing is
+    """
+
+    def setUp(self):
+        token = jsonwebtokens.create_jwt("dentist", 8888888888, "Doc")
+        self.headers = {"HTTP_AUTHORIZATION": f"Bearer {token}"}
+        self.patient = User.objects.create(name="John Doe", phonenumber=9876543210)
+        self.complaint = models.Complaint.objects.create(
+            user=self.patient, complaint="Tooth ache"
+        )
+        self.treatment = doc_models.Treatment.objects.create(name="RCT", price=5000)
+        self.medication = doc_models.Prescription.objects.create(
+            name="Amoxicillin", type="Tablet"
+        )
+        # catalog reloads with the rows of this test
+        cache.clear()
+
+    def post_sitting(self, **sitting):
+        return self.client.post(
+            "/p/sitting/",
+            {"complaint": str(self.complaint.id), "sitting": 0, **sitting},
+            content_type="application/json",
+            **self.headers,
+        )
+
+    def assertNothingSaved(self):
+        for model in (
+            models.Diagnosis,
+            models.PatientPrescription,
+            models.FollowUp,
+            models.Discount,
+        ):
+            self.assertFalse(model.objects.exists(), model.__name__)
+
+    def test_sitting_saved(self):
+        """
+        Every part written in one transaction (the test's own one turns it
+        into a savepoint), checks before it only read
+        """
+        doc_models.Treatment.objects.create(name="Consultation", price=300)
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post_sitting(
+                diagnoses=[
+                    {"treatment": str(self.treatment.id), "tooth_number": 11},
+                    {"treatment": str(self.treatment.id), "tooth_number": 12},
+                ],
+                prescriptions=[
+                    {"prescription": str(self.medication.id), "days": 3, "dosage": "OD"}
+                ],
+                followup={
+                    "title": "Sitting 1",
+                    "description": "",
+                    "date": "2025-01-08",
+                    "time": "10:00:00",
+                    "number": 1,
+                },
+                discount=500,
+                consultation=True,
+            )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        statements = [query["sql"].split()[0] for query in queries.captured_queries]
+        start = statements.index("SAVEPOINT")
+        self.assertNotIn("INSERT", statements[:start])
+        self.assertEqual(
+            statements[start:], ["SAVEPOINT"] + ["INSERT"] * 4 + ["RELEASE"]
+        )
+        self.assertEqual(
+            response.data["saved"],
+            {"diagnoses": 3, "prescriptions": 1, "followup": True, "discount": True},
+        )
+        self.assertCountEqual(
+            models.Diagnosis.objects.filter(complaint=self.complaint).values_list(
+                "treatment__name", "tooth_number", "price"
+            ),
+            [("Consultation", None, 300), ("RCT", 11, 5000), ("RCT", 12, 5000)],
+        )
+        prescription = models.PatientPrescription.objects.get(complaint=self.complaint)
+        self.assertEqual(
+            (prescription.sitting, prescription.prescription_id, prescription.days),
+            (0, self.medication.id, 3),
+        )
+        self.assertEqual(
+            models.FollowUp.objects.get(complaint=self.complaint).number, 1
+        )
+        self.assertEqual(
+            models.Discount.objects.get(complaint=self.complaint).discount, 500
+        )
+
+    def test_sitting_conflicts(self):
+        """
+        One invalid item and nothing of the sitting is saved, every conflict
+        is listed
+        """
+        response = self.post_sitting(
+            diagnoses=[
+                {"treatment": str(self.treatment.id), "tooth_number": 11},
+                {"treatment": str(uuid.uuid4()), "tooth_number": 12},
+            ],
+            prescriptions=[
+                {"prescription": str(uuid.uuid4()), "days": 3, "dosage": "OD"},
+                {"prescription": str(self.medication.id), "days": 3, "dosage": "OD"},
+            ],
+            discount=500,
+        )
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data["error"], "Sitting was not saved")
+        self.assertEqual(
+            response.data["conflicts"],
+            [
+                {"field": "diagnoses", "index": 1, "error": "Treatment not found"},
+                {
+                    "field": "prescriptions",
+                    "index": 0,
+                    "error": "Invalid medication, coudn't save prescription",
+                },
+            ],
+        )
+        self.assertNothingSaved()
+
+    def test_sitting_consultation_without_treatment(self):
+        response = self.post_sitting(
+            diagnoses=[{"treatment": str(self.treatment.id), "tooth_number": 11}],
+            consultation=True,
+        )
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(
+            response.data["conflicts"],
+            [{"field": "consultation", "index": 0, "error": "Treatment not found"}],
+        )
+        self.assertNothingSaved()
+
+    def test_sitting_not_found(self):
+        """
+        1. Invalid complaint
+        2. Sitting without its followup
+        """
+        # 1. invalid complaint
+        response = self.client.post(
+            "/p/sitting/",
+            {"complaint": str(uuid.uuid4()), "sitting": 0},
+            content_type="application/json",
+            **self.headers,
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(response.data, {"error": "Invalid complaint"})
+
+        # 2. no followup 2
+        response = self.post_sitting(sitting=2)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(response.data, {"error": "Invalid followup for sitting"})
+
+
+class DiagnosesBatchTests(TestCase):
+    """
+    diagnosis/ POST with a list: what can be saved is, the rest is listed
+    """
+
+    def setUp(self):
+        token = jsonwebtokens.create_jwt("dentist", 8888888888, "Doc")
+        self.headers = {"HTTP_AUTHORIZATION": f"Bearer {token}"}
+        self.patient = User.objects.create(name="John Doe", phonenumber=9876543210)
+        self.complaint = models.Complaint.objects.create(
+            user=self.patient, complaint="Tooth ache"
+        )
+        self.treatment = doc_models.Treatment.objects.create(name="RCT", price=5000)
+        models.Diagnosis.objects.create(
+            complaint=self.complaint,
+            treatment=self.treatment,
+            tooth_number=11,
+            price=5000,
+        )
+        # catalog reloads with the rows of this test
+        cache.clear()
+
+    def post_diagnoses(self, diagnoses):
+        return self.client.post(
+            "/p/diagnosis/",
+            [
+                {
+                    "complaint": str(complaint),
+                    "treatment": str(treatment),
+                    "tooth_number": tooth_number,
+                }
+                for complaint, treatment, tooth_number in diagnoses
+            ],
+            content_type="application/json",
+            **self.headers,
+        )
+
+    def test_mixed_batch(self):
+        """
+        Valid, duplicate of a saved one, unknown complaint, unknown treatment
+        and duplicate within the batch: only the valid one is saved
+        """
+        response = self.post_diagnoses(
+            [
+                (self.complaint.id, self.treatment.id, 12),
+                (self.complaint.id, self.treatment.id, 11),
+                (uuid.uuid4(), self.treatment.id, 13),
+                (self.complaint.id, uuid.uuid4(), 14),
+                (self.complaint.id, self.treatment.id, 12),
+            ]
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["message"], "1 diagnoses have been saved!")
+        self.assertEqual(
+            response.data["conflicts"],
+            [
+                {
+                    "field": "diagnoses",
+                    "index": 1,
+                    "error": "For tooth 11, RCT diagnosis already exists",
+                },
+                {
+                    "field": "diagnoses",
+                    "index": 2,
+                    "error": "For 13 Invalid chief-complaint",
+                },
+                {"field": "diagnoses", "index": 3, "error": "Treatment not found"},
+                {
+                    "field": "diagnoses",
+                    "index": 4,
+                    "error": "For tooth 12, RCT diagnosis already exists",
+                },
+            ],
+        )
+        self.assertEqual(
+            sorted(
+                models.Diagnosis.objects.filter(complaint=self.complaint).values_list(
+                    "tooth_number", flat=True
+                )
+            ),
+            [11, 12],
+        )
+
+    def test_batch_without_valid_entries(self):
+        """
+        Nothing saved: 409 CONFLICT with the conflicts
+        """
+        response = self.post_diagnoses(
+            [
+                (self.complaint.id, self.treatment.id, 11),
+                (uuid.uuid4(), self.treatment.id, 13),
+            ]
+        )
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data["error"], "No diagnosis was saved")
+        self.assertEqual(
+            [conflict["index"] for conflict in response.data["conflicts"]], [0, 1]
+        )
+        self.assertEqual(models.Diagnosis.objects.count(), 1)
+
+    def test_single_unknown_treatment(self):
+        """
+        A single diagnosis (not a list) that can't be saved: 404 NOT FOUND
+        """
+        response = self.client.post(
+            "/p/diagnosis/",
+            {
+                "complaint": str(self.complaint.id),
+                "treatment": str(uuid.uuid4()),
+                "tooth_number": 13,
+            },
+            content_type="application/json",
+            **self.headers,
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(response.data, {"error": "For 13 Invalid chief-complaint"})
+        self.assertEqual(models.Diagnosis.objects.count(), 1)
+
+
+class WritePathErrorTests(TransactionTestCase):
+    """
+    Foreign key and unique violations map to the old error messages
+    (autocommit, foreign keys are only checked at commit)
+    """
+
+    def setUp(self):
+        self.patient = User.objects.create(name="John Doe", phonenumber=9876543210)
+        self.complaint = models.Complaint.objects.create(
+            user=self.patient, complaint="Tooth ache"
+        )
+        self.treatment = doc_models.Treatment.objects.create(name="RCT", price=5000)
+        self.medication = doc_models.Prescription.objects.create(
+            name="Amoxicillin", type="Tablet"
+        )
+        # catalog reloads with the rows of this test
+        cache.clear()
+
+    def test_create_diagnosis_errors(self):
+        """
+        1. Invalid complaint
+        2. Duplicate diagnosis
+        """
+        diagnosis = {
+            "complaint": uuid.uuid4(),
+            "treatment": self.treatment.id,
+            "tooth_number": 11,
+        }
+        # 1. invalid complaint
+        error, code = services.create_diagnosis(diagnosis)
+        self.assertEqual(error, "For 11 Invalid chief-complaint")
+        self.assertEqual(code, status.HTTP_404_NOT_FOUND)
+
+        # 2. duplicate diagnosis
+        diagnosis["complaint"] = self.complaint.id
+        services.create_diagnosis(diagnosis)
+        error, code = services.create_diagnosis(diagnosis)
+        self.assertEqual(error, "For tooth 11, RCT diagnosis already exists")
+        self.assertEqual(code, status.HTTP_409_CONFLICT)
+
+    def test_create_followup_errors(self):
+        """
+        1. Invalid complaint
+        2. Duplicate followup
+        """
+        followup = {
+            "title": "Sitting 1",
+            "description": "",
+            "date": datetime.date(2025, 1, 1),
+            "time": None,
+            "number": 1,
+        }
+        # 1. invalid complaint
+        error = services.create_followup(str(uuid.uuid4()), followup)
+        self.assertEqual(error, "Invalid followup, chief complaint is not registered")
+
+        # 2. duplicate followup
+        services.create_followup(str(self.complaint.id), followup)
+        error = services.create_followup(str(self.complaint.id), followup)
+        self.assertEqual(error, "Duplicate followup, it already exists")
+
+    def test_create_patient_prescription_errors(self):
+        """
+        1. Invalid complaint
+        2. Invalid medication
+        3. Duplicate medication
+        4. Duplicate of a medication the catalog hasn't loaded yet
+        """
+        prescription = {
+            "complaint": uuid.uuid4(),
+            "prescription": self.medication.id,
+            "sitting": 0,
+            "days": 3,
+            "dosage": "OD",
+        }
+        # 1. invalid complaint
+        error, code = services.create_patient_prescription(prescription)
+        self.assertEqual(error, "Invalid complaint, coudn't save prescription")
+
+        # 2. invalid medication
+        prescription["complaint"] = self.complaint.id
+        error, code = services.create_patient_prescription(
+            {**prescription, "prescription": uuid.uuid4()}
+        )
+        self.assertEqual(error, "Invalid medication, coudn't save prescription")
+
+        # 3. duplicate medication
+        services.create_patient_prescription(prescription)
+        error, code = services.create_patient_prescription(prescription)
+        self.assertEqual(error, "Amoxicillin is a duplicate entry cannot save it")
+        self.assertEqual(code, status.HTTP_409_CONFLICT)
+
+        # 4. medication created by another process
+        (medication,) = doc_models.Prescription.objects.bulk_create(
+            [doc_models.Prescription(name="Ibuprofen", type="Tablet")]
+        )
+        prescription["prescription"] = medication.id
+        services.create_patient_prescription(prescription)
+        error, code = services.create_patient_prescription(prescription)
+        self.assertEqual(error, "Ibuprofen is a duplicate entry cannot save it")
+        self.assertEqual(code, status.HTTP_409_CONFLICT)
+
+    def test_discount_errors(self):
+        """
+        1. Invalid complaint on save
+        2. Invalid complaint on fetch
+        3. No discount yet
+        """
+        # 1. invalid complaint on save
+        error, code = services.create_or_update_discount(
+            {"complaint": uuid.uuid4(), "discount": 100}
+        )
+        self.assertEqual(error, "Can't create discount, invalid complaint")
+
+        # 2. invalid complaint on fetch
+        discount, error, code = services.fetch_discount(uuid.uuid4())
+        self.assertEqual(code, status.HTTP_404_NOT_FOUND)
+
+        # 3. no discount yet
+        discount, error, code = services.fetch_discount(self.complaint.id)
+        self.assertEqual(discount, {})
+        self.assertIsNone(error)
+
+
+class ChangesTests(TransactionTestCase):
+    """
+    changes/ feed, writes are committed (autocommit) so the triggers' log is
+    what a terminal would read
+    """
+
+    def setUp(self):
+        token = jsonwebtokens.create_jwt("admin", 8888888888, "Doc")
+        self.headers = {"HTTP_AUTHORIZATION": f"Bearer {token}"}
+        self.patient = User.objects.create(name="John Doe", phonenumber=9876543210)
+
+    def sync(self, since=None, limit=None):
+        params = {}
+        if since is not None:
+            params["since"] = since
+        if limit is not None:
+            params["limit"] = limit
+        response = self.client.get("/p/changes/", params, **self.headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_changes_of_writes(self):
+        """
+        1. Insert
+        2. Update, only the latest change of a record is kept
+        3. Delete
+        """
+        # 1. insert
+        complaint = models.Complaint.objects.create(
+            user=self.patient, complaint="Tooth ache"
+        )
+        page = self.sync()
+        self.assertEqual(
+            [(change["table"], change["id"]) for change in page["changes"]],
+            [("credentials", self.patient.id), ("complaints", complaint.id)],
+        )
+        self.assertFalse(page["changes"][1]["deleted"])
+        self.assertEqual(page["changes"][1]["row"]["complaint"], "Tooth ache")
+        self.assertFalse(page["more"])
+
+        # 2. update
+        complaint.complaint = "Bleeding gums"
+        complaint.save()
+        (change,) = self.sync(page["cursor"])["changes"]
+        self.assertEqual(change["id"], complaint.id)
+        self.assertEqual(change["row"]["complaint"], "Bleeding gums")
+        self.assertEqual(models.Change.objects.filter(row_id=complaint.id).count(), 1)
+
+        # 3. delete
+        complaint.delete()
+        (change,) = self.sync(page["cursor"])["changes"]
+        self.assertEqual(change["table"], "complaints")
+        self.assertTrue(change["deleted"])
+        self.assertIsNone(change["row"])
+
+    def test_changes_of_bulk_writes(self):
+        """
+        bulk_create and queryset update() skip signals, the triggers log them
+        """
+        cursor = self.sync()["cursor"]
+        complaints = models.Complaint.objects.bulk_create(
+            [
+                models.Complaint(user=self.patient, complaint=f"Complaint {i}")
+                for i in range(3)
+            ]
+        )
+        ids = {complaint.id for complaint in complaints}
+        page = self.sync(cursor)
+        self.assertEqual({change["id"] for change in page["changes"]}, ids)
+
+        models.Complaint.objects.filter(id__in=ids).update(complaint="Tooth ache")
+        page = self.sync(page["cursor"])
+        self.assertEqual({change["id"] for change in page["changes"]}, ids)
+        self.assertEqual(
+            {change["row"]["complaint"] for change in page["changes"]}, {"Tooth ache"}
+        )
+
+    def test_changes_pages(self):
+        """
+        Following the cursor with a small limit sees every record once
+        """
+        complaints = models.Complaint.objects.bulk_create(
+            [
+                models.Complaint(user=self.patient, complaint=f"Complaint {i}")
+                for i in range(6)
+            ]
+        )
+        seen, cursor, more = [], None, True
+        while more:
+            page = self.sync(cursor, limit=2)
+            self.assertLessEqual(len(page["changes"]), 2)
+            seen += [change["id"] for change in page["changes"]]
+            cursor, more = page["cursor"], page["more"]
+        expected = [self.patient.id] + [complaint.id for complaint in complaints]
+        self.assertEqual(sorted(seen), sorted(expected))
+
+        # caught up: nothing new, same cursor
+        page = self.sync(cursor, limit=2)
+        self.assertEqual(page["changes"], [])
+        self.assertEqual(page["cursor"], cursor)
+
+    def test_changes_bad_requests(self):
+        """
+        1. Not a cursor, values of the wrong type: 400 BAD REQUEST
+        2. Limit not a positive number: 400 BAD REQUEST
+        """
+        # 1. bad cursors
+        for cursor in ("x", encode_cursor(["a", "b"]), encode_cursor([1])):
+            response = self.client.get("/p/changes/", {"since": cursor}, **self.headers)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(response.data, {"error": "Invalid cursor"})
+
+        # 2. bad limits
+        for limit in ("0", "x"):
+            response = self.client.get("/p/changes/", {"limit": limit}, **self.headers)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(response.data, {"error": "Invalid limit"})
+
+
+def query_plans(function, *args):
+    """
+    Runs function and returns the EXPLAIN output of every query it made
+    (savepoints and other statements EXPLAIN can't take are skipped)
+    """
+    with CaptureQueriesContext(connection) as queries:
+        function(*args)
+    plans = []
+    with connection.cursor() as cursor:
+        for query in queries.captured_queries:
+            statement = query["sql"].lstrip("(")
+            if not statement.startswith(("SELECT", "INSERT", "UPDATE", "DELETE")):
+                continue
+            cursor.execute("EXPLAIN " + query["sql"])
+            plans.append("\n".join(row[0] for row in cursor.fetchall()))
+    return plans
+
+
+class SeededHistoryTestCase(TestCase):
+    """
+    Three years of history: 5000 registered patients, four complaints a day
+    shared by the first 500 of them, each with a followup a week later, two
+    diagnoses, a prescription per sitting and a discount
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.today = datetime.date.today()
+        patients = User.objects.bulk_create(
+            [
+                User(
+                    name=f"Patient {i}",
+                    normalized_name=f"patient {i}",
+                    phonenumber=9000000000 + i,
+                    phonenumber_text=str(9000000000 + i),
+                )
+                for i in range(5000)
+            ]
+        )
+        models.Details.objects.bulk_create(
+            [
+                models.Details(
+                    id=patient,
+                    date_of_birth=datetime.date(1990, 1, 1),
+                    address="Pune",
+                )
+                for patient in patients
+            ]
+        )
+        complaints = models.Complaint.objects.bulk_create(
+            [
+                models.Complaint(user=patients[i % 500], complaint="Tooth ache")
+                for i in range(4 * 3 * 365)
+            ]
+        )
+        # date is auto_now, spread the complaints back in time afterwards
+        for i, complaint in enumerate(complaints):
+            complaint.date = cls.today - datetime.timedelta(days=i // 4)
+        models.Complaint.objects.bulk_update(complaints, ["date"], batch_size=1000)
+        models.FollowUp.objects.bulk_create(
+            [
+                models.FollowUp(
+                    complaint=complaint,
+                    date=complaint.date + datetime.timedelta(days=7),
+                    time=datetime.time(9 + i % 8),
+                    title="Sitting 1",
+                    number=1,
+                )
+                for i, complaint in enumerate(complaints)
+            ]
+        )
+        treatments = doc_models.Treatment.objects.bulk_create(
+            [
+                doc_models.Treatment(name="RCT", price=5000),
+                doc_models.Treatment(name="Filling", price=1000),
+            ]
+        )
+        models.Diagnosis.objects.bulk_create(
+            [
+                models.Diagnosis(
+                    complaint=complaint,
+                    tooth_number=11,
+                    treatment=treatment,
+                    price=treatment.price,
+                )
+                for complaint in complaints
+                for treatment in treatments
+            ]
+        )
+        medication = doc_models.Prescription.objects.create(
+            name="Amoxicillin", type="Tablet"
+        )
+        models.PatientPrescription.objects.bulk_create(
+            [
+                models.PatientPrescription(
+                    complaint=complaint,
+                    sitting=sitting,
+                    prescription=medication,
+                    days=3,
+                    dosage="OD",
+                )
+                for complaint in complaints
+                for sitting in (0, 1)
+            ]
+        )
+        models.Discount.objects.bulk_create(
+            [
+                models.Discount(complaint=complaint, discount=100)
+                for complaint in complaints
+            ]
+        )
+        cls.patient = patients[0]
+        cls.complaint = complaints[0]
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+
+class DashboardTests(SeededHistoryTestCase):
+    def test_dashboard_entries(self):
+        with self.assertNumQueries(1):
+            entries = services.fetch_dashboard(self.today)
+        self.assertEqual(len(entries), 8)
+        self.assertEqual(
+            sorted(entry["type"] for entry in entries),
+            ["complaint"] * 4 + ["followup"] * 4,
+        )
+        self.assertEqual({entry["age"] for entry in entries}, {self.today.year - 1990})
+        times = [entry["time"] for entry in entries]
+        self.assertEqual(times, sorted(times))
+
+    def test_dashboard_uses_date_indexes(self):
+        (plan,) = query_plans(services.fetch_dashboard, self.today)
+        self.assertNotIn("Seq Scan on complaints", plan)
+        self.assertNotIn("Seq Scan on followups", plan)
+        self.assertIn("complaint_date_time_idx", plan)
+        self.assertIn("followup_date_time_idx", plan)
+
+
+class QueryPlanTests(SeededHistoryTestCase):
+    """
+    EXPLAINs every query of the service functions that read or write
+    patient records against years of history, none of them may read a large
+    table sequentially
+    """
+
+    LARGE_TABLES = (
+        "credentials",
+        "patient_details",
+        "complaints",
+        "followups",
+        "diagnosis",
+        "discounts",
+        "patient_prescriptions",
+    )
+
+    def assertIndexedPlans(self, function, *args):
+        for plan in query_plans(function, *args):
+            for table in self.LARGE_TABLES:
+                self.assertNotIn(f"Seq Scan on {table} ", plan)
+
+    def test_read_plans(self):
+        complaint_id = self.complaint.id
+        calls = {
+            "fetch_all_patients": (),
+            "fetch_patients_with_phone_and_name": (9000000000, "Patient 0"),
+            "fetch_patients_with_phone": (9000000000,),
+            "fetch_patients_with_phone_prefix": (900000001,),
+            "fetch_complaint_and_followup_history": (self.patient.id,),
+            "fetch_complaint_detail": (complaint_id,),
+            "fetch_medical_details": ("Patient 0", 9000000000),
+            "fetch_diagnosis_by_complaint": (complaint_id,),
+            "fetch_complaints_by_date": (self.today,),
+            "fetch_followups_by_date": (self.today,),
+            "fetch_dashboard": (self.today,),
+            "fetch_discount": (complaint_id,),
+            "fetch_patients_prescriptions": (complaint_id, 0),
+            "fetch_followup_and_personal_data_for_prescription_pdf": (
+                complaint_id,
+                1,
+            ),
+        }
+        for name, args in calls.items():
+            with self.subTest(name):
+                self.assertIndexedPlans(getattr(services, name), *args)
+
+        # followups by complaint are returned as a lazy queryset
+        with self.subTest("fetch_followups_by_complaint"):
+            self.assertIndexedPlans(
+                lambda: list(services.fetch_followups_by_complaint(complaint_id))
+            )
+
+    def test_name_search_plan(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+            if cursor.fetchone() is None:
+                self.skipTest("pg_trgm is not installed")
+        self.assertIndexedPlans(services.fetch_patients_with_name, "Patient 12")
+
+    def test_write_plans(self):
+        """
+        Calls run in order on the seeded rows: creates, updates, deletes
+        """
+        complaint_id = self.complaint.id
+        followup = models.FollowUp.objects.get(complaint_id=complaint_id)
+        diagnosis = models.Diagnosis.objects.filter(complaint_id=complaint_id).first()
+        patient_prescription = models.PatientPrescription.objects.get(
+            complaint_id=complaint_id, sitting=1
+        )
+        medication = doc_models.Prescription.objects.get()
+        other_medication = doc_models.Prescription.objects.create(
+            name="Paracetamol", type="Tablet"
+        )
+        treatment = doc_models.Treatment.objects.get(name="RCT")
+        doc_models.Treatment.objects.create(name="Consultation", price=300)
+        # catalog reloads with the rows of this test
+        cache.clear()
+        calls = {
+            "create_diagnosis": (
+                {
+                    "complaint": complaint_id,
+                    "treatment": treatment.id,
+                    "tooth_number": 12,
+                },
+            ),
+            "create_diagnoses": (
+                [
+                    {
+                        "complaint": complaint_id,
+                        "treatment": treatment.id,
+                        "tooth_number": tooth_number,
+                    }
+                    for tooth_number in (13, 14)
+                ],
+            ),
+            "add_consultation": (complaint_id,),
+            "create_followup": (
+                str(complaint_id),
+                {
+                    "title": "Sitting 2",
+                    "description": "",
+                    "date": self.today,
+                    "time": None,
+                    "number": 2,
+                },
+            ),
+            "create_patient_prescription": (
+                {
+                    "complaint": complaint_id,
+                    "prescription": other_medication.id,
+                    "sitting": 2,
+                    "days": 3,
+                    "dosage": "OD",
+                },
+            ),
+            "finalize_sitting": (
+                {
+                    "complaint": complaint_id,
+                    "sitting": 1,
+                    "diagnoses": [{"treatment": treatment.id, "tooth_number": 15}],
+                    "prescriptions": [
+                        {"prescription": other_medication.id, "days": 5, "dosage": "BD"}
+                    ],
+                    "followup": {
+                        "title": "Sitting 3",
+                        "description": "",
+                        "date": self.today,
+                        "time": None,
+                        "number": 3,
+                    },
+                    "consultation": False,
+                    "discount": 300,
+                },
+            ),
+            "add_medical_details": (
+                {
+                    "identity": {"name": "Patient 0", "phonenumber": 9000000000},
+                    "medical_details": {
+                        "allergies": ["Penicillin"],
+                        "illnesses": [],
+                        "smoking": False,
+                        "tobacco": False,
+                        "drinking": False,
+                    },
+                },
+            ),
+            "update_diagnosis": (
+                {"id": diagnosis.id, "treatment": treatment.id, "tooth_number": 16},
+            ),
+            "update_followup": (
+                {
+                    "id": followup.id,
+                    "title": "Sitting 1",
+                    "description": "Done",
+                    "date": self.today,
+                    "time": None,
+                    "completed": True,
+                },
+            ),
+            "update_patients_prescription": (
+                {
+                    "id": patient_prescription.id,
+                    "prescription": medication.id,
+                    "days": 7,
+                    "dosage": "TDS",
+                },
+            ),
+            "create_or_update_discount": (
+                {"complaint": complaint_id, "discount": 200},
+            ),
+            "replace_patients_prescriptions": (
+                complaint_id,
+                0,
+                [{"prescription": medication.id, "days": 5, "dosage": "BD"}],
+            ),
+            "delete_patient_prescription": (patient_prescription.id,),
+            "delete_diagnosis": (diagnosis.id,),
+            "delete_followup": (followup.id,),
+        }
+        for name, args in calls.items():
+            with self.subTest(name):
+                self.assertIndexedPlans(getattr(services, name), *args)
@@ -0,0 +1,156 @@
+from django.core.cache import cache
+from django.db.models import Count, F, Max, Prefetch, Value
+from authentication.models import User
+from doctor.models import Prescription, Treatment
+from . import models
+import hashlib
+
+# ==============================NOTE====================================
+# A patient's whole chart (complaints with their diagnoses, discount,
+# followups and per-sitting prescriptions) assembled in a fixed number of
+# queries and cached per patient.
+# - Cache key of a chart is built from the row count and latest updated_at
+#   of every table it is built from (one UNION ALL query, read from the
+#   database), so a stale chart is never served by any server process,
+#   old entries simply expire
+# - Treatment and medication names are part of the chart, a rename changes
+#   the key too
+# - Writes that skip auto_now (bulk_update, queryset update) must set
+#   updated_at themselves
+TIMELINE_TTL = 60 * 60
+
+
+def chart_validators(patient_id):
+    """
+    [(table, count, latest updated_at)] of the patient's complaints, their
+    records and the treatments/medications, in one query
+    """
+    tables = (
+        models.Complaint.objects.filter(user_id=patient_id),
+        models.Diagnosis.objects.filter(complaint__user_id=patient_id),
+        models.FollowUp.objects.filter(complaint__user_id=patient_id),
+        models.PatientPrescription.objects.filter(complaint__user_id=patient_id),
+        models.Discount.objects.filter(complaint__user_id=patient_id),
+        Treatment.objects.all(),
+        Prescription.objects.all(),
+    )
+    aggregates = [
+        queryset.annotate(table=Value(table))
+        .values("table")
+        .annotate(count=Count("pk"), latest=Max("updated_at"))
+        .values_list("table", "count", "latest")
+        for table, queryset in enumerate(tables)
+    ]
+    return sorted(aggregates[0].union(*aggregates[1:], all=True))
+
+
+def complaint_records():
+    """
+    Prefetches for a complaint's diagnoses (with treatment_name), followups
+    and prescriptions (with prescription_name/type), one query each
+    """
+    return (
+        Prefetch(
+            "diagnosis_set",
+            queryset=models.Diagnosis.objects.annotate(
+                treatment_name=F("treatment__name")
+            ).order_by("tooth_number", "treatment_name"),
+        ),
+        Prefetch(
+            "followup_set",
+            queryset=models.FollowUp.objects.order_by("number"),
+        ),
+        Prefetch(
+            "patientprescription_set",
+            queryset=models.PatientPrescription.objects.annotate(
+                prescription_name=F("prescription__name"),
+                prescription_type=F("prescription__type"),
+            ).order_by("sitting", "prescription_name"),
+        ),
+    )
+
+
+def build_timeline(patient_id):
+    """
+    Four queries: complaints (with discount), diagnoses, followups and
+    prescriptions of every complaint
+    """
+    complaints = (
+        models.Complaint.objects.filter(user_id=patient_id)
+        .select_related("discount")
+        .prefetch_related(*complaint_records())
+        .order_by("-date", "-time", "-id")
+    )
+
+    timeline = []
+    for complaint in complaints:
+        prescriptions_by_sitting = {}
+        for prescription in complaint.patientprescription_set.all():
+            prescriptions_by_sitting.setdefault(prescription.sitting, []).append(
+                {
+                    "id": prescription.id,
+                    "prescription_id": prescription.prescription_id,
+                    "prescription_name": prescription.prescription_name,
+                    "prescription_type": prescription.prescription_type,
+                    "days": prescription.days,
+                    "dosage": prescription.dosage,
+                }
+            )
+        try:
+            discount = complaint.discount.discount
+        except models.Discount.DoesNotExist:
+            discount = None
+        timeline.append(
+            {
+                "id": complaint.id,
+                "complaint": complaint.complaint,
+                "date": complaint.date,
+                "time": complaint.time,
+                "discount": discount,
+                "diagnoses": [
+                    {
+                        "id": diagnosis.id,
+                        "tooth_number": diagnosis.tooth_number,
+                        "treatment": diagnosis.treatment_id,
+                        "treatment_name": diagnosis.treatment_name,
+                        "price": diagnosis.price,
+                    }
+                    for diagnosis in complaint.diagnosis_set.all()
+                ],
+                "prescriptions": prescriptions_by_sitting.get(0, []),
+                "followups": [
+                    {
+                        "id": followup.id,
+                        "number": followup.number,
+                        "title": followup.title,
+                        "date": followup.date,
+                        "time": followup.time,
+                        "completed": followup.completed,
+                        "prescriptions": prescriptions_by_sitting.get(
+                            followup.number, []
+                        ),
+                    }
+                    for followup in complaint.followup_set.all()
+                ],
+            }
+        )
+    return timeline
+
+
+def fetch_timeline(patient_id):
+    """
+    1. Invalid patient_id
+    2. Cached chart for the current validators
+    3. Chart built and cached
+    """
+    validators = chart_validators(patient_id)
+    # no complaints, may not be a patient at all
+    if not validators[0][1] and not User.objects.filter(id=patient_id).exists():
+        return None, "This patient does not exist"
+    digest = hashlib.sha256(repr(validators).encode("utf-8")).hexdigest()
+    key = f"patient_timeline:{patient_id}:{digest}"
+    timeline = cache.get(key)
+    if timeline is None:
+        timeline = build_timeline(patient_id)
+        cache.set(key, timeline, timeout=TIMELINE_TTL)
+    return timeline, None
@@ -6,10 +6,14 @@ urlpatterns = [
     path("medical_details/", views.medical_details),
     path("medical_details/<int:phonenumber>/<str:name>/", views.medical_details),
     path("complaints/", views.complaints),
+    path("dashboard/", views.dashboard),
+    path("waiting_list/events/", views.waiting_list_events),
+    path("complaint/<uuid:complaint_id>/", views.complaint_detail),
     path("followup/", views.followups),
     path("followup/<uuid:complaint_id>/", views.followups),
     path("followup/<str:date>/", views.followups),
     path("followup/delete/<uuid:followup_id>/", views.followups),
+    path("sitting/", views.sitting),
     path("diagnosis/", views.diagnosis),
     path("diagnosis/<uuid:complaint_id>/", views.diagnosis),
     path("diagnosis/delete/<uuid:id>/", views.diagnosis),
@@ -20,8 +24,13 @@ urlpatterns = [
     path("bill/discount/<uuid:complaint_id>/", views.bills),
     path("bill/discount/", views.bills),
     path("bill/consultation/", views.bills),
+    path("history/timeline/<uuid:patient_id>/", views.patient_timeline),
+    path("history/timeline/", views.patient_timeline),
     path("history/<uuid:patient_id>/", views.patient_history),
     path("history/", views.patient_history),
+    path("changes/", views.sync_changes),
+    path("directory/stats/", views.directory_stats),
+    path("", views.patients),
     path("<int:phonenumber>/", views.patients),
     path("<str:name>/", views.patients),
     path("<int:phonenumber>/<str:name>/", views.patients),
@@ -1,23 +1,30 @@
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework import permissions
 from rest_framework.response import Response
 from rest_framework import status
 from django.db import IntegrityError
 import datetime
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 import uuid
 from authentication import models as auth
-import authentication.jsonwebtokens as jsonwebtokens
+from authentication import jsonwebtokens
+import authentication.permissions as app_permissions
 import authentication.validation as validation
+from dentistAPI import conditional
 from .serializers import DetailsSerializer, ComplaintSerializer
 from . import serializers
+from . import directory
 from . import models
+from . import pagination
+from . import permissions
+from . import search
 from . import services
-from . import utils
+from . import timeline
+from . import waiting_list
+from . import changes
 
 
 @api_view(["GET"])
-@permission_classes((permissions.AllowAny,))
+@permission_classes((app_permissions.IsDentistOrAdmin,))
 def patients(request, phonenumber=None, name=None):
     """
     --------HERE NAME IN THE PATH SHOULD BE IN LOWERCASE-SNAKECASE--------
@@ -25,20 +32,29 @@ def patients(request, phonenumber=None, name=None):
     1. Name and Phonenumber
     2. Name
     3. Phonenumber
+    4. Phonenumber prefix (typeahead): p/<first digits>/?match=prefix&limit=10
+    5. Neither (p/): every patient, page by page
+
+    Query params:
+    - fields: comma separated subset of the patient fields, eg: fields=name,phonenumber
+    - limit: page size (1, 2, 5) or number of matches (4)
+    - cursor: "next" from the previous page (1, 3, 5)
+    Name searches (2) and prefix searches (4) are capped and return no "next"
     """
-    # Make sure user is admin or doctor
-    token, error = jsonwebtokens.is_authorized(
-        request.headers["Authorization"].split(" ")[1], set(["admin", "dentist"])
-    )
-    if error:
-        return Response(
-            {"error": error},
-            status=status.HTTP_401_UNAUTHORIZED,
-        )
-
     if request.method == "GET":
+        prefix_search = request.query_params.get("match") == "prefix" and not name
         # Convert data to proper format
-        if phonenumber:
+        if phonenumber and prefix_search:
+            is_valid_phonenumber: validation.FieldValidity = (
+                validation.validate_phonenumber_prefix(int(phonenumber))
+            )
+
+            if not is_valid_phonenumber["valid"]:
+                return Response(
+                    {"error": is_valid_phonenumber["error"]},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+        elif phonenumber:
             is_valid_phonenumber: validation.FieldValidity = (
                 validation.validate_phonenumber(int(phonenumber))
             )
@@ -51,41 +67,66 @@ def patients(request, phonenumber=None, name=None):
         if name:
             name = services.capitalize_name(name, snake_case=True)
 
-        patients, no_match_error = {}, ""
+        fields, error = pagination.select_fields(
+            request.query_params.get("fields"), services.PATIENT_FIELDS
+        )
+        if error:
+            return Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+        cursor_values = None
+        if request.query_params.get("cursor"):
+            cursor_values, error = pagination.decode_cursor(
+                request.query_params["cursor"], services.PATIENT_CURSOR
+            )
+            if error:
+                return Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+        limit = pagination.page_size(request.query_params.get("limit"))
+
+        patients, next_cursor, no_match_error = {}, None, ""
         if phonenumber and name:
-            patients, no_match_error = services.fetch_patients_with_phone_and_name(
-                phonenumber, name
+            patients, next_cursor, no_match_error = (
+                services.fetch_patients_with_phone_and_name(
+                    phonenumber, name, fields, cursor_values, limit
+                )
+            )
+        elif phonenumber and prefix_search:
+            patients, no_match_error = services.fetch_patients_with_phone_prefix(
+                phonenumber, fields, min(limit, search.SEARCH_LIMIT)
             )
         elif phonenumber:
-            patients, no_match_error = services.fetch_patients_with_phone(phonenumber)
+            patients, next_cursor, no_match_error = services.fetch_patients_with_phone(
+                phonenumber, fields, cursor_values, limit
+            )
         elif name:
-            patients, no_match_error = services.fetch_patients_with_name(name)
+            patients, no_match_error = services.fetch_patients_with_name(name, fields)
         else:
-            return Response(
-                {"error": "Provide atleast name or phonenumber to search"},
-                status=status.HTTP_400_BAD_REQUEST,
+            # Fetch all patients
+            patients, next_cursor = services.fetch_all_patients(
+                fields, cursor_values, limit
             )
         if no_match_error:
             return Response({"error": no_match_error}, status=status.HTTP_200_OK)
-        return Response({"patients": patients}, status=status.HTTP_200_OK)
-
-    # JWT authentication
-    token, error = jsonwebtokens.is_authorized(
-        request.headers["Authorization"].split(" ")[1], set(["dentist", "admin"])
-    )
-    if error:
         return Response(
-            {"error": error},
-            status=status.HTTP_401_UNAUTHORIZED,
+            {"patients": patients, "next": next_cursor}, status=status.HTTP_200_OK
         )
 
-    # Fetch all patients
-    all_patients = models.Details.objects.all().values_list()
-    return Response({"patients": all_patients}, status=status.HTTP_200_OK)
+
+@api_view(["GET"])
+@permission_classes((app_permissions.IsDentistOrAdmin,))
+def directory_stats(request):
+    """
+    Hit rate, size and approximate memory of this process's patient directory
+    """
+    return Response(
+        {
+            "enabled": directory.enabled(),
+            **directory.patient_directory.directory_stats(),
+        },
+        status=status.HTTP_200_OK,
+    )
 
 
 @api_view(["GET", "POST"])
-@permission_classes((permissions.AllowAny,))
+@permission_classes((permissions.DetailsPermission,))
 def details(request):
     """
     1. POST:
@@ -103,16 +144,6 @@ def details(request):
         Returns patient details using jwt data
     """
     if request.method == "POST":
-        # Make sure user is admin
-        token, error = jsonwebtokens.is_authorized(
-            request.headers["Authorization"].split(" ")[1], set(["admin", "dentist"])
-        )
-        if error:
-            return Response(
-                {"error": error},
-                status=status.HTTP_401_UNAUTHORIZED,
-            )
-
         # Case 2
         phonenumber = request.data.get("phonenumber")
         is_valid_phonenumber: validation.FieldValidity = (
@@ -156,44 +187,32 @@ def details(request):
             {"message": "Details have been registered"}, status=status.HTTP_200_OK
         )
     elif request.method == "GET":
-        try:
-            token = request.headers["Authorization"].split(" ")[1]
-        except (KeyError, IndexError):
-            return Response(
-                {"error": "Authorization token missing"},
-                status=status.HTTP_401_UNAUTHORIZED,
-            )
-
-        payload, error = jsonwebtokens.is_authorized(token, set(["patient"]))
-        if error:
-            return Response({"error": error}, status=status.HTTP_401_UNAUTHORIZED)
-
+        payload = request.auth
         if "phonenumber" not in payload:
             return Response({"error": "Phone number not found in token"}, status=400)
 
-        try:
-            user = auth.User.objects.get(
-                phonenumber=payload["phonenumber"], name=payload["name"]
-            )
-            details = models.Details.objects.get(id=user)
-            serialized = DetailsSerializer(details)
-            return Response(
-                {
-                    "phonenumber": user.phonenumber,
-                    "name": user.name,
-                    "role": user.role,
-                    "date_of_birth": serialized.data["date_of_birth"],
-                },
-                status=200,
-            )
-        except auth.User.DoesNotExist:
-            return Response({"error": "User not found"}, status=404)
-        except models.Details.DoesNotExist:
+        user_id, error = services.fetch_user_id_from_token(payload)
+        if error:
+            return Response({"error": error}, status=404)
+
+        error, details = services.fetch_details_object_by_id(user_id)
+        if error:
             return Response({"error": "User details not found"}, status=404)
+        user = details.id
+        serialized = DetailsSerializer(details)
+        return Response(
+            {
+                "phonenumber": user.phonenumber,
+                "name": user.name,
+                "role": user.role,
+                "date_of_birth": serialized.data["date_of_birth"],
+            },
+            status=200,
+        )
 
 
 @api_view(["GET", "POST"])
-@permission_classes((permissions.AllowAny,))
+@permission_classes((app_permissions.IsDentistOrAdmin,))
 def complaints(request):
     """
     GET REQUEST:
@@ -237,37 +256,28 @@ def complaints(request):
 
 
     """
-    # Make sure user is admin or dentist
-    token, error = jsonwebtokens.is_authorized(
-        request.headers["Authorization"].split(" ")[1], set(["admin", "dentist"])
-    )
-    if error:
-        return Response(
-            {"error": error},
-            status=status.HTTP_401_UNAUTHORIZED,
+    if request.method == "GET":
+        # ETag from today's count/latest update and the patients shown
+        today_date = datetime.datetime.now().date()
+        etag = conditional.make_etag(
+            today_date,
+            *conditional.aggregate(
+                models.Complaint.objects.filter(date=today_date),
+                "updated_at",
+                **services.entry_validators("user"),
+            ),
         )
+        not_modified = conditional.not_modified(request, etag=etag)
+        if not_modified:
+            return not_modified
 
-    if request.method == "GET":
         # Fetch active patients
-        all_complaints = models.Complaint.objects.select_related(
-            "user", "user__details"
-        ).filter(date=datetime.datetime.now().date())
-
-        complaints = []
-        for complaint in all_complaints:
-            complaints.append(
-                {
-                    "id": complaint.id,
-                    "patient_id": complaint.user.id,
-                    "name": complaint.user.name,
-                    "age": utils.get_age(complaint.user.details.date_of_birth),
-                    "phonenumber": complaint.user.phonenumber,
-                    "time": complaint.time,
-                    "complaint": complaint.complaint,
-                }
-            )
-
-        return Response({"complaints": complaints}, status=status.HTTP_200_OK)
+        complaints = services.fetch_complaints_by_date(today_date)
+        return Response(
+            {"complaints": complaints},
+            status=status.HTTP_200_OK,
+            headers=conditional.headers(etag),
+        )
 
     if request.method == "POST":
         # Validate phonenumber
@@ -292,7 +302,7 @@ def complaints(request):
         try:
             user = auth.User.objects.get(
                 phonenumber=phonenumber,
-                name=services.capitalize_name(serializer.data["name"]),
+                normalized_name=auth.normalize_name(serializer.data["name"]),
             )
         except auth.User.DoesNotExist:
             return Response(
@@ -315,8 +325,153 @@ def complaints(request):
         return Response({"message": "complaint registered"}, status=status.HTTP_200_OK)
 
 
+@api_view(["GET"])
+@permission_classes((app_permissions.IsDentistOrAdmin,))
+def dashboard(request):
+    """
+    Today's complaints and followups together, sorted by time
+    - sends an ETag, If-None-Match with it gets 304 NOT MODIFIED until a
+    complaint, followup or patient changes
+    Returns JSON:
+        {
+            "date": "2025-12-05",
+            "entries": [
+                {
+                    "type": "complaint" | "followup",
+                    "id": <complaint UUID>,
+                    "followup_id": <followup UUID> | null,
+                    "sitting": 0 for complaint, followup number otherwise,
+                    "patient_id", "name", "age", "phonenumber", "time",
+                    "complaint": <chief complaint>,
+                    "followup": <followup title> | null,
+                    "completed": <Bool>
+                }
+            ]
+        }
+    """
+    if request.method == "GET":
+        # ETag from today's count/latest update and the patients shown
+        today_date = datetime.datetime.now().date()
+        etag = conditional.make_etag(
+            today_date,
+            *conditional.aggregate(
+                models.Complaint.objects.filter(date=today_date),
+                "updated_at",
+                **services.entry_validators("user"),
+            ),
+            *conditional.aggregate(
+                models.FollowUp.objects.filter(date=today_date),
+                "updated_at",
+                **services.entry_validators("complaint__user", "complaint"),
+            ),
+        )
+        not_modified = conditional.not_modified(request, etag=etag)
+        if not_modified:
+            return not_modified
+
+        entries = services.fetch_dashboard(today_date)
+        return Response(
+            {"date": today_date, "entries": entries},
+            status=status.HTTP_200_OK,
+            headers=conditional.headers(etag),
+        )
+
+
+async def waiting_list_events(request):
+    """
+    Live waiting list for the admin/dentist dashboards (server-sent events),
+    replaces polling complaints GET and followups GET
+    - Token in "Authorization: Bearer <token>" or ?token=<token> (EventSource
+    can't send headers)
+    - 401 UNAUTHORIZED: Token missing, invalid or not admin/dentist
+    - 405 METHOD NOT ALLOWED: Anything but GET
+    Events:
+        snapshot: {complaints: [...], followups: [...]} on connect (and
+        whenever changes may have been missed)
+        complaint: {id: <complaint UUID>, entry: <row> | null}
+        followup: {id: <followup UUID>, entry: <row> | null}
+        null entry: row is no longer on today's list
+    """
+    if request.method != "GET":
+        return JsonResponse(
+            {"error": f'Method "{request.method}" not allowed.'},
+            status=status.HTTP_405_METHOD_NOT_ALLOWED,
+        )
+    header = request.headers.get("Authorization", "").split()
+    token = header[1] if len(header) == 2 else request.GET.get("token")
+    if not token:
+        return JsonResponse(
+            {"error": "Authorization token missing"},
+            status=status.HTTP_401_UNAUTHORIZED,
+        )
+    _, error = jsonwebtokens.is_authorized(token, ["admin", "dentist"])
+    if error:
+        return JsonResponse({"error": error}, status=status.HTTP_401_UNAUTHORIZED)
+
+    return StreamingHttpResponse(
+        waiting_list.stream(),
+        content_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@api_view(["GET"])
+@permission_classes((app_permissions.IsDentist,))
+def complaint_detail(request, complaint_id=None):
+    """
+    Sitting screen in one request: the complaint with its patient, diagnoses,
+    followups, prescriptions of every sitting ({sitting: [...]}) and discount
+    - 404 NOT FOUND: Invalid complaint
+    """
+    if request.method == "GET":
+        detail, error = services.fetch_complaint_detail(complaint_id)
+        if error:
+            return Response({"error": error}, status=status.HTTP_404_NOT_FOUND)
+        return Response(detail, status=status.HTTP_200_OK)
+
+
+@api_view(["POST"])
+@permission_classes((app_permissions.IsDentist,))
+def sitting(request):
+    """
+    Finalize a sitting: everything the dentist entered, saved together or not
+    at all
+    Expected JSON:
+    {
+        "complaint": <UUID>,
+        "sitting": 0 (complaint) | followup number,
+        "diagnoses": [{"treatment": <UUID>, "tooth_number": 44}],
+        "prescriptions": [{"prescription": <UUID>, "days": 3, "dosage": "OD"}],
+        "followup": {followup JSON of followup/ POST} (optional, next sitting),
+        "discount": 1000 (optional),
+        "consultation": true (optional)
+    }
+    - 400 BAD REQUEST: Invalid fields
+    - 404 NOT FOUND: Invalid complaint/followup
+    - 409 CONFLICT: {"error", "conflicts": [{"field", "index", "error"}]}
+    """
+    if request.method == "POST":
+        sitting_serializer = serializers.SittingSerializer(data=request.data)
+        if not sitting_serializer.is_valid():
+            return Response(
+                {"error": "Invalid fields, check all fields properly"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        saved, conflicts, error, error_code = services.finalize_sitting(
+            sitting_serializer.validated_data
+        )
+        if conflicts:
+            return Response({"error": error, "conflicts": conflicts}, status=error_code)
+        if error:
+            return Response({"error": error}, status=error_code)
+        return Response(
+            {"success": "Sitting has been saved!", "saved": saved},
+            status=status.HTTP_201_CREATED,
+        )
+
+
 @api_view(["GET", "POST", "PUT", "DELETE"])
-@permission_classes((permissions.AllowAny,))
+@permission_classes((app_permissions.IsDentist,))
 def diagnosis(request, complaint_id=None, id=None):
     """
     1. GET: fetch by complaint_id
@@ -327,6 +482,8 @@ def diagnosis(request, complaint_id=None, id=None):
         "complaint": "1002931f-d1b3-4408-9147-2e3432c67cc2",
         "tooth_number": 44
     }
+    or a list of them, the ones that can be saved are, the rest come back in
+    "conflicts": [{"field", "index", "error"}] (409 CONFLICT if none saved)
     3. PUT: change treatment (tooth no. change not possible only according to UI)
     Expected JSON:
     {
@@ -336,13 +493,6 @@ def diagnosis(request, complaint_id=None, id=None):
     }
     4. DELETE: deleting diagnosis for a tooth
     """
-    if request.method == "GET":
-        token, error = jsonwebtokens.is_authorized(
-            request.headers.get("Authorization").split(" ")[1],
-            set(["dentist"]),
-        )
-        if error:
-            return Response({"error": error}, status=status.HTTP_401_UNAUTHORIZED)
     if request.method == "GET":
         if complaint_id:
             diagnoses = services.fetch_diagnosis_by_complaint(complaint_id)
@@ -354,6 +504,33 @@ def diagnosis(request, complaint_id=None, id=None):
         )
 
     elif request.method == "POST":
+        if isinstance(request.data, list):
+            # many teeth at once, saves what it can and lists the rest
+            diagnoses_serializer = serializers.DiagnosisSerializer(
+                data=request.data, many=True
+            )
+            if not diagnoses_serializer.is_valid():
+                return Response(
+                    {"error": "Invalid fields, check all fields properly"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            saved, conflicts, error, error_status = services.create_diagnoses(
+                diagnoses_serializer.validated_data
+            )
+            if error:
+                return Response({"error": error}, status=error_status)
+            if not saved and conflicts:
+                return Response(
+                    {"error": "No diagnosis was saved", "conflicts": conflicts},
+                    status=status.HTTP_409_CONFLICT,
+                )
+            return Response(
+                {
+                    "message": f"{saved} diagnoses have been saved!",
+                    "conflicts": conflicts,
+                }
+            )
+
         # serialize incoming data
         diagnosis_serializer = serializers.DiagnosisSerializer(data=request.data)
         if not diagnosis_serializer.is_valid():
@@ -391,7 +568,7 @@ def diagnosis(request, complaint_id=None, id=None):
 
 
 @api_view(["GET", "POST", "PUT", "DELETE"])
-@permission_classes((permissions.AllowAny,))
+@permission_classes((permissions.FollowupsPermission,))
 def followups(request, complaint_id=None, date=None, followup_id=None):
     """
     1. GET:
@@ -426,41 +603,53 @@ def followups(request, complaint_id=None, date=None, followup_id=None):
     }
     """
     if request.method == "GET":
-        token, error = jsonwebtokens.is_authorized(
-            request.headers.get("Authorization").split(" ")[1],
-            set(["dentist", "admin"]),
-        )
-        if error:
-            return Response({"error": error}, status=status.HTTP_401_UNAUTHORIZED)
-
         # fetching followups for patient's complaint
         if complaint_id:
+            # count/latest update of the complaint's followups
+            etag = conditional.make_etag(
+                complaint_id,
+                *conditional.aggregate(
+                    models.FollowUp.objects.filter(complaint_id=complaint_id),
+                    "updated_at",
+                ),
+            )
+            not_modified = conditional.not_modified(request, etag=etag)
+            if not_modified:
+                return not_modified
+
             # the url already verifies that UUID is valid so no checking needed
             # fetch all followups for that complaint_id
             past_followups = services.fetch_followups_by_complaint(complaint_id)
             return Response(
                 {"followups": past_followups},
                 status=status.HTTP_200_OK,
+                headers=conditional.headers(etag),
             )
-        if date:
-            # fetching followups for a particular date
-            today_followups = services.fetch_followups_by_date(date)
-            return Response({"followups": today_followups}, status=status.HTTP_200_OK)
 
-        # fetching followups for dashboard
-        today_date = datetime.datetime.now().date()
-        today_followups = services.fetch_followups_by_date(today_date)
-        return Response({"followups": today_followups}, status=status.HTTP_200_OK)
+        # fetching followups for a particular date, or for dashboard (today)
+        if not date:
+            date = datetime.datetime.now().date()
+        etag = conditional.make_etag(
+            str(date),
+            *conditional.aggregate(
+                models.FollowUp.objects.filter(date=date),
+                "updated_at",
+                **services.entry_validators("complaint__user", "complaint"),
+            ),
+        )
+        not_modified = conditional.not_modified(request, etag=etag)
+        if not_modified:
+            return not_modified
 
-    # FOR POST AND PUT you need to be dentist
-    token, error = jsonwebtokens.is_authorized(
-        request.headers.get("Authorization").split(" ")[1],
-        set(["dentist"]),
-    )
-    if error:
-        return Response({"error": error}, status=status.HTTP_401_UNAUTHORIZED)
+        followups_for_date = services.fetch_followups_by_date(date)
+        return Response(
+            {"followups": followups_for_date},
+            status=status.HTTP_200_OK,
+            headers=conditional.headers(etag),
+        )
 
-    elif request.method == "POST":
+    # FOR POST, PUT and DELETE you need to be dentist (FollowupsPermission)
+    if request.method == "POST":
         followup_serializer = serializers.FollowupSerializer(
             data=request.data["followup"]
         )
@@ -495,12 +684,6 @@ def followups(request, complaint_id=None, date=None, followup_id=None):
             {"success": "Followup has been updated"}, status=status.HTTP_200_OK
         )
     if request.method == "DELETE":
-        token, error = jsonwebtokens.is_authorized(
-            request.headers.get("Authorization").split(" ")[1],
-            set(["dentist"]),
-        )
-        if error:
-            return Response({"error": error}, status=status.HTTP_401_UNAUTHORIZED)
         if not followup_id:
             return Response(
                 {"error": "Invalid followup, it does not exist"},
@@ -508,18 +691,21 @@ def followups(request, complaint_id=None, date=None, followup_id=None):
             )
         # check if followup_id is valid uuid (already checked in the URL so no need to)
         # add function that deletes the followup and returns error and code
-        number, error, status_code = services.delete_followup(followup_id)
+        number, names, error, status_code = services.delete_followup(followup_id)
         if error:
             return Response({"error": error}, status=status_code)
         # return success
         return Response(
-            {"success": f"Followup no. {number} deleted successfully"},
+            {
+                "success": f"Followup no. {number} deleted successfully",
+                "prescriptions_deleted": names,
+            },
             status=status.HTTP_200_OK,
         )
 
 
 @api_view(["GET", "POST"])
-@permission_classes((permissions.AllowAny,))
+@permission_classes((permissions.MedicalDetailsPermission,))
 def medical_details(request, name=None, phonenumber=None):
     """
 
@@ -552,12 +738,11 @@ def medical_details(request, name=None, phonenumber=None):
         # Case when doctor is viewing patient's medical_details
         data = {}  # Empty init for scope adjustment
         if phonenumber and name:
-            token, error = jsonwebtokens.is_authorized(
-                request.headers.get("Authorization").split(" ")[1],
-                set(["dentist"]),
-            )
-            if error:
-                return Response({"error": error}, status=status.HTTP_401_UNAUTHORIZED)
+            if request.auth.get("role") != "dentist":
+                return Response(
+                    {"error": "You are unauthorized"},
+                    status=status.HTTP_401_UNAUTHORIZED,
+                )
 
             name = services.capitalize_name(name, snake_case=True)
             data, error = services.serialize_identity(
@@ -569,31 +754,42 @@ def medical_details(request, name=None, phonenumber=None):
         # Case when patient is viewing their own medical_details
         else:
             # Here we are only interested in getting token, not authorization
-            token, error = jsonwebtokens.is_authorized(
-                request.headers.get("Authorization").split(" ")[1],
-            )
+            token = request.auth
             data, error = services.serialize_identity(
                 {"name": token.get("name"), "phonenumber": token.get("phonenumber")}
             )
             if error:
                 return Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+            data["user_id"] = token.get("user_id")
+
+        # ETag from the details row, the user_id is needed for it anyway
+        user_id, error = services.fetch_user_id_from_token(data)
+        if error:
+            return Response({"error": error}, status=status.HTTP_404_NOT_FOUND)
+        etag = conditional.make_etag(
+            user_id,
+            *conditional.aggregate(
+                models.Details.objects.filter(id=user_id), "updated_at"
+            ),
+        )
+        not_modified = conditional.not_modified(request, etag=etag)
+        if not_modified:
+            return not_modified
 
         medical_details, error = services.fetch_medical_details(
             data["name"],
             data["phonenumber"],
+            user_id=user_id,
         )
         if error:
             return Response({"error": error}, status=status.HTTP_404_NOT_FOUND)
-        return Response({"medical_details": medical_details}, status=status.HTTP_200_OK)
-
-    if request.method == "POST":
-        token, error = jsonwebtokens.is_authorized(
-            request.headers.get("Authorization").split(" ")[1],
-            set(["dentist"]),
+        return Response(
+            {"medical_details": medical_details},
+            status=status.HTTP_200_OK,
+            headers=conditional.headers(etag),
         )
-        if error:
-            return Response({"error": error}, status=status.HTTP_401_UNAUTHORIZED)
 
+    if request.method == "POST":
         data, error = services.serialize_medical_details(request.data)
         if error:
             return Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
@@ -608,52 +804,133 @@ def medical_details(request, name=None, phonenumber=None):
         )
 
 
+def history_patient_id(token, patient_id=None):
+    """
+    Whose history is being asked for
+    1. patient_id given: admin/doctor look for patient of their own choice
+    2. Not given: patient sees their own history
+    """
+    if patient_id:
+        if token.get("role") not in set(["dentist", "admin"]):
+            return None, "You are unauthorized", status.HTTP_401_UNAUTHORIZED
+        return patient_id, None, None
+
+    if token.get("role") != "patient":
+        return None, "You are unauthorized", status.HTTP_401_UNAUTHORIZED
+    patient_id, error = services.fetch_user_id_from_token(token)
+    if error:
+        return None, error, status.HTTP_404_NOT_FOUND
+    return patient_id, None, None
+
+
 @api_view(["GET", "POST"])
-@permission_classes((permissions.AllowAny,))
+@permission_classes((app_permissions.IsAuthenticatedRole,))
 def patient_history(request, patient_id=None):
     """
     Get list of all complaints and followups for a particular patient
+    - latest complaint first, paged like p/: ?limit= and ?cursor=<"next">
     """
     if request.method == "GET":
-        if patient_id:
-            print("control went here")
-            # case where admin/doctor look for patient of their own choice
-            token, error = jsonwebtokens.is_authorized(
-                request.headers.get("Authorization").split(" ")[1],
-                set(["dentist", "admin"]),
+        patient_id, error, error_status = history_patient_id(request.auth, patient_id)
+        if error:
+            return Response({"error": error}, status=error_status)
+
+        cursor_values = None
+        if request.query_params.get("cursor"):
+            cursor_values, error = pagination.decode_cursor(
+                request.query_params["cursor"], services.HISTORY_CURSOR
             )
             if error:
-                return Response({"error": error}, status=status.HTTP_401_UNAUTHORIZED)
-        else:
-            print("hello")
-            # case where patient sees their own history
-            token, error = jsonwebtokens.is_authorized(
-                request.headers.get("Authorization").split(" ")[1],
-                set(["patient"]),
+                return Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+        limit = pagination.page_size(request.query_params.get("limit"))
+
+        patient_history, next_cursor, error = (
+            services.fetch_complaint_and_followup_history(
+                patient_id, cursor_values, limit
+            )
+        )
+        if error:
+            return Response({"error": error}, status=status.HTTP_404_NOT_FOUND)
+        return Response(
+            {"history": patient_history, "next": next_cursor},
+            status=status.HTTP_200_OK,
+        )
+
+
+@api_view(["GET"])
+@permission_classes((app_permissions.IsAuthenticatedRole,))
+def patient_timeline(request, patient_id=None):
+    """
+    Whole chart of a patient in one response: every complaint (latest first)
+    with its diagnoses, discount, prescriptions (sitting 0) and followups with
+    their prescriptions
+    """
+    if request.method == "GET":
+        patient_id, error, error_status = history_patient_id(request.auth, patient_id)
+        if error:
+            return Response({"error": error}, status=error_status)
+
+        patient_timeline, error = timeline.fetch_timeline(patient_id)
+        if error:
+            return Response({"error": error}, status=status.HTTP_404_NOT_FOUND)
+        return Response({"timeline": patient_timeline}, status=status.HTTP_200_OK)
+
+
+@api_view(["GET"])
+@permission_classes((app_permissions.IsDentistOrAdmin,))
+def sync_changes(request):
+    """
+    Delta sync: records inserted, updated or deleted after a cursor, across
+    credentials, patient_details, complaints, followups, diagnosis,
+    patient_prescriptions and discounts
+    - ?since=<cursor> (left out for everything), ?limit=<n> (at most 500)
+    - Keep calling with the returned cursor while "more" is true, then poll
+    - 400 BAD REQUEST: Invalid cursor, Invalid limit
+    Returns JSON:
+        {
+            "changes": [
+                {
+                    "table": "complaints",
+                    "id": <UUID>,
+                    "deleted": false,
+                    "row": {...} (null when deleted)
+                }
+            ],
+            "cursor": <String>,
+            "more": false
+        }
+    """
+    if request.method == "GET":
+        cursor_values = None
+        since = request.query_params.get("since")
+        if since:
+            cursor_values, error = pagination.decode_cursor(
+                since, changes.CHANGES_CURSOR
             )
             if error:
-                return Response({"error": error}, status=status.HTTP_401_UNAUTHORIZED)
-
-            try:
-                patient_id = auth.User.objects.get(
-                    name=services.capitalize_name(token["name"]),
-                    phonenumber=token["phonenumber"],
-                ).id
-            except auth.User.DoesNotExist:
                 return Response(
-                    {"error": "User not found"}, status=status.HTTP_404_NOT_FOUND
+                    {"error": "Invalid cursor"}, status=status.HTTP_400_BAD_REQUEST
                 )
+        try:
+            limit = int(request.query_params.get("limit", changes.CHANGES_LIMIT))
+        except ValueError:
+            limit = 0
+        if limit < 1:
+            return Response(
+                {"error": "Invalid limit"}, status=status.HTTP_400_BAD_REQUEST
+            )
 
-        patient_history, error = services.fetch_complaint_and_followup_history(
-            patient_id
+        change_list, cursor, more = changes.fetch_changes(
+            cursor_values, min(limit, changes.CHANGES_LIMIT)
+        )
+        return Response(
+            {"changes": change_list, "cursor": cursor, "more": more},
+            status=status.HTTP_200_OK,
         )
-        if error:
-            return Response({"error": error}, status=status.HTTP_404_NOT_FOUND)
-        return Response({"history": patient_history}, status=status.HTTP_200_OK)
 
 
 @api_view(["GET", "POST", "PUT"])
-@permission_classes((permissions.AllowAny,))
+@permission_classes((app_permissions.IsDentist,))
 def bills(request, complaint_id=None):
     """
     1. GET /p/bill/discount/<uuid:complain_id>: get discount if present
@@ -671,13 +948,6 @@ def bills(request, complaint_id=None):
     }
     """
 
-    token, error = jsonwebtokens.is_authorized(
-        request.headers.get("Authorization").split(" ")[1],
-        set(["dentist"]),
-    )
-    if error:
-        return Response({"error": error}, status=status.HTTP_401_UNAUTHORIZED)
-
     if request.method == "GET":
         if not complaint_id:
             return Response(
@@ -732,7 +1002,7 @@ def bills(request, complaint_id=None):
 
 
 @api_view(["GET", "POST", "PUT", "DELETE"])
-@permission_classes((permissions.AllowAny,))
+@permission_classes((app_permissions.IsDentist,))
 def prescription(
     request, patient_prescription_id=None, complaint_id=None, sitting=None
 ):
@@ -755,15 +1025,13 @@ def prescription(
         "days": 3,
         "dosage": "OD"
     }
+    PUT prescription/<complaint_id>/<sitting>/: the complete prescription of
+    that sitting, what isn't in the list is removed
+    [
+        {"prescription": prescription_id, "days": 3, "dosage": "OD"}
+    ]
     4. DELETE using user_prescription_id
     """
-    token, error = jsonwebtokens.is_authorized(
-        request.headers.get("Authorization").split(" ")[1],
-        set(["dentist"]),
-    )
-    if error:
-        return Response({"error": error}, status=status.HTTP_401_UNAUTHORIZED)
-
     if request.method == "GET":
         if not complaint_id or sitting is None:
             return Response(
@@ -795,6 +1063,23 @@ def prescription(
             return Response({"error": error}, status=error_code)
         return Response({"success": "Saved prescription!"})
 
+    if request.method == "PUT" and complaint_id:
+        # replace the whole prescription of the sitting
+        prescriptions_serializer = serializers.SittingPrescriptionSerializer(
+            data=request.data, many=True
+        )
+        if not prescriptions_serializer.is_valid():
+            return Response(
+                {"error": "Invalid field, check all fields properly"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        counts, error, error_code = services.replace_patients_prescriptions(
+            complaint_id, sitting, prescriptions_serializer.validated_data
+        )
+        if error:
+            return Response({"error": error}, status=error_code)
+        return Response({"success": "Saved prescription!", "changes": counts})
+
     if request.method == "PUT":
         # serialize data
         patient_prescription_update_serializer = (
@@ -821,19 +1106,12 @@ def prescription(
 
 
 @api_view(["GET"])
-@permission_classes((permissions.AllowAny,))
+@permission_classes((app_permissions.IsDentist,))
 def pdf_prescription(request, complaint_id=None, sitting=None):
     """
     Generates a pdf prescription for a sitting
     """
 
-    token, error = jsonwebtokens.is_authorized(
-        request.headers.get("Authorization").split(" ")[1],
-        set(["dentist"]),
-    )
-    if error:
-        return Response({"error": error}, status=status.HTTP_401_UNAUTHORIZED)
-
     if request.method == "GET":
         if not complaint_id or sitting is None:
             return Response(
@@ -0,0 +1,192 @@
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, connections
+from . import services
+import asyncio
+import datetime
+import json
+import select
+import threading
+import time
+
+# ==============================NOTE====================================
+# Live waiting list pushed to the dashboards as server-sent events.
+# - signals.py NOTIFYs the waiting_list channel after every committed
+#   Complaint/FollowUp write (Postgres delivers it to every server process)
+#   A failed NOTIFY is logged and skipped, the write is already committed
+# - Each process runs one listener thread (own connection, LISTEN) while it
+#   has subscribers. It builds the changed row once and hands it to every
+#   open stream of the process, streams never query per change
+# - A stream starts with a "snapshot" (same rows as complaints/followups
+#   GET), then gets "complaint"/"followup" events: {"id", "entry"} where
+#   entry is the row or null when it left today's list
+# - Listener errors, reconnects and slow clients get a fresh snapshot since
+#   changes may have been missed
+# - Needs an ASGI server (dentistAPI/asgi.py), every stream is one
+#   long-lived request
+CHANNEL = "waiting_list"
+HEARTBEAT_INTERVAL = 15
+POLL_TIMEOUT = 5
+RECONNECT_DELAY = 3
+QUEUE_SIZE = 100
+RESYNC = "resync"
+
+
+def notify(kind, row_id):
+    """
+    kind: complaint | followup
+    """
+    payload = json.dumps({"kind": kind, "id": str(row_id)})
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_notify(%s, %s)", [CHANNEL, payload])
+
+
+def snapshot():
+    today_date = datetime.datetime.now().date()
+    return {
+        "complaints": services.fetch_complaints_by_date(today_date),
+        "followups": services.fetch_followups_by_date(today_date),
+    }
+
+
+def build_event(payload):
+    """
+    Changed row if it is (still) on today's waiting list, None otherwise
+    """
+    today_date = datetime.datetime.now().date()
+    row_id = payload["id"]
+    if payload["kind"] == "complaint":
+        complaint = (
+            services.complaints_with_patient()
+            .filter(id=row_id, date=today_date)
+            .first()
+        )
+        entry = services.complaint_entry(complaint) if complaint else None
+    else:
+        followup = (
+            services.followups_with_patient().filter(id=row_id, date=today_date).first()
+        )
+        entry = services.followup_entry(followup) if followup else None
+    return {"event": payload["kind"], "data": {"id": row_id, "entry": entry}}
+
+
+def format_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
+
+
+def deliver(queue, event):
+    """
+    Runs on the stream's event loop
+    - Queue full (client not reading): drop what's queued and resync
+    """
+    try:
+        queue.put_nowait(event)
+    except asyncio.QueueFull:
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(RESYNC)
+
+
+class WaitingListHub:
+    """
+    subscribers: queue of an open stream -> its event loop
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = {}
+        self.thread = None
+        self.stats = {"notifications": 0, "errors": 0}
+
+    def subscribe(self):
+        queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        with self.lock:
+            self.subscribers[queue] = asyncio.get_running_loop()
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.listen, name="waiting-list-listener", daemon=True
+                )
+                self.thread.start()
+        return queue
+
+    def unsubscribe(self, queue):
+        with self.lock:
+            self.subscribers.pop(queue, None)
+
+    def publish(self, event):
+        with self.lock:
+            subscribers = list(self.subscribers.items())
+        for queue, loop in subscribers:
+            try:
+                loop.call_soon_threadsafe(deliver, queue, event)
+            except RuntimeError:
+                # event loop is closed, the stream is gone
+                self.unsubscribe(queue)
+
+    def listen(self):
+        """
+        Listener thread, exits once the last stream is closed
+        """
+        while True:
+            try:
+                if not self.listen_until_idle():
+                    return
+            except Exception:
+                self.stats["errors"] += 1
+                connection.close()
+                time.sleep(RECONNECT_DELAY)
+            # notifications may have been missed
+            self.publish(RESYNC)
+
+    def listen_until_idle(self):
+        """
+        Returns False once there are no subscribers left
+        """
+        wrapper = connections["default"]
+        listener = wrapper.get_new_connection(wrapper.get_connection_params())
+        try:
+            listener.autocommit = True
+            with listener.cursor() as cursor:
+                cursor.execute(f"LISTEN {CHANNEL}")
+            while True:
+                with self.lock:
+                    if not self.subscribers:
+                        self.thread = None
+                        return False
+                if select.select([listener], [], [], POLL_TIMEOUT) == ([], [], []):
+                    continue
+                listener.poll()
+                while listener.notifies:
+                    notification = listener.notifies.pop(0)
+                    self.stats["notifications"] += 1
+                    self.publish(build_event(json.loads(notification.payload)))
+        finally:
+            listener.close()
+            connection.close()
+
+
+hub = WaitingListHub()
+
+
+async def stream():
+    """
+    Event stream of one client, subscribed before the snapshot is taken so
+    no change falls in between
+    """
+    queue = hub.subscribe()
+    try:
+        yield f"retry: {RECONNECT_DELAY * 1000}\n\n"
+        yield format_event("snapshot", await sync_to_async(snapshot)())
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                # comment line, keeps proxies from closing an idle stream
+                yield ": heartbeat\n\n"
+                continue
+            if event == RESYNC:
+                yield format_event("snapshot", await sync_to_async(snapshot)())
+            else:
+                yield format_event(event["event"], event["data"])
+    finally:
+        hub.unsubscribe(queue)